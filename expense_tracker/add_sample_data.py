@@ -1,13 +1,23 @@
 from app import create_app
-from models import db, Expense, Category, User
+from models import db, Expense, Category, User, Budget, DailyCategoryTotal, MonthlyCategoryTotal
+import rollups
+import shards
+from commands import init_database
+from category_cache import category_cache
 from datetime import datetime, timedelta
 import random
 
 def add_sample_data():
     app = create_app()
     with app.app_context():
+        init_database()
+        
         # Clear existing data
-        Expense.query.delete()
+        for _ in shards.each():
+            DailyCategoryTotal.query.delete()
+            MonthlyCategoryTotal.query.delete()
+            Expense.query.delete()
+        Budget.query.delete()
         Category.query.delete()
         
         # Create a test user if not exists
@@ -17,6 +27,8 @@ def add_sample_data():
             user.set_password('demo123')
             db.session.add(user)
             db.session.commit()
+        if shards.enabled():
+            shards.use_user(user.id)
 
         # Create categories
         categories = [
@@ -31,6 +43,7 @@ def add_sample_data():
         
         for category in categories:
             db.session.add(category)
+        category_cache.invalidate()
         db.session.commit()
 
         # Sample expenses for the last 30 days
@@ -83,6 +96,7 @@ def add_sample_data():
                 user_id=user.id
             )
             db.session.add(expense)
+            rollups.record_added(expense)
 
         db.session.commit()
         print("Sample data added successfully!")
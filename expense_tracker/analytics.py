@@ -0,0 +1,210 @@
+"""Per-user spending analytics computed on NumPy arrays.
+
+A user's expenses are loaded once as parallel arrays (day, cents, category
+code, id), archived years included, and kept in a per-worker LRU bounded
+by ANALYTICS_CACHE_BYTES. Every expense write bumps the user's data
+version (see rollups.py), so a cached copy is reloaded on the first
+request after a change, whichever worker made it.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from models import db
+from versions import DATA_EPOCH, get_versions, user_data_version
+import archive
+
+ROLLING_DAYS = 30
+PERCENTILES = (50, 75, 90, 95, 99)
+# Modified z-score above which a spend counts as unusual for its category
+# (Iglewicz and Hoaglin), and the history a category needs before it is judged
+ANOMALY_SCORE = 3.5
+ANOMALY_MIN_EXPENSES = 8
+ANOMALY_LIMIT = 50
+
+
+class UserArrays:
+    """One user's expenses as column arrays, sorted by day"""
+
+    def __init__(self, days, cents, codes, ids, categories):
+        self.days = days
+        self.cents = cents
+        self.codes = codes
+        self.ids = ids
+        self.categories = categories
+
+    @classmethod
+    def load(cls, user_id):
+        expenses, conditions = archive.source(lambda expenses: [expenses.user_id == user_id], archive.catalog())
+        rows = db.session.execute(
+            select(expenses.date, expenses.amount_cents, expenses.category, expenses.id)
+            .where(*conditions).order_by(expenses.date, expenses.id)
+        ).all()
+        if not rows:
+            return cls(np.empty(0, 'datetime64[D]'), np.empty(0, np.int64), np.empty(0, np.int32),
+                       np.empty(0, np.int64), [])
+        days, cents, names, ids = zip(*rows)
+        categories, codes = np.unique(np.array(names, dtype=object), return_inverse=True)
+        return cls(np.array(days, dtype='datetime64[D]'), np.array(cents, dtype=np.int64),
+                   codes.astype(np.int32), np.array(ids, dtype=np.int64), [str(name) for name in categories])
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.cents.nbytes + self.codes.nbytes + self.ids.nbytes
+
+
+class AnalyticsCache:
+    """Per-worker LRU of UserArrays, checked against the user's data version"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, user_id):
+        names = [user_data_version(user_id), DATA_EPOCH]
+        versions = get_versions(names)
+        version = tuple(versions[name][0] for name in names)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        arrays = UserArrays.load(user_id)
+        max_bytes = current_app.config['ANALYTICS_CACHE_BYTES']
+        with self._lock:
+            self._discard(user_id)
+            # A user bigger than the whole budget is computed but not kept
+            if arrays.nbytes <= max_bytes:
+                self._entries[user_id] = (version, arrays)
+                self._bytes += arrays.nbytes
+                while self._bytes > max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+        return arrays
+
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+analytics_cache = AnalyticsCache()
+
+
+def _dollars(cents):
+    return np.round(np.asarray(cents, dtype=np.float64) / 100, 2).tolist()
+
+
+def _month_start(months_back, today):
+    month = np.datetime64(today, 'M') - (months_back - 1)
+    return month.astype('datetime64[D]')
+
+
+def rolling_average(arrays, start, end):
+    """Average daily spend over the ROLLING_DAYS ending on each day in [start, end]"""
+    first = start - (ROLLING_DAYS - 1)
+    mask = (arrays.days >= first) & (arrays.days <= end)
+    length = int((end - first).astype(int)) + 1
+    daily = np.bincount((arrays.days[mask] - first).astype(np.int64), weights=arrays.cents[mask], minlength=length)
+    running = np.concatenate(([0.0], np.cumsum(daily)))
+    averages = (running[ROLLING_DAYS:] - running[:-ROLLING_DAYS]) / ROLLING_DAYS
+    days = np.arange(start, end + 1, dtype='datetime64[D]')
+    return [{'date': str(day), 'average': amount} for day, amount in zip(days, _dollars(averages))]
+
+
+def monthly(arrays, start, end):
+    """Totals, month-over-month changes and category shares per month in [start, end]"""
+    # One month before the range so its first month has a change too
+    first = np.datetime64(start, 'M') - 1
+    months = np.arange(first, np.datetime64(end, 'M') + 1)
+    mask = (arrays.days >= first.astype('datetime64[D]')) & (arrays.days <= end)
+    index = (arrays.days[mask].astype('datetime64[M]') - first).astype(np.int64)
+    width = max(len(arrays.categories), 1)
+    # bincount only returns floats when it was given any weights at all
+    table = np.bincount(index * width + arrays.codes[mask], weights=arrays.cents[mask],
+                        minlength=len(months) * width).astype(np.float64).reshape(len(months), width)
+    totals = table.sum(axis=1)
+    change = np.diff(totals)
+    previous = totals[:-1]
+    percent = np.divide(change * 100, previous, out=np.full_like(change, np.nan), where=previous > 0)
+    shares = np.divide(table[1:], totals[1:, None], out=np.zeros_like(table[1:]), where=totals[1:, None] > 0)
+
+    result = []
+    for row, month in enumerate(months[1:]):
+        result.append({
+            'month': str(month),
+            'total': _dollars(totals[row + 1]),
+            'change': _dollars(change[row]),
+            'change_percent': None if np.isnan(percent[row]) else round(float(percent[row]), 1),
+            'category_share': {name: round(float(shares[row, code]), 4)
+                               for code, name in enumerate(arrays.categories) if shares[row, code] > 0},
+        })
+    return result
+
+
+def percentiles(arrays, start, end):
+    """Percentiles of single expense amounts in [start, end]"""
+    mask = (arrays.days >= start) & (arrays.days <= end)
+    if not mask.any():
+        return {}
+    values = np.percentile(arrays.cents[mask], PERCENTILES)
+    return {f'p{p}': amount for p, amount in zip(PERCENTILES, _dollars(values))}
+
+
+def anomalies(arrays, start, end):
+    """Expenses in [start, end] far above what the user usually spends in that category.
+
+    Each category's median and median absolute deviation come from the
+    user's whole history rather than just the requested months.
+    """
+    scores = np.zeros(len(arrays.cents))
+    for code in range(len(arrays.categories)):
+        in_category = arrays.codes == code
+        if np.count_nonzero(in_category) < ANOMALY_MIN_EXPENSES:
+            continue
+        values = arrays.cents[in_category].astype(np.float64)
+        median = np.median(values)
+        deviation = np.median(np.abs(values - median))
+        if deviation > 0:
+            scores[in_category] = 0.6745 * (values - median) / deviation
+        else:
+            # Mostly identical amounts: fall back to the mean absolute deviation
+            deviation = np.mean(np.abs(values - median))
+            if deviation > 0:
+                scores[in_category] = (values - median) / (1.253314 * deviation)
+
+    flagged = np.flatnonzero((scores > ANOMALY_SCORE) & (arrays.days >= start) & (arrays.days <= end))
+    # Newest first
+    flagged = flagged[::-1][:ANOMALY_LIMIT]
+    return [{
+        'id': int(arrays.ids[i]),
+        'date': str(arrays.days[i]),
+        'category': arrays.categories[arrays.codes[i]],
+        'amount': _dollars(arrays.cents[i]),
+        'score': round(float(scores[i]), 1),
+    } for i in flagged]
+
+
+def user_analytics(user_id, months=12, today=None):
+    """Every metric for the last `months` calendar months up to today"""
+    arrays = analytics_cache.get(user_id)
+    end = np.datetime64(today or date.today(), 'D')
+    start = _month_start(months, end)
+    return {
+        'from': str(start),
+        'to': str(end),
+        'expense_count': int(np.count_nonzero((arrays.days >= start) & (arrays.days <= end))),
+        'rolling_average': rolling_average(arrays, start, end),
+        'monthly': monthly(arrays, start, end),
+        'percentiles': percentiles(arrays, start, end),
+        'anomalies': anomalies(arrays, start, end),
+    }
@@ -9,57 +9,82 @@ def admin_required(f):
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
     return decorated_function
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, send_file, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, Expense, Category, User
-from forms import ExpenseForm, CategoryForm, LoginForm, RegistrationForm, AdminUserForm
-from config import Config
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, Expense, Category, User, Budget, Job, UserShard
+from forms import ExpenseForm, BudgetForm, CategoryForm, LoginForm, RegistrationForm, AdminUserForm, ImportForm
+from config import config
+from database import configure_sqlite, dispose_after_fork, init_replica_routing, replica_reads
+import metrics
+from commands import register_commands
+import rollups
+import budgets
+from user_cache import user_cache
+from money import from_cents
+import importer
+import exporter
+import batch
+import jobs
+import search
+import shards
+import archive
+from category_cache import category_cache
+from pagination import keyset_paginate, merge_keyset_pages
+from conditional import conditional_get
+from dashboard import dashboard_data
+from versions import bump_version, user_data_version
+from passwords import HashingBusy, login_limiter
+from sqlalchemy.orm import joinedload, selectinload
+from collections import defaultdict
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract
+from sqlalchemy import func, select
 from functools import wraps
 import calendar
+import logging
+import os
 
-def create_app():
+def create_app(config_name=None):
+    """Build and configure the app without touching the database.
+
+    Creating the schema and seeding are explicit steps (`flask init-db`,
+    `flask seed`, `flask create-admin`), so importing this module costs no
+    queries and workers booting together don't race each other's DDL.
+    """
     app = Flask(__name__)
-    app.config.from_object(Config)
+    config_class = config[config_name or os.environ.get('FLASK_CONFIG', 'default')]
+    app.config.from_object(config_class)
+    config_class.init_app(app)
+    logging.basicConfig(level=app.config['LOG_LEVEL'],
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
     
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            configure_sqlite(engine, app.config)
+        metrics.init_app(app, db.engines.values())
+        dispose_after_fork(db.engines.values())
+    init_replica_routing(app, db)
+    shards.init_app(app)
     
     # Initialize Flask-Login
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'login'
     
+    register_commands(app)
+    
+    user_cache.configure(app.config['USER_CACHE_TTL'], app.config['USER_CACHE_SIZE'])
+    
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return user_cache.get(int(id))
     
-    with app.app_context():
-        try:
-            db.create_all()
-            
-            # Create default categories if none exist
-            if not Category.query.first():
-                default_categories = [
-                    ('Food & Dining', '#FF6B6B'),
-                    ('Transportation', '#4ECDC4'),
-                    ('Shopping', '#45B7D1'),
-                    ('Entertainment', '#96CEB4'),
-                    ('Bills & Utilities', '#FECA57'),
-                    ('Healthcare', '#FF9FF3'),
-                    ('Education', '#54A0FF'),
-                    ('Travel', '#5F27CD'),
-                    ('Other', '#00D2D3')
-                ]
-                
-                for name, color in default_categories:
-                    if not Category.query.filter_by(name=name).first():
-                        category = Category(name=name, color=color)
-                        db.session.add(category)
-                db.session.commit()
-        except Exception as e:
-            print(f"Error during initialization: {e}")
-            db.session.rollback()
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(e):
+        return 'The server is busy, please try again in a moment.', 503, {'Retry-After': '5'}
     
     return app
 
@@ -72,10 +97,26 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        ip, username = request.remote_addr or '', form.username.data
+        retry_after = login_limiter.check(ip, username)
+        if retry_after:
+            flash(f'Too many login attempts. Please try again in {retry_after} seconds.', 'error')
+            return render_template('login.html', form=form), 429, {'Retry-After': str(retry_after)}
+        login_limiter.attempted(ip)
+        user = User.query.filter_by(username=username).first()
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment.', 'error')
+            return render_template('login.html', form=form), 503, {'Retry-After': '5'}
+        if not valid:
+            login_limiter.failed(ip, username)
             flash('Invalid username or password', 'error')
             return redirect(url_for('login'))
+        login_limiter.succeeded(ip, username)
+        # check_password upgrades hashes made with old parameters
+        if db.session.is_modified(user):
+            db.session.commit()
         login_user(user)
         next_page = request.args.get('next')
         if not next_page or not next_page.startswith('/'):
@@ -103,124 +144,46 @@ def admin_create_user():
 
 @app.route('/')
 @login_required
+@replica_reads
+@conditional_get
 def dashboard():
     if current_user.role == 'admin':
         return redirect(url_for('admin_dashboard'))
         
     try:
-        # Get current month expenses
-        today = datetime.now()
-        current_month = today.month
-        current_year = today.year
-        start_of_month = datetime(current_year, current_month, 1)
-        # Calculate end of month
-        if current_month == 12:
-            end_of_month = datetime(current_year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_of_month = datetime(current_year, current_month + 1, 1) - timedelta(days=1)
-        
-        monthly_expenses_result = db.session.query(func.sum(Expense.amount)).filter(
-            Expense.date >= start_of_month,
-            Expense.date <= end_of_month,
-            Expense.user_id == current_user.id
-        ).scalar()
-        monthly_expenses = float(monthly_expenses_result) if monthly_expenses_result else 0.0
-        
-        # Get recent expenses (last 10) and convert to dictionaries
-        # Get recent expenses and convert to dictionaries using the model's to_dict method
-        recent_expenses_query = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.created_at.desc()).limit(10).all()
-        recent_expenses = []
-        for expense in recent_expenses_query:
-            try:
-                recent_expenses.append(expense.to_dict())
-            except Exception as e:
-                print(f"Error processing expense {expense.id}: {e}")
-        
-        # Get category-wise expenses - COMPLETELY FIXED
-        category_query_results = db.session.query(
-            Category.name,
-            Category.color,
-            func.sum(Expense.amount)
-        ).join(Expense, Expense.category == Category.name).filter(
-            Expense.date >= start_of_month,
-            Expense.date <= end_of_month,
-            Expense.user_id == current_user.id
-        ).group_by(Category.name, Category.color).all()
-        
-        # Convert to plain Python list - NO SQLAlchemy objects
-        category_expenses = []
-        for result in category_query_results:
-            category_name = str(result[0])  # Category name
-            category_color = str(result[1])  # Category color
-            total_amount = float(result[2]) if result[2] else 0.0  # Sum of expenses
-            category_expenses.append([category_name, total_amount, category_color])
-        
-        # Get daily expenses - COMPLETELY FIXED
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=6)
-        
-        # Convert dates for query
-        query_start_date = start_date.date()
-        query_end_date = end_date.date()
-        print(f"Query date range: {query_start_date} to {query_end_date}")  # Debug log
-        
-        daily_query_results = db.session.query(
-            Expense.date,
-            func.sum(Expense.amount)
-        ).filter(
-            Expense.date >= query_start_date,
-            Expense.date <= query_end_date
-        ).group_by(Expense.date).all()
-        
-        # Convert to dictionary first
-        daily_data_dict = {}
-        for result in daily_query_results:
-            try:
-                expense_date = result[0]  # First element is date
-                print(f"Query result date: {expense_date}, type: {type(expense_date)}")  # Debug log
-                if isinstance(expense_date, str):
-                    # Convert string date to date object
-                    expense_date = datetime.strptime(expense_date, '%Y-%m-%d').date()
-                elif isinstance(expense_date, datetime):
-                    expense_date = expense_date.date()
-                total_amount = float(result[1]) if result[1] else 0.0  # Second element is sum
-                daily_data_dict[expense_date] = total_amount
-            except Exception as e:
-                print(f"Error processing query result: {e}, data: {result}")  # Debug log
-        
-        # Create complete 7-day list with plain Python data
-        daily_expenses = []
-        current_date = start_date.date()
-        end_date_date = end_date.date()
-        while current_date <= end_date_date:
-            try:
-                date_str = current_date.strftime('%Y-%m-%d') if isinstance(current_date, (datetime, date)) else current_date
-                print(f"Processing date: {current_date}, type: {type(current_date)}")  # Debug log
-                daily_expenses.append({
-                    'date': date_str,
-                    'amount': daily_data_dict.get(current_date, 0.0)
-                })
-            except Exception as e:
-                print(f"Error processing date {current_date}: {e}")  # Debug log
-            current_date += timedelta(days=1)
-        
+        # Every widget comes from one statement; the charts' data is embedded
+        # in the page rather than fetched from /api/dashboard
+        data = dashboard_data(current_user.id)
         return render_template('index.html',
-                             monthly_total=monthly_expenses,
-                             recent_expenses=recent_expenses,
-                             category_expenses=category_expenses,
-                             daily_expenses=daily_expenses,
-                             current_month=calendar.month_name[current_month])
-    
+                             monthly_total=data['monthly_total'],
+                             recent_expenses=data['recent_expenses'],
+                             category_expenses=data['category_expenses'],
+                             budgets=data['budgets'],
+                             charts={'daily_expenses': data['daily_expenses'],
+                                     'category_expenses': data['category_expenses']},
+                             current_month=data['month'])
+    
+    except shards.UserMoving:
+        raise
     except Exception as e:
-        print(f"Error in dashboard: {e}")
+        app.logger.exception("Error in dashboard: %s", e)
         # Return dashboard with empty data if error occurs
         return render_template('index.html',
                              monthly_total=0.0,
                              recent_expenses=[],
                              category_expenses=[],
-                             daily_expenses=[],
+                             budgets=[],
+                             charts={'daily_expenses': [], 'category_expenses': []},
                              current_month=calendar.month_name[datetime.now().month])
 
+@app.route('/api/dashboard')
+@login_required
+@replica_reads
+@conditional_get
+def api_dashboard():
+    """Monthly total, category totals, the last 7 days and recent expenses in one response"""
+    return jsonify(dashboard_data(current_user.id))
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -244,7 +207,7 @@ def add_expense():
                 expense_date = expense_date.date()
             
             expense = Expense(
-                amount=float(form.amount.data),  # Ensure amount is float
+                amount=form.amount.data,  # Decimal, stored as integer cents
                 category=form.category.data,
                 description=form.description.data.strip() if form.description.data else None,
                 date=expense_date,
@@ -252,10 +215,16 @@ def add_expense():
             )
             
             db.session.add(expense)
+            rollups.record_added(expense)
             db.session.commit()
             
             flash('Expense added successfully!', 'success')
+            warning = budgets.over_budget_message(current_user.id, expense.category, expense.date)
+            if warning:
+                flash(warning, 'warning')
             return redirect(url_for('dashboard'))
+        except shards.UserMoving:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error adding expense: {str(e)}', 'error')
@@ -263,40 +232,177 @@ def add_expense():
     
     return render_template('add_expense.html', form=form)
 
+def expense_owner():
+    # Admin sees all expenses, others see only their own
+    return None if current_user.role == 'admin' else current_user.id
+
+def expense_filters(args):
+    """SQL conditions for the expense listing filters in args, scoped to the current user"""
+    conditions = search.filter_conditions(args, expense_owner())
+    match = search.condition(args.get('q'), expense_owner())
+    if match is not None:
+        conditions.append(match)
+    return conditions
+
 @app.route('/expenses')
 @login_required
+@replica_reads
+@conditional_get
 def expenses():
-    page = request.args.get('page', 1, type=int)
-    category_filter = request.args.get('category', '')
-    
-    # Admin sees all expenses, others see only their own
-    if current_user.role == 'admin':
-        query = Expense.query
+    filters = search.active_filters(request.args)
+    
+    # Admins list every user's expenses; with shards that is a merge of one
+    # cursor page per shard, in date order even when searching
+    if current_user.role == 'admin' and shards.enabled():
+        return render_template('expenses.html',
+                             expenses=all_shards_page(per_page=20),
+                             cursor_mode=True,
+                             categories=category_cache.names(),
+                             filters=filters,
+                             current_category=filters.get('category', ''))
+    
+    load_user = joinedload if current_user.role == 'admin' else None
+    years = archive.years_in_range(request.args)
+    
+    # Searches are ranked by relevance, so they page by number. Only the
+    # expense table has a full-text index to rank with; a search whose date
+    # range reaches an archived year lists the matches of both by date
+    searching = bool(search.search_terms(filters.get('q'))) and not years
+    
+    # Cursor paging by default; ?page=N keeps the old numbered pages working
+    cursor_mode = 'page' not in request.args and not searching
+    if cursor_mode:
+        expenses = cursor_page(years, per_page=20, load_user=load_user)
     else:
-        query = Expense.query.filter_by(user_id=current_user.id)
-    
-    if category_filter:
-        query = query.filter(Expense.category == category_filter)
-    
-    expenses = query.order_by(Expense.date.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+        if searching:
+            source = Expense
+            query = search.ranked(Expense.query.filter(*search.filter_conditions(request.args, expense_owner())),
+                                  filters['q'], expense_owner())
+        else:
+            # Numbered pages can't tell which pages reach the archive, so they
+            # read it whenever the filter's date range overlaps an archived year
+            source, conditions = archive.filtered(request.args, expense_owner(), years)
+            query = db.session.query(source).filter(*conditions).order_by(source.date.desc(), source.id.desc())
+        if load_user:
+            query = query.options(load_user(source.user))
+        expenses = query.paginate(
+            page=request.args.get('page', 1, type=int), per_page=20, error_out=False
+        )
     
-    categories = [choice[0] for choice in ExpenseForm().category.choices]
+    categories = category_cache.names()
     
     return render_template('expenses.html', 
                          expenses=expenses, 
+                         cursor_mode=cursor_mode,
                          categories=categories,
-                         current_category=category_filter)
+                         filters=filters,
+                         current_category=filters.get('category', ''))
+
+def cursor_page(years, per_page, load_user=None):
+    """One cursor page of the listing; archived years are read only when the page reaches them"""
+    paging = dict(per_page=per_page, after=request.args.get('after'), before=request.args.get('before'),
+                  with_total=request.args.get('count') == '1')
+    if not (years and paging['with_total']):
+        query = Expense.query.filter(*expense_filters(request.args))
+        if load_user:
+            query = query.options(load_user(Expense.user))
+        page = keyset_paginate(query, **paging)
+        if not archive.reaches(page, years, paging['after'], paging['before']):
+            return page
+    source, conditions = archive.filtered(request.args, expense_owner(), years)
+    query = db.session.query(source).filter(*conditions)
+    if load_user:
+        query = query.options(load_user(source.user))
+    return keyset_paginate(query, entity=source, **paging)
+
+def all_shards_page(per_page):
+    """One cursor page of expenses merged from every shard"""
+    pages = []
+    for _ in shards.each():
+        # Users live on the primary, so they are loaded in a second query
+        pages.append(cursor_page(archive.years_in_range(request.args), per_page, load_user=selectinload))
+    return merge_keyset_pages(pages, per_page, after=request.args.get('after'), before=request.args.get('before'))
+
+@app.route('/expenses/import', methods=['GET', 'POST'])
+@login_required
+def import_expenses():
+    form = ImportForm()
+    report = None
+    
+    if form.validate_on_submit():
+        default_category = app.config['IMPORT_DEFAULT_CATEGORY']
+        category_names = category_cache.names()
+        if default_category not in category_names:
+            flash(f'Import needs a "{default_category}" category for unmatched rows.', 'error')
+            return redirect(url_for('import_expenses'))
+        
+        upload = form.file.data
+        try:
+            report = importer.import_expenses(
+                importer.rows_for_format(upload.stream, form.file_format.data, form.amount_signs.data),
+                current_user.id, category_names, default_category,
+                app.config['IMPORT_BATCH_SIZE']
+            )
+            skipped = f' ({report.credits_skipped} credits skipped)' if report.credits_skipped else ''
+            flash(f'Imported {report.rows_imported} of {report.rows_read} rows{skipped}.', 'success')
+        except shards.UserMoving:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error importing expenses: {str(e)}', 'error')
+    
+    return render_template('import_expenses.html', form=form, report=report)
+
+@app.route('/expenses/export')
+@login_required
+def export_expenses():
+    """Stream the filtered expense list as CSV or JSON lines"""
+    file_format = request.args.get('format', 'csv')
+    if file_format not in exporter.EXPORT_FORMATS:
+        flash('Export format must be csv or jsonl.', 'error')
+        return redirect(url_for('expenses'))
+    
+    mimetype, extension = exporter.EXPORT_FORMATS[file_format]
+    include_user = current_user.role == 'admin'
+    if include_user:
+        # Exports across every user can run for minutes; build them in the background
+        return enqueue_job('export', format=file_format, filters=search.active_filters(request.args),
+                           include_user=True)
+    chunks = exporter.generate_export(file_format, request.args, expense_owner(), include_user)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=expenses.{extension}'}
+    )
+
+def find_expense(id):
+    """The expense with id, archived or not, or 404.
+
+    Archived rows are read-only, so a POST moves an archived expense back to
+    the expense table before it is changed.
+    """
+    expense = db.session.get(Expense, id)
+    if expense is None and request.method == 'POST':
+        if archive.restore([id], expense_owner()):
+            expense = db.session.get(Expense, id)
+    elif expense is None:
+        source, conditions = archive.source(lambda expenses: [expenses.id == id], archive.catalog())
+        expense = db.session.query(source).filter(*conditions).first()
+    if expense is None:
+        abort(404)
+    return expense
 
 @app.route('/delete_expense/<int:id>', methods=['POST'])
 @login_required
 def delete_expense(id):
-    expense = Expense.query.get_or_404(id)
+    if current_user.role == 'admin' and shards.enabled():
+        shards.use_expense(id)
+    expense = find_expense(id)
     # Only admin or owner can delete
     if current_user.role != 'admin' and expense.user_id != current_user.id:
         flash('You do not have permission to delete this expense.', 'error')
         return redirect(url_for('expenses'))
+    rollups.record_removed(expense)
     db.session.delete(expense)
     db.session.commit()
     flash('Expense deleted successfully!', 'success')
@@ -305,77 +411,277 @@ def delete_expense(id):
 @app.route('/edit_expense/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_expense(id):
-    expense = Expense.query.get_or_404(id)
+    if current_user.role == 'admin' and shards.enabled():
+        shards.use_expense(id)
+    expense = find_expense(id)
     # Only admin or owner can edit
     if current_user.role != 'admin' and expense.user_id != current_user.id:
         flash('You do not have permission to edit this expense.', 'error')
         return redirect(url_for('expenses'))
     form = ExpenseForm(obj=expense)
     if form.validate_on_submit():
+        before = rollups.snapshot(expense)
         expense.amount = form.amount.data
         expense.category = form.category.data
         expense.description = form.description.data
         expense.date = form.date.data
+        rollups.record_changed(before, expense)
         db.session.commit()
         flash('Expense updated successfully!', 'success')
         return redirect(url_for('expenses'))
     return render_template('add_expense.html', form=form, expense=expense)
 
 @app.route('/api/monthly_data')
+@login_required
+@replica_reads
+@conditional_get
 def monthly_data():
-    """API endpoint for monthly expense data"""
-    current_year = datetime.now().year
+    """API endpoint for expense totals over time.
+
+    Defaults to the twelve months of the current year. Accepts `year=YYYY`
+    or a half-open `from=YYYY-MM-DD&to=YYYY-MM-DD` range, and
+    `granularity=day|week|month`.
+    """
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+    
+    try:
+        year = request.args.get('year', type=int)
+        range_from = request.args.get('from')
+        range_to = request.args.get('to')
+        if range_from or range_to:
+            start = datetime.strptime(range_from, '%Y-%m-%d').date() if range_from else date(date.today().year, 1, 1)
+            end = datetime.strptime(range_to, '%Y-%m-%d').date() if range_to else date.today() + timedelta(days=1)
+        else:
+            year = year or datetime.now().year
+            start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    except ValueError:
+        return jsonify({'error': 'dates must be formatted as YYYY-MM-DD'}), 400
+    
+    if end <= start:
+        return jsonify({'error': '"to" must be after "from"'}), 400
+    if (end - start).days > app.config['MONTHLY_DATA_MAX_DAYS']:
+        return jsonify({'error': 'requested range is too large'}), 400
     
     # Filter by user_id if not admin
-    query = db.session.query(func.sum(Expense.amount))
-    if not current_user.is_authenticated or current_user.role != 'admin':
-        query = query.filter(Expense.user_id == current_user.id)
+    user_id = None if current_user.role == 'admin' else current_user.id
+    if user_id is None:
+        # Every user's spend: add up the series of each shard
+        totals = defaultdict(int)
+        for _ in shards.each():
+            for period, total in rollups.spend_series(start, end, granularity):
+                totals[period] += total
+        series = sorted(totals.items())
+    else:
+        series = rollups.spend_series(start, end, granularity, user_id=user_id)
+    
+    # A single calendar year by month keeps the original {month, amount} shape
+    legacy_shape = granularity == 'month' and start.month == 1 and start.day == 1 and end == date(start.year + 1, 1, 1)
     
     monthly_data = []
-    for month in range(1, 13):
-        total = query.filter(
-            extract('month', Expense.date) == month,
-            extract('year', Expense.date) == current_year
-        ).scalar()
-        
-        monthly_data.append({
-            'month': calendar.month_name[month][:3],
-            'amount': float(total) if total else 0.0
-        })
+    for period, total in series:
+        item = {'amount': from_cents(total)}
+        if granularity == 'month':
+            item['month'] = calendar.month_name[period.month][:3]
+        if not legacy_shape:
+            item['period'] = period.strftime('%Y-%m-%d')
+        monthly_data.append(item)
     
     return jsonify(monthly_data)
 
+@app.route('/api/analytics')
+@login_required
+@replica_reads
+@conditional_get
+def api_analytics():
+    """Rolling 30-day average, monthly changes and category shares,
+    percentiles and unusual spends for the current user.
+
+    Covers the last `months=N` calendar months (default 12).
+    """
+    months = request.args.get('months', 12, type=int)
+    if not 1 <= months <= app.config['ANALYTICS_MAX_MONTHS']:
+        return jsonify({'error': f'months must be between 1 and {app.config["ANALYTICS_MAX_MONTHS"]}'}), 400
+    # NumPy is imported on the first analytics request rather than at startup
+    from analytics import user_analytics
+    return jsonify(user_analytics(current_user.id, months))
+
+@app.route('/api/expenses', methods=['POST', 'PATCH', 'DELETE'])
+@login_required
+def api_expenses():
+    """Batch create (POST), update (PATCH) or delete (DELETE) expenses.
+
+    Takes a JSON array (or {"items": [...]}) and applies every valid item in
+    one transaction, returning a result per item in request order.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return jsonify({'error': 'Request body must be a JSON array of items'}), 400
+    if len(items) > app.config['API_BATCH_LIMIT']:
+        return jsonify({'error': f'At most {app.config["API_BATCH_LIMIT"]} items per request'}), 413
+    
+    try:
+        if current_user.role == 'admin' and shards.enabled():
+            # Admins may touch any user's expenses: run each shard's share of
+            # the batch on that shard, then put the results back in order
+            results = [None] * len(items)
+            for location, indexes in shard_batches(items).items():
+                with shards.using(location):
+                    restore_batch([items[i] for i in indexes])
+                    for index, result in zip(indexes, run_batch([items[i] for i in indexes])):
+                        results[index] = dict(result, index=index)
+        else:
+            restore_batch(items)
+            results = run_batch(items)
+        db.session.commit()
+    except shards.UserMoving:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error saving expenses: {str(e)}'}), 500
+    
+    failed = sum(1 for result in results if result['status'] == 'error')
+    return jsonify({
+        'results': results,
+        'succeeded': len(results) - failed,
+        'failed': failed
+    }), 207 if failed else 200
+
+def run_batch(items):
+    if request.method == 'POST':
+        return batch.create_expenses(items, current_user, category_cache.names())
+    if request.method == 'PATCH':
+        return batch.update_expenses(items, current_user, category_cache.names())
+    return batch.delete_expenses(items, current_user)
+
+def restore_batch(items):
+    """Move archived expenses named by a PATCH or DELETE batch back so it can change them"""
+    if request.method == 'POST':
+        return
+    ids = [batch.item_id(item) for item in items]
+    archive.restore([expense_id for expense_id in ids if expense_id is not None], expense_owner())
+
+def shard_batches(items):
+    """Group batch item indexes by the shard holding (or receiving) each expense"""
+    here = shards.current()
+    groups = defaultdict(list)
+    if request.method == 'POST':
+        for index, item in enumerate(items):
+            owner_id = item.get('user_id') if isinstance(item, dict) else None
+            if isinstance(owner_id, int) and db.session.get(User, owner_id) is not None:
+                groups[shards.use_user(owner_id)].append(index)
+            else:
+                groups[here].append(index)
+        shards.use(here)
+        return groups
+    ids = [batch.item_id(item) for item in items]
+    found = shards.locate_expenses([expense_id for expense_id in ids if expense_id is not None])
+    for index, expense_id in enumerate(ids):
+        groups[found.get(expense_id, here)].append(index)
+    return groups
+
 # Admin routes
+# Sort keys accepted by the admin user table; 'total' sorts on the aggregate
+ADMIN_USER_SORTS = {
+    'total': None,
+    'created': User.created_at,
+    'username': User.username,
+}
+
 @app.route('/admin')
 @login_required
 @admin_required
+@replica_reads
 def admin_dashboard():
+    page = request.args.get('page', 1, type=int)
+    sort = request.args.get('sort', 'created')
+    order = request.args.get('order', 'asc')
+    if sort not in ADMIN_USER_SORTS:
+        sort = 'created'
+    if order not in ('asc', 'desc'):
+        order = 'asc'
+    
     # Get statistics
     total_users = User.query.count()
-    total_expenses = db.session.query(func.sum(Expense.amount)).scalar() or 0
     total_categories = Category.query.count()
-    
-    # Get monthly expenses
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    monthly_expenses = db.session.query(func.sum(Expense.amount)).filter(
-        extract('month', Expense.date) == current_month,
-        extract('year', Expense.date) == current_year
-    ).scalar() or 0
-    
-    # Get users with their total expenses
-    users = User.query.all()
-    for user in users:
-        user.total_expenses = db.session.query(func.sum(Expense.amount)).filter(
-            Expense.user_id == user.id
-        ).scalar() or 0
+    today = date.today()
+    start_of_month = today.replace(day=1)
+    start_of_next_month = (start_of_month + timedelta(days=32)).replace(day=1)
+    per_page = app.config['ADMIN_USERS_PER_PAGE']
+    pages = max(1, -(-total_users // per_page))
+    page = min(max(page, 1), pages)
+    
+    if shards.enabled():
+        total_expenses, monthly_expenses, users = sharded_admin_stats(
+            start_of_month, start_of_next_month, sort, order, page, per_page)
+    else:
+        total_expenses = from_cents(db.session.scalar(rollups.total_statement()))
+        
+        # Get monthly expenses
+        monthly_expenses = from_cents(db.session.scalar(
+            rollups.total_statement(start_of_month, start_of_next_month)))
+        
+        # Get one page of users with their total expenses in a single grouped query
+        user_totals = rollups.user_totals_statement().subquery()
+        total_column = func.coalesce(user_totals.c.total, 0)
+        sort_column = total_column if sort == 'total' else ADMIN_USER_SORTS[sort]
+        sort_column = sort_column.desc() if order == 'desc' else sort_column.asc()
+        
+        rows = db.session.query(User, total_column).outerjoin(
+            user_totals, user_totals.c.user_id == User.id
+        ).order_by(sort_column, User.id).limit(per_page).offset((page - 1) * per_page).all()
+        
+        users = []
+        for user, user_total in rows:
+            user.total_expenses = from_cents(user_total)
+            users.append(user)
     
     return render_template('admin_dashboard.html',
                          total_users=total_users,
                          total_expenses=total_expenses,
                          total_categories=total_categories,
                          monthly_expenses=monthly_expenses,
-                         users=users)
+                         users=users,
+                         page=page,
+                         pages=pages,
+                         sort=sort,
+                         order=order)
+
+def sharded_admin_stats(start_of_month, start_of_next_month, sort, order, page, per_page):
+    """admin_dashboard's totals and page of users when the rollups are spread over shards"""
+    def spend(conn):
+        return (
+            conn.execute(rollups.total_statement()).scalar() or 0,
+            conn.execute(rollups.total_statement(start_of_month, start_of_next_month)).scalar() or 0,
+            conn.execute(rollups.user_totals_statement()).all(),
+        )
+    
+    # All shards are queried at once; the users table stays on the primary,
+    # so totals are joined to users here rather than in SQL
+    total = monthly = 0
+    user_totals = defaultdict(int)
+    for _, (shard_total, shard_monthly, rows) in shards.fan_out(spend):
+        total += shard_total
+        monthly += shard_monthly
+        for user_id, cents in rows:
+            user_totals[user_id] += cents
+    
+    if sort == 'total':
+        sign = -1 if order == 'desc' else 1
+        ids = sorted(db.session.scalars(select(User.id)),
+                     key=lambda user_id: (sign * user_totals.get(user_id, 0), user_id))
+        ids = ids[(page - 1) * per_page:page * per_page]
+        by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+        users = [by_id[user_id] for user_id in ids if user_id in by_id]
+    else:
+        sort_column = ADMIN_USER_SORTS[sort]
+        sort_column = sort_column.desc() if order == 'desc' else sort_column.asc()
+        users = User.query.order_by(sort_column, User.id).limit(per_page).offset((page - 1) * per_page).all()
+    for user in users:
+        user.total_expenses = from_cents(user_totals.get(user.id, 0))
+    return from_cents(total), from_cents(monthly), users
 
 @app.route('/admin/users/add', methods=['GET', 'POST'])
 @login_required
@@ -409,6 +715,7 @@ def admin_edit_user(user_id):
         if form.password.data:
             user.set_password(form.password.data)
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash(f'User {user.username} has been updated successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
     
@@ -423,15 +730,50 @@ def admin_delete_user(user_id):
         return redirect(url_for('admin_dashboard'))
     
     user = User.query.get_or_404(user_id)
+    if shards.enabled():
+        shards.use_user(user_id)
+        UserShard.query.filter_by(user_id=user_id).delete()
     db.session.delete(user)
     db.session.commit()
+    user_cache.invalidate(user_id)
     flash(f'User {user.username} has been deleted successfully!', 'success')
     return redirect(url_for('admin_dashboard'))
 
+# Budget Routes
+@app.route('/budgets', methods=['GET', 'POST'])
+@login_required
+def manage_budgets():
+    """List this month's budget status and add or change a category's budget"""
+    form = BudgetForm()
+    if form.validate_on_submit():
+        budget = Budget.query.filter_by(user_id=current_user.id, category=form.category.data).first()
+        if budget is None:
+            budget = Budget(user_id=current_user.id, category=form.category.data)
+            db.session.add(budget)
+        budget.limit = form.limit.data
+        # The dashboard shows budgets, so cached copies of it are stale now
+        bump_version(user_data_version(current_user.id))
+        db.session.commit()
+        flash(f'Budget for {budget.category} saved.', 'success')
+        return redirect(url_for('manage_budgets'))
+    return render_template('budgets.html', form=form, budgets=budgets.status(current_user.id),
+                           current_month=calendar.month_name[date.today().month])
+
+@app.route('/budgets/<int:budget_id>/delete', methods=['POST'])
+@login_required
+def delete_budget(budget_id):
+    budget = Budget.query.filter_by(id=budget_id, user_id=current_user.id).first_or_404()
+    db.session.delete(budget)
+    bump_version(user_data_version(current_user.id))
+    db.session.commit()
+    flash(f'Budget for {budget.category} removed.', 'success')
+    return redirect(url_for('manage_budgets'))
+
 # Category Management Routes
 @app.route('/categories')
 @login_required
 @admin_required
+@replica_reads
 def manage_categories():
     categories = Category.query.order_by(Category.name).all()
     return render_template('categories.html', categories=categories)
@@ -454,6 +796,7 @@ def add_category():
     
     category = Category(name=name, color=color)
     db.session.add(category)
+    category_cache.invalidate()
     try:
         db.session.commit()
         flash('Category added successfully!', 'success')
@@ -485,6 +828,7 @@ def edit_category():
     
     category.name = name
     category.color = color
+    category_cache.invalidate()
     
     try:
         db.session.commit()
@@ -500,25 +844,69 @@ def edit_category():
 @admin_required
 def delete_category(id):
     category = Category.query.get_or_404(id)
+    if category.name == 'Uncategorized':
+        flash('The Uncategorized category cannot be deleted.', 'error')
+        return redirect(url_for('manage_categories'))
     
-    # Update all expenses using this category to 'Uncategorized'
-    uncategorized = Category.query.filter_by(name='Uncategorized').first()
-    if not uncategorized:
-        uncategorized = Category(name='Uncategorized', color='#999999')
-        db.session.add(uncategorized)
-        db.session.flush()
-    
-    Expense.query.filter_by(category=category.name).update({'category': 'Uncategorized'})
-    
-    try:
-        db.session.delete(category)
-        db.session.commit()
-        flash('Category deleted successfully!', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Error deleting category: {str(e)}', 'error')
-    
-    return redirect(url_for('manage_categories'))
+    # Moving every user's expenses can take a while; a background job does it
+    # in chunks, then deletes the category
+    params = {'category_id': category.id, 'name': category.name}
+    if jobs.find_active('delete-category', **params):
+        flash(f'Category {category.name} is already being deleted.', 'info')
+        return redirect(url_for('job_list'))
+    # Committed with the job: every worker stops offering the category for
+    # new expenses (see category_cache)
+    category_cache.invalidate()
+    return enqueue_job('delete-category', **params)
+
+def enqueue_job(kind, **params):
+    """Queue a background job for the current user and show the job list"""
+    if jobs.pending_count(current_user.id) >= app.config['JOB_MAX_PENDING_PER_USER']:
+        flash('You already have several jobs waiting; try again when they finish.', 'error')
+        return redirect(url_for('job_list'))
+    job = jobs.enqueue(kind, current_user.id, **params)
+    flash(f'Job #{job.id} has been queued.', 'success')
+    return redirect(url_for('job_list'))
+
+def owned_job_or_404(job_id):
+    job = Job.query.get_or_404(job_id)
+    if current_user.role != 'admin' and job.user_id != current_user.id:
+        abort(404)
+    return job
+
+@app.route('/jobs')
+@login_required
+def job_list():
+    job_rows = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).limit(50).all()
+    return render_template('jobs.html', jobs=job_rows)
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    return jsonify(owned_job_or_404(job_id).to_dict())
+
+@app.route('/jobs/<int:job_id>/download')
+@login_required
+def download_job_result(job_id):
+    job = owned_job_or_404(job_id)
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        abort(404)
+    return send_file(job.result_path, as_attachment=True, download_name=job.result_name)
+
+@app.route('/reports/yearly', methods=['POST'])
+@login_required
+def yearly_report():
+    """Queue the year-over-year spend report (every user's spend for admins)"""
+    return enqueue_job('yearly-report', user_id=None if current_user.role == 'admin' else current_user.id)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if not token and app.config['METRICS_REQUIRE_TOKEN']:
+        abort(404)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,207 @@
+"""Hot/cold partitioning of expenses.
+
+`flask archive-expenses` moves expenses dated more than ARCHIVE_AFTER_DAYS
+ago out of the expense table into one expense_archive_<year> table per
+year, recorded in the expense_archive catalog. The expense table and its
+indexes then only grow with recent data, which is what most pages read.
+
+Archived expenses keep counting in the rollups, so dashboards and the
+yearly report are unaffected. Listings and exports read the archive
+tables only when the requested range reaches an archived year (filtered,
+reaches); editing or deleting an archived expense first moves it back to
+the expense table (restore). With shards, each shard archives its own
+rows next to them.
+"""
+import threading
+from datetime import datetime
+from sqlalchemy import Column, Index, MetaData, Table, delete, insert, inspect, select, union_all, update
+from sqlalchemy.orm import aliased
+from database import ARCHIVE_TABLE_PREFIX
+from models import db, Expense, ExpenseArchive
+from pagination import decode_cursor
+import search
+
+# Archive tables are created on demand, so they stay out of db.metadata
+# (and out of create_all and the migrations)
+_metadata = MetaData()
+_lock = threading.Lock()
+
+
+def year_table(year):
+    """The archive table for one year: expense's columns and indexes, no foreign keys"""
+    name = f'{ARCHIVE_TABLE_PREFIX}{int(year)}'
+    with _lock:
+        table = _metadata.tables.get(name)
+        if table is None:
+            columns = [Column(column.name, column.type, primary_key=column.primary_key,
+                              nullable=column.nullable) for column in Expense.__table__.columns]
+            indexes = [Index(index.name.replace('ix_expense_', f'ix_{name}_'),
+                             *[column.name for column in index.columns])
+                       for index in Expense.__table__.indexes]
+            table = Table(name, _metadata, *columns, *indexes)
+        return table
+
+
+def _engine():
+    # The database holding the session's current expense data (a shard or the primary)
+    return db.session.get_bind(clause=select(Expense.id))
+
+
+def catalog(connection=None):
+    """Catalog rows of every archived year, oldest first"""
+    statement = select(ExpenseArchive).order_by(ExpenseArchive.year)
+    if connection is None:
+        return db.session.scalars(statement).all()
+    if not inspect(connection).has_table(ExpenseArchive.__tablename__):
+        return []
+    return connection.execute(statement).all()
+
+
+def tables(connection=None):
+    return [year_table(row.year) for row in catalog(connection)]
+
+
+def years_in_range(args):
+    """Catalog rows of the archived years that the date filter in args overlaps"""
+    date_from, date_to = search.date_range(args)
+    return [row for row in catalog()
+            if (date_from is None or date_from.year <= row.year)
+            and (date_to is None or row.year <= date_to.year)]
+
+
+def boundary(years):
+    """Every archived expense in years is dated before this day"""
+    return max(row.archived_before for row in years)
+
+
+def source(conditions_for, years):
+    """(source, conditions) to read expenses matching conditions_for from.
+
+    conditions_for(source) builds the filters for Expense or for an archive
+    table's columns. Without archived years that is simply Expense and its
+    conditions. Otherwise it is an alias of Expense over a UNION ALL of the
+    expense table and those archive tables, each filtered inside its own
+    branch so every table is read through its own indexes, and no further
+    conditions.
+    """
+    if not years:
+        return Expense, conditions_for(Expense)
+    branches = [select(*Expense.__table__.columns).where(*conditions_for(Expense))]
+    for row in years:
+        table = year_table(row.year)
+        branches.append(select(*table.columns).where(*conditions_for(table.c)))
+    return aliased(Expense, union_all(*branches).subquery('expenses')), []
+
+
+def filtered(args, owner_id, years):
+    """source() for the expense listing filters in args, search included"""
+    def conditions_for(expenses):
+        conditions = search.filter_conditions(args, owner_id, expenses)
+        match = search.condition(args.get('q'), owner_id, expenses)
+        if match is not None:
+            conditions.append(match)
+        return conditions
+    return source(conditions_for, years)
+
+
+def reaches(page, years, after=None, before=None):
+    """Whether a cursor page read from the expense table alone may be missing archived rows"""
+    if not years:
+        return False
+    cutoff = boundary(years)
+    position = decode_cursor(before) if decode_cursor(after) is None else None
+    if position is not None:
+        # Paging back towards newer rows: archived rows are all older than the cutoff
+        return position[0] < cutoff
+    return not (page.has_next and page.items[-1].date >= cutoff)
+
+
+def _record(conn, year, archived_before):
+    now = datetime.utcnow()
+    entry = conn.execute(select(ExpenseArchive.archived_before).where(ExpenseArchive.year == year)).first()
+    if entry is None:
+        conn.execute(insert(ExpenseArchive).values(year=year, archived_before=archived_before, archived_at=now))
+    elif entry.archived_before < archived_before:
+        conn.execute(update(ExpenseArchive).where(ExpenseArchive.year == year)
+                     .values(archived_before=archived_before, archived_at=now))
+
+
+def ensure_year(conn, year, archived_before):
+    """Create a year's archive table on conn if needed and record it in the catalog"""
+    table = year_table(year)
+    table.create(conn, checkfirst=True)
+    _record(conn, year, archived_before)
+    return table
+
+
+def archive_before(cutoff, batch_size, report=None):
+    """Move the current location's expenses dated before cutoff into the archive.
+
+    Each batch is copied and deleted in one transaction, so an interrupted
+    run leaves every expense in exactly one place. Returns the number moved.
+    """
+    expense = Expense.__table__
+    moved = 0
+    while True:
+        with _engine().begin() as conn:
+            ids = conn.execute(select(expense.c.id).where(expense.c.date < cutoff)
+                               .limit(batch_size)).scalars().all()
+            if not ids:
+                return moved
+            rows = conn.execute(select(expense).where(expense.c.id.in_(ids))).mappings().all()
+            by_year = {}
+            for row in rows:
+                by_year.setdefault(row['date'].year, []).append(dict(row))
+            for year, year_rows in by_year.items():
+                conn.execute(insert(ensure_year(conn, year, cutoff)), year_rows)
+            conn.execute(delete(expense).where(expense.c.id.in_(ids)))
+        moved += len(ids)
+        if report:
+            report(f'{moved} expenses archived')
+
+
+def restore(ids, owner_id=None):
+    """Move archived expenses (of owner_id, if given) back into the expense table.
+
+    Archived rows are read-only; edits and deletes restore them first. Runs
+    in the session's transaction. Returns the number restored.
+    """
+    expense = Expense.__table__
+    ids = list(ids)
+    hot = set(db.session.scalars(select(expense.c.id).where(expense.c.id.in_(ids))))
+    missing = [expense_id for expense_id in ids if expense_id not in hot]
+    restored = 0
+    if not missing:
+        return restored
+    for table in tables():
+        condition = table.c.id.in_(missing)
+        if owner_id is not None:
+            condition = condition & (table.c.user_id == owner_id)
+        rows = db.session.execute(select(table).where(condition)).mappings().all()
+        if rows:
+            db.session.execute(insert(expense), [dict(row) for row in rows])
+            db.session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+            restored += len(rows)
+    return restored
+
+
+def existing_ids(conn, ids):
+    """The ids among ids held on conn's database, archived or not"""
+    ids = list(ids)
+    statements = [select(Expense.id).where(Expense.id.in_(ids))]
+    statements += [select(table.c.id).where(table.c.id.in_(ids)) for table in tables(conn)]
+    return set(conn.execute(union_all(*statements)).scalars())
+
+
+def vacuum():
+    """Return the space freed by archiving and refresh the planner statistics"""
+    engine = _engine()
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        if engine.dialect.name == 'sqlite':
+            conn.exec_driver_sql('VACUUM')
+            conn.exec_driver_sql('ANALYZE')
+        elif engine.dialect.name == 'postgresql':
+            conn.exec_driver_sql('VACUUM ANALYZE expense')
+            for table in tables(conn):
+                conn.exec_driver_sql(f'ANALYZE {table.name}')
@@ -0,0 +1,153 @@
+from collections import defaultdict
+from sqlalchemy import delete, select
+from models import db, Expense, User
+from forms import expense_validator
+import rollups
+
+EDITABLE_FIELDS = ('amount', 'category', 'description', 'date')
+
+
+def _deltas():
+    return defaultdict(lambda: [0, 0])
+
+
+def _add_delta(deltas, user_id, day, category, cents, count):
+    delta = deltas[(user_id, day, category)]
+    delta[0] += cents
+    delta[1] += count
+
+
+def item_id(item):
+    """The expense id an update or delete item names, or None when it is not an integer"""
+    expense_id = item.get('id') if isinstance(item, dict) else item
+    if isinstance(expense_id, int) and not isinstance(expense_id, bool):
+        return expense_id
+    return None
+
+
+def _id_error(index):
+    return {'index': index, 'status': 'error', 'errors': {'id': 'Expected an integer id.'}}
+
+
+def _load_owned(items, user):
+    """Map the ids referenced by items to expenses the user may change, in one query"""
+    ids = {item_id(item) for item in items} - {None}
+    if not ids:
+        return {}
+    query = Expense.query.filter(Expense.id.in_(ids))
+    if user.role != 'admin':
+        query = query.filter(Expense.user_id == user.id)
+    return {expense.id: expense for expense in query}
+
+
+def _existing_owners(items, user):
+    """The user_ids an admin's items name that belong to real users, in one query"""
+    if user.role != 'admin':
+        return set()
+    ids = {item.get('user_id') for item in items if isinstance(item, dict)}
+    ids = {owner_id for owner_id in ids if isinstance(owner_id, int) and not isinstance(owner_id, bool)}
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(User.id).where(User.id.in_(ids))))
+
+
+def create_expenses(items, user, category_names):
+    """Validate and insert a list of expense dicts; returns per-item results.
+
+    Valid items are flushed together (one multi-row INSERT where the
+    database supports RETURNING) and their rollup changes applied in bulk.
+    The caller commits.
+    """
+    results, created = [], []
+    deltas = _deltas()
+    clean = expense_validator(category_names)
+    owner_ids = _existing_owners(items, user)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'status': 'error', 'errors': {'item': 'Expected an object.'}})
+            continue
+        values, errors = clean(item)
+        owner_id = user.id
+        if user.role == 'admin' and 'user_id' in item:
+            owner_id = item['user_id']
+            if owner_id not in owner_ids:
+                errors['user_id'] = 'User not found.'
+        if errors:
+            results.append({'index': index, 'status': 'error', 'errors': errors})
+            continue
+        expense = Expense(user_id=owner_id, **values)
+        created.append((index, expense))
+        _add_delta(deltas, owner_id, values['date'], values['category'], expense.amount_cents, 1)
+        results.append(None)
+
+    db.session.add_all([expense for _, expense in created])
+    db.session.flush()
+    rollups.apply_deltas(deltas)
+    for index, expense in created:
+        results[index] = {'index': index, 'status': 'created', 'id': expense.id, 'expense': expense.to_dict()}
+    return results
+
+
+def update_expenses(items, user, category_names):
+    """Apply partial updates ({"id": ..., field: value}) to many expenses at once"""
+    expenses = _load_owned(items, user)
+    results, seen = [], set()
+    deltas = _deltas()
+    clean = expense_validator(category_names)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'status': 'error', 'errors': {'item': 'Expected an object.'}})
+            continue
+        if item_id(item) is None:
+            results.append(_id_error(index))
+            continue
+        expense = expenses.get(item_id(item))
+        if expense is None:
+            results.append({'index': index, 'status': 'error', 'errors': {'id': 'Expense not found.'}})
+            continue
+        if expense.id in seen:
+            results.append({'index': index, 'status': 'error', 'errors': {'id': 'Duplicate id in batch.'}})
+            continue
+        seen.add(expense.id)
+
+        merged = {field: getattr(expense, field) for field in EDITABLE_FIELDS}
+        merged.update({field: item[field] for field in EDITABLE_FIELDS if field in item})
+        values, errors = clean(merged)
+        if errors:
+            results.append({'index': index, 'status': 'error', 'id': expense.id, 'errors': errors})
+            continue
+
+        _add_delta(deltas, expense.user_id, expense.date, expense.category, -expense.amount_cents, -1)
+        for field, value in values.items():
+            setattr(expense, field, value)
+        _add_delta(deltas, expense.user_id, expense.date, expense.category, expense.amount_cents, 1)
+        results.append({'index': index, 'status': 'updated', 'id': expense.id, 'expense': expense.to_dict()})
+
+    db.session.flush()
+    rollups.apply_deltas(deltas)
+    return results
+
+
+def delete_expenses(items, user):
+    """Delete many expenses given as ids or {"id": ...} objects"""
+    expenses = _load_owned(items, user)
+    results, doomed = [], set()
+    deltas = _deltas()
+    for index, item in enumerate(items):
+        if item_id(item) is None:
+            results.append(_id_error(index))
+            continue
+        expense = expenses.get(item_id(item))
+        if expense is None or expense.id in doomed:
+            results.append({'index': index, 'status': 'error', 'errors': {'id': 'Expense not found.'}})
+            continue
+        doomed.add(expense.id)
+        _add_delta(deltas, expense.user_id, expense.date, expense.category, -expense.amount_cents, -1)
+        results.append({'index': index, 'status': 'deleted', 'id': expense.id})
+
+    if doomed:
+        db.session.execute(delete(Expense).where(Expense.id.in_(doomed)), execution_options={'synchronize_session': False})
+        for expense_id in doomed:
+            db.session.expunge(expenses[expense_id])
+    rollups.apply_deltas(deltas)
+    return results
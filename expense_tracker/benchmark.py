@@ -0,0 +1,205 @@
+"""Time the request paths behind the busiest pages and record them as JSON.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 10000,100000,1000000 --output bench.json
+    python benchmark.py --compare bench.json
+
+Without --sizes the database in DATABASE_URL is measured as it is. With
+--sizes a fresh SQLite database is generated for each expense count (see
+generate_data.py) and measured in a child process. --compare exits non-zero
+when a median got slower than the baseline by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, date
+import sqlalchemy
+from sqlalchemy import event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def endpoints():
+    """(name, url, as_admin) for each measured request"""
+    year = date.today().year
+    return [
+        ('dashboard', '/', False),
+        ('api_dashboard', '/api/dashboard', False),
+        ('expenses', '/expenses', False),
+        ('expenses with total', '/expenses?count=1', False),
+        ('expenses deep offset page', '/expenses?page=50', False),
+        ('expenses search', '/expenses?q=subscription', False),
+        ('expenses search + filters', f'/expenses?q=card&date_from={year}-01-01&min_amount=20', False),
+        ('monthly_data year', f'/api/monthly_data?year={year}', False),
+        ('monthly_data 5 years', f'/api/monthly_data?from={year - 4}-01-01&to={year}-12-31', False),
+        ('admin_dashboard', '/admin', True),
+    ]
+
+
+def _client_for(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+def measure(repeat, warmup):
+    """Time each endpoint repeat times against the configured database"""
+    from app import app
+    from models import db, User
+    import shards
+
+    with app.app_context():
+        admin = User.query.filter_by(role='admin').first()
+        # The heaviest customer is the worst case for per-user pages
+        per_user = {}
+        for by_user in shards.user_counts().values():
+            for user_id, size in by_user.items():
+                per_user[user_id] = per_user.get(user_id, 0) + size
+        heaviest = max(per_user, key=per_user.get) if per_user else None
+        customer = db.session.get(User, heaviest) if heaviest else User.query.filter_by(role='customer').first()
+        if admin is None or customer is None:
+            raise SystemExit('benchmark needs an admin and a customer; run generate_data.py first')
+        counts = {
+            'users': User.query.count(),
+            'expenses': sum(per_user.values()),
+            'customer_expenses': per_user.get(customer.id, 0),
+        }
+        clients = {True: _client_for(app, admin), False: _client_for(app, customer)}
+        engine = db.engine
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+    results = {}
+    try:
+        for name, url, as_admin in endpoints():
+            client = clients[as_admin]
+            for _ in range(warmup):
+                client.get(url)
+            timings = []
+            for _ in range(repeat):
+                queries[0] = 0
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise SystemExit(f'{name}: GET {url} returned {response.status_code}')
+            timings.sort()
+            results[name] = {
+                'url': url,
+                'median_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+                'min_ms': round(timings[0], 3),
+                'mean_ms': round(statistics.fmean(timings), 3),
+                'queries': queries[0],
+            }
+            print(f'{name:28} {results[name]["median_ms"]:10.2f} ms  {queries[0]:3} queries', file=sys.stderr)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    return dict(counts, dialect=engine.dialect.name, results=results)
+
+
+def measure_sizes(sizes, users_per_expense, repeat, warmup):
+    """Generate a throwaway SQLite database per size and measure each in a child process"""
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            path = os.path.join(workdir, f'bench_{size}.db')
+            env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+            users = max(10, int(size * users_per_expense))
+            print(f'-- {size} expenses, {users} users', file=sys.stderr)
+            subprocess.run([sys.executable, 'generate_data.py', '--users', str(users),
+                            '--expenses', str(size)], cwd=HERE, env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            output = os.path.join(workdir, f'bench_{size}.json')
+            subprocess.run([sys.executable, 'benchmark.py', '--repeat', str(repeat),
+                            '--warmup', str(warmup), '--output', output],
+                           cwd=HERE, env=env, check=True)
+            with open(output) as f:
+                runs.extend(json.load(f)['runs'])
+    return runs
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Print median changes against baseline; returns the regressed (size, name) pairs"""
+    regressions = []
+    previous = {run['expenses']: run['results'] for run in baseline['runs']}
+    for run in report['runs']:
+        old_results = previous.get(run['expenses'])
+        if old_results is None:
+            print(f'no baseline run with {run["expenses"]} expenses', file=sys.stderr)
+            continue
+        for name, result in run['results'].items():
+            old = old_results.get(name)
+            if old is None:
+                continue
+            ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else 1.0
+            flag = 'REGRESSED' if ratio > 1 + threshold else ''
+            print(f'{run["expenses"]:>10} {name:28} {old["median_ms"]:10.2f} -> '
+                  f'{result["median_ms"]:10.2f} ms ({ratio:5.2f}x) {flag}', file=sys.stderr)
+            if flag:
+                regressions.append((run['expenses'], name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', help='Comma-separated expense counts to generate and measure.')
+    parser.add_argument('--users-per-expense', type=float, default=0.001,
+                        help='Users generated per expense with --sizes (default: 1 per 1000).')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON file from an earlier run.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed median slowdown before --compare fails (default: 0.25).')
+    args = parser.parse_args()
+
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        runs = measure_sizes(sizes, args.users_per_expense, args.repeat, args.warmup)
+    else:
+        runs = [measure(args.repeat, args.warmup)]
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'repeat': args.repeat,
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
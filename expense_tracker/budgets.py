@@ -0,0 +1,65 @@
+"""Monthly category budgets.
+
+Spend against a budget is read from the user's MonthlyCategoryTotal row
+for the month, which rollups.py keeps up to date in the same transaction
+as every expense write; checking a budget never sums expenses.
+`flask reconcile-budgets` rebuilds those counters after bulk loads that
+bypass the rollup helpers.
+"""
+import calendar
+from datetime import date
+from sqlalchemy import select
+from models import db, Budget, MonthlyCategoryTotal
+from money import from_cents
+
+# Share of a budget spent from which the dashboard shows it as nearly used up
+WARN_RATIO = 0.8
+
+
+def _state(budget, spent_cents):
+    return {
+        'id': budget.id,
+        'category': budget.category,
+        'limit': from_cents(budget.limit_cents),
+        'spent': from_cents(spent_cents),
+        'remaining': from_cents(budget.limit_cents - spent_cents),
+        'percent': round(spent_cents * 100 / budget.limit_cents, 1) if budget.limit_cents else None,
+        'warning': spent_cents >= budget.limit_cents * WARN_RATIO,
+        'over': spent_cents > budget.limit_cents,
+    }
+
+
+def month_spend(user_id, month, categories=None):
+    """{category: cents} spent by a user in the month starting on month"""
+    statement = select(MonthlyCategoryTotal.category, MonthlyCategoryTotal.total_cents).where(
+        MonthlyCategoryTotal.user_id == user_id, MonthlyCategoryTotal.month == month)
+    if categories is not None:
+        statement = statement.where(MonthlyCategoryTotal.category.in_(categories))
+    return dict(db.session.execute(statement).all())
+
+
+def status(user_id, spent=None, today=None):
+    """State of each of a user's budgets for the current month, by category.
+
+    spent is an optional {category: cents} for this month that the caller
+    already has (the dashboard reads it anyway); otherwise it is looked up.
+    """
+    budgets = Budget.query.filter_by(user_id=user_id).order_by(Budget.category).all()
+    if not budgets:
+        return []
+    if spent is None:
+        month = (today or date.today()).replace(day=1)
+        spent = month_spend(user_id, month, [budget.category for budget in budgets])
+    return [_state(budget, spent.get(budget.category) or 0) for budget in budgets]
+
+
+def over_budget_message(user_id, category, day):
+    """Warning text when the user's budget for category is exceeded in day's month, else None"""
+    budget = Budget.query.filter_by(user_id=user_id, category=category).first()
+    if budget is None:
+        return None
+    spent = month_spend(user_id, day.replace(day=1), [category]).get(category) or 0
+    if spent <= budget.limit_cents:
+        return None
+    return (f'Over budget: {category} is at ${from_cents(spent):.2f} of its '
+            f'${from_cents(budget.limit_cents):.2f} budget for {calendar.month_name[day.month]} {day.year}.')
@@ -0,0 +1,69 @@
+import json
+import threading
+from collections import namedtuple
+from flask import g
+from models import Category, Job
+from versions import get_version, bump_version
+
+CATEGORIES_VERSION = 'categories'
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name', 'color'])
+
+
+class CategoryCache:
+    """Per-worker copy of the category table, ordered by name.
+
+    The shared version row is read at most once per request; the table itself
+    is only reloaded when that version differs from the cached one, so form
+    construction and color lookups normally cost no queries at all.
+
+    Categories with a queued or running delete-category job are left out of
+    names() and choices(), so the forms, imports and the batch API can't
+    file new expenses under them while the job empties them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._categories = []
+        self._colors = {}
+        self._deleting = frozenset()
+
+    def _load(self):
+        version = g.get('_category_version')
+        if version is None:
+            version = g._category_version = get_version(CATEGORIES_VERSION)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    categories = [CachedCategory(c.id, c.name, c.color)
+                                  for c in Category.query.order_by(Category.name).all()]
+                    deleting = Job.query.filter(Job.kind == 'delete-category',
+                                                Job.status.in_(('queued', 'running')))
+                    self._categories = categories
+                    self._colors = {c.name: c.color for c in categories}
+                    self._deleting = frozenset(json.loads(job.params)['name'] for job in deleting)
+                    self._version = version
+        return self._categories
+
+    def all(self):
+        return list(self._load())
+
+    def names(self):
+        return [c.name for c in self._load() if c.name not in self._deleting]
+
+    def choices(self):
+        return [(name, name) for name in self.names()]
+
+    def color(self, name, default='#007bff'):
+        self._load()
+        return self._colors.get(name, default)
+
+    def invalidate(self):
+        """Mark categories as changed for every worker (commit with the change)"""
+        bump_version(CATEGORIES_VERSION)
+        g.pop('_category_version', None)
+        self._version = None
+
+
+category_cache = CategoryCache()
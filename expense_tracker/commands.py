@@ -0,0 +1,366 @@
+import click
+import os
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import inspect
+from models import db, Category, Expense, DailyCategoryTotal, MonthlyCategoryTotal, User
+from category_cache import category_cache
+from dashboard import dashboard_statement
+from pagination import keyset_query
+import archive
+import importer
+import jobs
+import rollups
+import search
+import shards
+
+DEFAULT_CATEGORIES = [
+    ('Food & Dining', '#FF6B6B'),
+    ('Transportation', '#4ECDC4'),
+    ('Shopping', '#45B7D1'),
+    ('Entertainment', '#96CEB4'),
+    ('Bills & Utilities', '#FECA57'),
+    ('Healthcare', '#FF9FF3'),
+    ('Education', '#54A0FF'),
+    ('Travel', '#5F27CD'),
+    ('Other', '#00D2D3'),
+]
+
+
+class MigrationCommands(click.Group):
+    """`flask db`: Flask-Migrate's commands, loaded when one of them runs.
+
+    Flask-Migrate pulls in Alembic, which takes longer to import than the
+    rest of the app, so web workers and scripts never import it.
+    """
+
+    def __init__(self, app):
+        super().__init__('db', help='Perform database migrations.')
+        self.app = app
+
+    def _migrate_commands(self):
+        init_migrations(self.app)
+        from flask_migrate.cli import db as migrate_commands
+        return migrate_commands
+
+    def list_commands(self, ctx):
+        return self._migrate_commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._migrate_commands().get_command(ctx, name)
+
+
+def init_migrations(app):
+    """Set up Flask-Migrate on app (`flask db` and upgrade_database.py)"""
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=os.path.join(app.root_path, 'migrations'), render_as_batch=True)
+
+
+def hot_queries(user_id=1):
+    """The statements behind the busiest pages, as (name, statement, expected).
+
+    They come from the same builders the views use, so check-indexes
+    explains what the pages actually run. expected lists plan lines a
+    statement needs by design, which plan_problems() lets through.
+    """
+    today = date.today()
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    # A cursor position somewhere inside the listing
+    position = (today, 1000)
+    page_size = 21
+
+    def listing(args, owner_id, **seek):
+        query = Expense.query.filter(*search.filter_conditions(args, owner_id))
+        return keyset_query(query, **seek).limit(page_size).statement
+
+    mine = Expense.query.filter(*search.filter_conditions({}, user_id))
+    return [
+        # Groups the seven rows of the week's series
+        ('dashboard', dashboard_statement(user_id, today), ['TEMP B-TREE FOR GROUP BY']),
+        ('expense listing', listing({}, user_id), []),
+        ('expense listing, next page', listing({}, user_id, after=position), []),
+        ('expense listing, previous page', listing({}, user_id, before=position), []),
+        ('expense listing, date range', listing({'date_from': month_start.isoformat()}, user_id, after=position), []),
+        ('admin expense listing', listing({}, None, after=position), []),
+        ('category expense listing', listing({'category': 'Other'}, None, after=position), []),
+        # Orders only the matches, by rank
+        ('expense search', search.ranked(mine, 'coffee', user_id).limit(20).statement, ['TEMP B-TREE FOR ORDER BY']),
+        # Sums every rollup row; there is nothing to narrow it to
+        ('admin total', rollups.total_statement(), ['SCAN daily_category_total']),
+        ('admin month total', rollups.total_statement(month_start, next_month), []),
+        ('admin user totals', rollups.user_totals_statement(), []),
+    ]
+
+
+def explain(statement, engine=None):
+    """Return the database's query plan for statement as a list of lines"""
+    engine = engine or db.engine
+    compiled = statement.compile(dialect=engine.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+            return [row[-1] for row in rows]
+        if engine.dialect.name == 'postgresql':
+            # Tiny tables are cheaper to seq-scan; ask whether an index *can* be used
+            conn.exec_driver_sql('SET enable_seqscan = off')
+        rows = conn.exec_driver_sql(f'EXPLAIN {compiled}', params)
+        return [' '.join(str(value) for value in row) for row in rows]
+
+
+def plan_problems(plan, expected=()):
+    """Lines of a query plan that show a full table scan or an explicit sort.
+
+    Scans of the statement's own CTEs and literal rows, and reads of the
+    full-text index, are not table scans. Lines containing one of expected
+    are left out.
+    """
+    # Names SQLite gives the rows a CTE or subquery produces
+    produced = {line.split()[-1].upper() for line in plan
+                if line.upper().startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    problems = []
+    for line in plan:
+        upper = line.upper()
+        if any(fragment.upper() in upper for fragment in expected):
+            continue
+        if upper.startswith('SCAN '):
+            name = upper.split()[1]
+            if 'USING' not in upper and 'VIRTUAL TABLE' not in upper and name not in produced | {'CONSTANT'}:
+                problems.append(line)
+        elif 'TEMP B-TREE' in upper or 'SEQ SCAN' in upper:
+            problems.append(line)
+    return problems
+
+
+def init_database():
+    """Create a fresh database: every table and index on the primary and the shards.
+
+    For development and tests. Existing databases are brought up to date
+    with `flask db upgrade` instead, since create_all never alters a table
+    that is already there. Safe to re-run; rollups are backfilled for
+    databases whose expenses predate them. Returns the names of the tables
+    created on the primary.
+    """
+    existing = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    # The full-text index is raw DDL that create_all doesn't know about
+    with db.engine.begin() as conn:
+        search.install(conn)
+    init_shards()
+    for _ in shards.each():
+        if Expense.query.first() and not DailyCategoryTotal.query.first():
+            rollups.rebuild()
+        elif DailyCategoryTotal.query.first() and not MonthlyCategoryTotal.query.first():
+            rollups.rebuild_monthly()
+    return sorted(set(inspect(db.engine).get_table_names()) - existing)
+
+
+def init_shards():
+    """Create the sharded tables on every configured shard; the migrations
+    only cover the primary"""
+    for shard in range(shards.count()):
+        shards.create_schema(shards.engine(shard))
+    return shards.count()
+
+
+def seed_categories():
+    """Add DEFAULT_CATEGORIES to an empty category table; returns how many were added"""
+    if Category.query.first():
+        return 0
+    for name, color in DEFAULT_CATEGORIES:
+        db.session.add(Category(name=name, color=color))
+    category_cache.invalidate()
+    db.session.commit()
+    return len(DEFAULT_CATEGORIES)
+
+
+def create_admin(username, email, password):
+    """Create an admin user; returns None when the username is taken"""
+    if User.query.filter_by(username=username).first():
+        return None
+    user = User(username=username, email=email, role='admin')
+    user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def register_commands(app):
+    """Attach the maintenance commands to the app's `flask` CLI"""
+    app.cli.add_command(MigrationCommands(app))
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create a fresh development database (deploys use `flask db upgrade`)."""
+        created = init_database()
+        click.echo(f'Created tables: {", ".join(created)}.' if created else 'Database schema is up to date.')
+
+    @app.cli.command('init-shards')
+    def init_shards_command():
+        """Create the expense tables and search index on every shard."""
+        shard_count = init_shards()
+        click.echo(f'Shard schemas are up to date on {shard_count} shards.' if shard_count
+                   else 'SHARD_DATABASE_URLS is not configured.')
+
+    @app.cli.command('seed')
+    def seed_command():
+        """Add the default expense categories to an empty database."""
+        added = seed_categories()
+        click.echo(f'Added {added} categories.' if added else 'Categories already exist.')
+
+    @app.cli.command('create-admin')
+    @click.option('--username', default='admin', show_default=True)
+    @click.option('--email', default='admin@example.com', show_default=True)
+    @click.password_option(help='Password for the new user (prompted for when omitted).')
+    def create_admin_command(username, email, password):
+        """Create an admin user."""
+        if create_admin(username, email, password) is None:
+            raise click.ClickException(f'User {username} already exists')
+        click.echo(f'Admin user {username} created.')
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user\'s rows.')
+    def rebuild_rollups_command(user_id):
+        """Backfill the daily/category rollup table from expenses."""
+        rows = 0
+        for _ in shards.each(user_id):
+            rows += rollups.rebuild(user_id)
+        click.echo(f'Rebuilt {rows} rollup rows.')
+
+    @app.cli.command('reconcile-budgets')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user\'s counters.')
+    def reconcile_budgets_command(user_id):
+        """Rebuild the monthly spend counters behind budgets from expenses."""
+        rows = 0
+        for _ in shards.each(user_id):
+            rows += rollups.rebuild_monthly(user_id)
+        click.echo(f'Rebuilt {rows} monthly counters.')
+
+    @app.cli.command('import-expenses')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--username', required=True, help='Owner of the imported expenses.')
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ofx']), default=None,
+                  help='File format (default: from the file extension).')
+    @click.option('--default-category', default=None,
+                  help='Category for rows whose category is missing or unknown.')
+    @click.option('--signs', type=click.Choice(importer.AMOUNT_SIGNS), default='bank', show_default=True,
+                  help='CSV amounts: bank (spending negative, credits positive) '
+                       'or expenses (spending positive, refunds negative).')
+    @click.option('--batch-size', type=int, default=None, help='Rows per INSERT batch.')
+    def import_expenses_command(path, username, file_format, default_category, signs, batch_size):
+        """Stream a CSV or OFX bank export into a user's expenses."""
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f'No user named {username}')
+        default_category = default_category or current_app.config['IMPORT_DEFAULT_CATEGORY']
+        category_names = category_cache.names()
+        if default_category not in category_names:
+            raise click.ClickException(f'Default category {default_category} does not exist')
+        if file_format is None:
+            file_format = 'ofx' if os.path.splitext(path)[1].lower() in ('.ofx', '.qfx') else 'csv'
+
+        if shards.enabled():
+            shards.use_user(user.id)
+        with open(path, 'rb') as stream:
+            report = importer.import_expenses(
+                importer.rows_for_format(stream, file_format, signs), user.id, category_names,
+                default_category, batch_size or current_app.config['IMPORT_BATCH_SIZE']
+            )
+        for line, message in report.errors:
+            click.echo(f'line {line}: {message}', err=True)
+        click.echo(f'Imported {report.rows_imported} of {report.rows_read} rows '
+                   f'({report.error_count} errors, {report.credits_skipped} credits skipped) '
+                   f'in {report.elapsed:.2f}s, '
+                   f'{report.rows_per_second:.0f} rows/sec.')
+
+    @app.cli.command('run-jobs')
+    @click.option('--concurrency', type=int, default=None, help='Jobs run at the same time.')
+    @click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+    def run_jobs_command(concurrency, once):
+        """Run queued background jobs (exports, reports, category deletes)."""
+        concurrency = concurrency or current_app.config['JOB_CONCURRENCY']
+        click.echo(f'Running jobs with {concurrency} threads.')
+        jobs.run_worker(current_app._get_current_object(), concurrency,
+                        current_app.config['JOB_POLL_INTERVAL'], once)
+
+    @app.cli.command('check-indexes')
+    def check_indexes_command():
+        """EXPLAIN the hot queries and fail if any needs a table scan."""
+        failed = False
+        # The hot queries all read expense tables, which may live on the shards
+        engine = shards.engine(0) if shards.enabled() else db.engine
+        for name, statement, expected in hot_queries():
+            plan = explain(statement, engine)
+            problems = plan_problems(plan, expected)
+            status = 'FAIL' if problems else 'ok'
+            click.echo(f'[{status}] {name}')
+            for line in plan:
+                click.echo(f'        {line}')
+            failed = failed or bool(problems)
+        if failed:
+            raise click.ClickException('some hot queries do not use an index')
+
+    @app.cli.command('rebalance-shards')
+    @click.option('--tolerance', type=float, default=0.1,
+                  help='Allowed difference between shard sizes, as a fraction of the mean.')
+    @click.option('--drain', type=float, default=None,
+                  help='Seconds to wait after flagging users before copying them.')
+    @click.option('--dry-run', is_flag=True, help='Only print the planned moves.')
+    def rebalance_shards_command(tolerance, drain, dry_run):
+        """Move users off the primary and between shards until shard sizes are even."""
+        if not shards.enabled():
+            raise click.ClickException('SHARD_DATABASE_URLS is not configured')
+        if not dry_run:
+            removed = shards.remove_leftovers()
+            if removed:
+                click.echo(f'Removed {removed} expenses left behind by an interrupted move.')
+        moves = shards.plan_moves(tolerance)
+        for user_id, source, target in moves:
+            click.echo(f'user {user_id}: {"primary" if source is None else f"shard {source}"} -> shard {target}')
+        if not moves:
+            click.echo('Shards are balanced.')
+        if dry_run or not moves:
+            return
+        drain = current_app.config['SHARD_DRAIN_SECONDS'] if drain is None else drain
+        shards.move_users(moves, drain, report=click.echo)
+        click.echo(f'Moved {len(moves)} users.')
+
+    @app.cli.command('archive-expenses')
+    @click.option('--older-than-days', type=int, default=None,
+                  help='Archive expenses dated more than this many days ago (default: ARCHIVE_AFTER_DAYS).')
+    @click.option('--batch-size', type=int, default=None, help='Expenses moved per transaction.')
+    @click.option('--no-vacuum', is_flag=True, help='Skip VACUUM/ANALYZE after archiving.')
+    def archive_expenses_command(older_than_days, batch_size, no_vacuum):
+        """Move old expenses into per-year archive tables and compact the database."""
+        days = current_app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+        cutoff = date.today() - timedelta(days=days)
+        batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+        for location in shards.each():
+            name = 'primary' if location is None else f'shard {location}'
+            moved = archive.archive_before(cutoff, batch_size, report=lambda message: click.echo(f'{name}: {message}'))
+            click.echo(f'{name}: archived {moved} expenses dated before {cutoff}.')
+            if moved and not no_vacuum:
+                archive.vacuum()
+                click.echo(f'{name}: vacuumed and analyzed.')
+
+    @app.cli.command('sync-replica')
+    def sync_replica_command():
+        """Copy the primary SQLite database into the replica file (local testing)."""
+        engines = db.engines
+        if 'replica' not in engines:
+            raise click.ClickException('REPLICA_DATABASE_URL is not configured')
+        if engines[None].dialect.name != 'sqlite' or engines['replica'].dialect.name != 'sqlite':
+            raise click.ClickException('sync-replica only copies SQLite databases')
+        primary = engines[None].raw_connection()
+        replica = engines['replica'].raw_connection()
+        try:
+            primary.driver_connection.backup(replica.driver_connection)
+        finally:
+            replica.close()
+            primary.close()
+        click.echo('Replica is now a copy of the primary.')
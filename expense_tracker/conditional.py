@@ -0,0 +1,62 @@
+import hashlib
+from datetime import date, datetime, time, timezone
+from functools import wraps
+from flask import make_response, request, session
+from flask_login import current_user
+from category_cache import CATEGORIES_VERSION
+from versions import DATA_EPOCH, get_versions, user_data_version
+
+
+def _validators():
+    """ETag and Last-Modified for the current user's data, from one small query"""
+    versions = get_versions([user_data_version(current_user.id), CATEGORIES_VERSION, DATA_EPOCH])
+    # Pages roll over at midnight ("this month", "last 7 days") even without writes
+    today = date.today()
+    seed = ':'.join([request.full_path, str(current_user.id), current_user.username, today.isoformat()] +
+                    [str(version) for version, _ in versions.values()])
+    etag = hashlib.sha1(seed.encode()).hexdigest()
+
+    last_modified = datetime.combine(today, time.min).astimezone(timezone.utc)
+    for _, updated_at in versions.values():
+        if updated_at is not None:
+            last_modified = max(last_modified, updated_at.replace(tzinfo=timezone.utc))
+    return etag, last_modified
+
+
+def conditional_get(view):
+    """Answer repeat GETs with 304 Not Modified while the user's data is unchanged.
+
+    The check runs before the view, so an unchanged dashboard costs one
+    version lookup instead of its aggregate queries. Admin views span every
+    user's data and are always rendered in full.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flash messages are rendered into the page, so it must be fresh
+        if request.method != 'GET' or current_user.role == 'admin' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        etag, last_modified = _validators()
+        # HTTP dates only have whole seconds, so the ETag decides whenever
+        # the client sent one
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and last_modified.replace(microsecond=0) <= since
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # A write later in the same second would leave Last-Modified as it is,
+        # so it is only sent once that second is over
+        if last_modified.replace(microsecond=0) < datetime.now(timezone.utc).replace(microsecond=0):
+            response.last_modified = last_modified.replace(microsecond=0)
+        # Let browsers keep the page but revalidate on every view
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
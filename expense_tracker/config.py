@@ -1,6 +1,141 @@
 import os
 
+
+def engine_options(url, config):
+    """Pool settings for server databases; SQLite gets its PRAGMAs in database.py"""
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_pre_ping': True,
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+
+
+def database_url(default):
+    """DATABASE_URL from the environment, with Heroku's postgres:// scheme fixed"""
+    url = os.environ.get('DATABASE_URL', default)
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
 class Config:
-    SECRET_KEY = 'your-secret-key-here'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///expenses.db'
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    SQLALCHEMY_DATABASE_URI = database_url('sqlite:///expenses.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Longest date range /api/monthly_data will aggregate in one request
+    MONTHLY_DATA_MAX_DAYS = 366 * 20
+    ADMIN_USERS_PER_PAGE = 50
+    # Bulk import: rows per executemany batch and the fallback category
+    IMPORT_BATCH_SIZE = 5000
+    IMPORT_DEFAULT_CATEGORY = 'Other'
+    # Most items accepted by one /api/expenses request
+    API_BATCH_LIMIT = 1000
+    # Identity snapshots behind current_user: seconds before a worker
+    # re-reads a user (bounds how long role changes take to propagate)
+    USER_CACHE_TTL = 60
+    USER_CACHE_SIZE = 10000
+    # Per-worker memory for the NumPy arrays behind /api/analytics, and the
+    # longest period it analyses
+    ANALYTICS_CACHE_BYTES = int(os.environ.get('ANALYTICS_CACHE_BYTES', 256 * 1024 * 1024))
+    ANALYTICS_MAX_MONTHS = 120
+    # Connection pool for Postgres/MySQL; pre-ping and recycle drop
+    # connections the server or a proxy has closed while idle
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # SQLite: wait this long for a write lock before 'database is locked',
+    # and memory-map up to this many bytes of the file
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # Statements slower than this are logged and counted per endpoint
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+    # When set, /metrics requires "Authorization: Bearer <token>"; with
+    # METRICS_REQUIRE_TOKEN and no token set, /metrics is not served at all
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_REQUIRE_TOKEN = False
+    # Background jobs (`flask run-jobs`): worker threads, queue polling,
+    # when a silent running job counts as abandoned, and per-user limits
+    JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))
+    JOB_STALE_SECONDS = 600
+    JOB_MAX_PENDING_PER_USER = 3
+    JOB_CHUNK_SIZE = 2000
+    # Where job results are written (default: <instance>/job_results)
+    JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR')
+    # Optional read replica for GET-only views; after a write the same
+    # browser reads from the primary for this many seconds
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
+    # Werkzeug method for new password hashes; older hashes are upgraded
+    # on the user's next login (e.g. 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Hashing threads per process, hashes allowed to wait for them, and how
+    # long a request waits before it is answered 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5.0))
+    # Login admission control: attempts per client IP and failures per
+    # username from one client IP within the window, checked before any
+    # hashing
+    LOGIN_WINDOW_SECONDS = 300
+    LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('LOGIN_ATTEMPTS_PER_IP', 30))
+    LOGIN_FAILURES_PER_USERNAME = int(os.environ.get('LOGIN_FAILURES_PER_USERNAME', 5))
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted
+    # (the client IP feeds the login limits)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Expense shards: comma-separated database URLs that hold expenses and
+    # rollups per user (see shards.py); empty keeps them on the primary
+    SHARD_DATABASE_URLS = [url.strip() for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if url.strip()]
+    # Expense ids reserved from the primary per round trip when sharded
+    SHARD_ID_BLOCK_SIZE = 1000
+    # How long rebalance-shards waits for in-flight requests of a user it
+    # is about to move
+    SHARD_DRAIN_SECONDS = int(os.environ.get('SHARD_DRAIN_SECONDS', 30))
+    # `flask archive-expenses`: expenses dated more than this many days ago
+    # move to the per-year archive tables, this many rows per transaction
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_BATCH_SIZE = 20000
+
+    @staticmethod
+    def init_app(app):
+        """Derive engine options and the replica and shard binds from the database URLs"""
+        if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        extra = [('replica', app.config['REPLICA_DATABASE_URL'])]
+        extra += [(f'shard{number}', url) for number, url in enumerate(app.config['SHARD_DATABASE_URLS'])]
+        for key, url in extra:
+            if url and key not in binds:
+                if url.startswith('postgres://'):
+                    url = 'postgresql://' + url[len('postgres://'):]
+                binds[key] = dict(engine_options(url, app.config), url=url)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+
+
+class ProductionConfig(Config):
+    # The Heroku router sits in front of every request
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1))
+    # Per-endpoint traffic is not for the public internet
+    METRICS_REQUIRE_TOKEN = True
+
+
+config = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+    'default': DevelopmentConfig,
+}
@@ -1,20 +1,11 @@
 from app import create_app
-from models import db, User
+from commands import create_admin
 
 def create_admin_user():
+    # `flask create-admin` does the same with a password of your choice
     app = create_app()
     with app.app_context():
-        # Check if admin already exists
-        admin = User.query.filter_by(username='admin').first()
-        if not admin:
-            admin = User(
-                username='admin',
-                email='admin@example.com',
-                role='admin'
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
+        if create_admin('admin', 'admin@example.com', 'admin123'):
             print("Admin user created successfully!")
             print("Username: admin")
             print("Password: admin123")
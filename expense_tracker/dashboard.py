@@ -0,0 +1,112 @@
+import calendar
+from datetime import date, datetime, timedelta
+from sqlalchemy import BigInteger, Date, DateTime, Integer, String, and_, func, literal, null, select, type_coerce, union_all
+from models import db, Expense, DailyCategoryTotal, MonthlyCategoryTotal
+from category_cache import category_cache
+from money import from_cents
+from rollups import _as_date
+import budgets
+
+RECENT_LIMIT = 10
+SERIES_DAYS = 7
+
+
+def _typed_null(type_):
+    # Typed NULL placeholders give every UNION member the same columns
+    return type_coerce(null(), type_)
+
+
+def dashboard_statement(user_id, today):
+    """All dashboard widgets for one user as a single UNION ALL statement.
+
+    Rows are tagged by their `widget` column:
+      category - this month's total per category, from the monthly rollup
+      day      - one row per day of the last week, zero-filled by joining a
+                 CTE of literal dates against the rollup table
+      recent   - the newest expenses
+    Every branch is an index range read scoped to user_id.
+    """
+    rollup = DailyCategoryTotal
+    monthly = MonthlyCategoryTotal
+
+    categories = select(
+        literal('category', String).label('widget'),
+        monthly.category.label('label'),
+        _typed_null(Date).label('day'),
+        type_coerce(monthly.total_cents, BigInteger).label('cents'),
+        _typed_null(Integer).label('expense_id'),
+        _typed_null(String).label('description'),
+        _typed_null(DateTime).label('created_at'),
+    ).where(monthly.user_id == user_id, monthly.month == today.replace(day=1))
+
+    days = union_all(*[
+        select(literal(today - timedelta(days=offset), Date).label('day'))
+        for offset in range(SERIES_DAYS - 1, -1, -1)
+    ]).cte('series_days')
+    series = select(
+        literal('day', String),
+        _typed_null(String),
+        days.c.day,
+        func.coalesce(func.sum(rollup.total_cents), 0),
+        _typed_null(Integer),
+        _typed_null(String),
+        _typed_null(DateTime),
+    ).select_from(
+        days.outerjoin(rollup, and_(rollup.user_id == user_id, rollup.day == days.c.day))
+    ).group_by(days.c.day)
+
+    newest = select(Expense).where(Expense.user_id == user_id) \
+        .order_by(Expense.created_at.desc(), Expense.id.desc()).limit(RECENT_LIMIT).cte('recent')
+    recent = select(
+        literal('recent', String),
+        newest.c.category,
+        newest.c.date,
+        newest.c.amount_cents,
+        newest.c.id,
+        newest.c.description,
+        newest.c.created_at,
+    )
+
+    return union_all(categories, series, recent)
+
+
+def dashboard_data(user_id, today=None):
+    """Run dashboard_statement and shape its rows for the page and /api/dashboard"""
+    today = today or date.today()
+    category_rows, day_rows, recent_rows = [], [], []
+    for row in db.session.execute(dashboard_statement(user_id, today)):
+        if row.widget == 'category':
+            category_rows.append(row)
+        elif row.widget == 'day':
+            day_rows.append(row)
+        else:
+            recent_rows.append(row)
+
+    category_rows.sort(key=lambda row: row.label)
+    day_rows.sort(key=lambda row: _as_date(row.day))
+    recent_rows.sort(key=lambda row: (row.created_at or datetime.min, row.expense_id), reverse=True)
+    month_spend = {row.label: row.cents or 0 for row in category_rows}
+    return {
+        'month': calendar.month_name[today.month],
+        'monthly_total': from_cents(sum(row.cents or 0 for row in category_rows)),
+        'category_expenses': [
+            {'category': row.label, 'amount': from_cents(row.cents), 'color': category_cache.color(row.label)}
+            for row in category_rows
+        ],
+        'daily_expenses': [
+            {'date': _as_date(row.day).strftime('%Y-%m-%d'), 'amount': from_cents(row.cents)}
+            for row in day_rows
+        ],
+        'recent_expenses': [
+            {
+                'id': row.expense_id,
+                'amount': from_cents(row.cents),
+                'category': row.label,
+                'description': row.description,
+                'date': _as_date(row.day).strftime('%Y-%m-%d'),
+                'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else None,
+            }
+            for row in recent_rows
+        ],
+        'budgets': budgets.status(user_id, month_spend, today),
+    }
@@ -0,0 +1,155 @@
+import os
+import time
+from functools import wraps
+from flask import current_app, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+from sqlalchemy.sql.util import find_tables
+
+REPLICA_BIND = 'replica'
+# Flask session key holding the time until which this browser reads from the primary
+PRIMARY_UNTIL = '_read_primary_until'
+# Tables that live on the expense shards when SHARD_DATABASE_URLS is set,
+# along with the per-year archive tables named ARCHIVE_TABLE_PREFIX<year>
+SHARDED_TABLES = frozenset({'expense', 'daily_category_total', 'monthly_category_total', 'expense_fts',
+                            'expense_archive'})
+ARCHIVE_TABLE_PREFIX = 'expense_archive_'
+# Session.info key of the shard this session's expense statements go to;
+# None routes them to the primary (users whose data has not been moved yet)
+SHARD = 'shard'
+
+
+def shard_bind(number):
+    return f'shard{number}'
+
+
+class ShardNotSelected(RuntimeError):
+    """An expense statement ran before the session was routed to a shard"""
+
+
+def configure_sqlite(engine, config):
+    """Set per-connection PRAGMAs so concurrent workers can share one SQLite file.
+
+    WAL lets readers proceed while one writer commits, synchronous=NORMAL is
+    durable under WAL without an fsync per transaction, and busy_timeout makes
+    a blocked writer wait instead of failing with 'database is locked'.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(config["SQLITE_BUSY_TIMEOUT_MS"])}')
+        cursor.execute(f'PRAGMA mmap_size={int(config["SQLITE_MMAP_SIZE"])}')
+        cursor.close()
+
+
+def dispose_after_fork(engines):
+    """Give forked children (gunicorn --preload workers) pools of their own.
+
+    Connections opened in the parent must not be shared across processes;
+    dispose(close=False) drops the inherited ones without closing them under
+    the parent, and each child connects afresh on first use.
+    """
+    engines = list(engines)
+
+    def reset_pools():
+        for engine in engines:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset_pools)
+
+
+def _touches_shards(mapper, clause):
+    if mapper is not None and inspect(mapper).persist_selectable.name in SHARDED_TABLES:
+        return True
+    return clause is not None and any(
+        table.name in SHARDED_TABLES or table.name.startswith(ARCHIVE_TABLE_PREFIX)
+        for table in find_tables(clause, include_aliases=True, include_crud=True)
+    )
+
+
+class RoutingSession(Session):
+    """Session that routes expense statements to a shard and plain SELECTs
+    to the read replica when allowed.
+
+    With shards configured, anything touching SHARDED_TABLES goes to the
+    shard in info[SHARD] (see shards.py); everything else stays on the
+    primary. Replica routing is opt-in per request (see replica_reads).
+    Flushes and INSERT/UPDATE/DELETE statements always use the primary, and
+    once this session has written anything, or holds unflushed changes, its
+    reads stay on the primary too so it sees its own writes.
+    """
+
+    # Called for the shard when expense data is touched before one was
+    # selected; shards.init_app installs the logged-in user's lookup
+    resolve_shard = None
+
+    def _bind_arguments(self, statement, kwargs):
+        # ORM-enabled compound selects (UNION of model columns) reach get_bind
+        # without their statement; pass it along so they can be routed too
+        bind_arguments = dict(kwargs.get('bind_arguments') or {})
+        bind_arguments.setdefault('clause', statement)
+        return dict(kwargs, bind_arguments=bind_arguments)
+
+    def execute(self, statement, params=None, **kwargs):
+        return super().execute(statement, params, **self._bind_arguments(statement, kwargs))
+
+    def scalar(self, statement, params=None, **kwargs):
+        return super().scalar(statement, params, **self._bind_arguments(statement, kwargs))
+
+    def scalars(self, statement, params=None, **kwargs):
+        return super().scalars(statement, params, **self._bind_arguments(statement, kwargs))
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_bind(0) in self._db.engines and _touches_shards(mapper, clause):
+            if SHARD not in self.info:
+                if self.resolve_shard is None:
+                    raise ShardNotSelected('expense data is sharded; select a shard first (shards.use_user)')
+                self.info[SHARD] = self.resolve_shard()
+            if self.info[SHARD] is not None:
+                return self._db.engines[shard_bind(self.info[SHARD])]
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and not self._flushing and clause is not None:
+            if getattr(clause, 'is_dml', False):
+                self.info['wrote'] = True
+            elif (self.info.get('use_replica') and getattr(clause, 'is_select', False)
+                    and not self.info.get('wrote') and not (self.new or self.dirty or self.deleted)):
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+def replica_reads(view):
+    """Let a GET view read from the replica unless this browser wrote recently"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'GET' and session.get(PRIMARY_UNTIL, 0) <= time.time():
+            current_app.extensions['sqlalchemy'].session.info['use_replica'] = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replica_routing(app, db):
+    """Pin a browser to the primary for a while after any request that wrote.
+
+    Replicas apply the primary's changes with some lag, so the redirect after
+    add_expense would otherwise render a dashboard without the new expense.
+    """
+    if REPLICA_BIND not in app.config.get('SQLALCHEMY_BINDS', {}):
+        return
+
+    @app.after_request
+    def remember_write(response):
+        if db.session.info.get('wrote'):
+            session[PRIMARY_UNTIL] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
+        return response
@@ -0,0 +1,128 @@
+import csv
+import heapq
+import io
+import json
+from datetime import date, datetime
+from sqlalchemy import func, select
+from models import db, User
+from money import format_cents, from_cents
+import archive
+import shards
+
+EXPORT_COLUMNS = ['id', 'date', 'category', 'amount', 'description', 'created_at']
+AMOUNT_INDEX = EXPORT_COLUMNS.index('amount')
+
+# Content type and file extension per export format
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+def export_statement(args, owner_id, include_user=False):
+    """SELECT of the export columns for the listing filters in args, newest first.
+
+    Archived years are read when the filter's date range reaches them. With
+    include_user and shards the owner's user_id is selected instead of the
+    username, since users live on the primary.
+    """
+    source, conditions = archive.filtered(args, owner_id, archive.years_in_range(args))
+    columns = [source.id, source.date, source.category, source.amount_cents,
+               source.description, source.created_at]
+    if include_user and shards.enabled():
+        columns.append(source.user_id)
+    elif include_user:
+        columns.append(User.username)
+    statement = select(*columns).where(*conditions)
+    if include_user and not shards.enabled():
+        statement = statement.join(User, User.id == source.user_id)
+    return statement.order_by(source.date.desc(), source.id.desc())
+
+
+def count_rows(args, owner_id):
+    """Number of expenses export_rows(args, owner_id) yields at the current location"""
+    source, conditions = archive.filtered(args, owner_id, archive.years_in_range(args))
+    return db.session.execute(select(func.count(source.id)).where(*conditions)).scalar()
+
+
+def export_rows(args, owner_id, include_user=False, batch_size=1000):
+    """Yield plain result rows for the expenses matching the listing filters in args.
+
+    Rows are fetched batch_size at a time (a server-side cursor where the
+    driver supports one) and never become ORM objects, so memory use does
+    not depend on how many expenses match.
+    """
+    if include_user and shards.enabled():
+        yield from _all_shard_rows(args, owner_id, batch_size)
+        return
+    statement = export_statement(args, owner_id, include_user)
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def _all_shard_rows(args, owner_id, batch_size):
+    """export_rows for every user's expenses, merged newest first from each shard"""
+    # Each shard has its own archived years, so each gets its own statement
+    statements = [(location, export_statement(args, owner_id, include_user=True))
+                  for location in shards.each()]
+
+    def stream(location, statement):
+        with shards.engine(location).connect() as conn:
+            result = conn.execution_options(yield_per=batch_size).execute(statement)
+            for partition in result.partitions():
+                yield from partition
+
+    usernames = dict(db.session.execute(select(User.id, User.username)).all())
+    streams = [stream(location, statement) for location, statement in statements]
+    for row in heapq.merge(*streams, key=lambda row: (row[1], row[0]), reverse=True):
+        yield tuple(row[:-1]) + (usernames.get(row[-1]),)
+
+
+def _cell(value):
+    # Same date formats as Expense.to_dict()
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def generate_csv(rows, include_user=False, rows_per_chunk=500):
+    """Serialize rows as CSV text, yielding a chunk every rows_per_chunk rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS + (['username'] if include_user else []))
+    count = 0
+    for row in rows:
+        cells = ['' if value is None else _cell(value) for value in row]
+        cells[AMOUNT_INDEX] = format_cents(row[AMOUNT_INDEX])
+        writer.writerow(cells)
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def generate_jsonl(rows, include_user=False, rows_per_chunk=500):
+    """Serialize rows as one JSON object per line, yielding in chunks"""
+    keys = EXPORT_COLUMNS + (['username'] if include_user else [])
+    lines = []
+    for row in rows:
+        record = {key: _cell(value) for key, value in zip(keys, row)}
+        record['amount'] = from_cents(row[AMOUNT_INDEX])
+        lines.append(json.dumps(record))
+        if len(lines) >= rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def generate_export(file_format, args, owner_id, include_user=False):
+    rows = export_rows(args, owner_id, include_user)
+    if file_format == 'jsonl':
+        return generate_jsonl(rows, include_user)
+    return generate_csv(rows, include_user)
@@ -1,27 +1,99 @@
 from flask_wtf import FlaskForm
-from wtforms import FloatField, SelectField, StringField, DateField, SubmitField, PasswordField, EmailField, TextAreaField
+from flask_wtf.file import FileField, FileRequired
+from wtforms import DecimalField, SelectField, StringField, DateField, SubmitField, PasswordField, EmailField, TextAreaField
 from wtforms.validators import DataRequired, NumberRange, Email, EqualTo, Length, ValidationError
 from models import User
-from datetime import date
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+from werkzeug.datastructures import MultiDict
+from money import CENT
+
+AMOUNT_MIN = Decimal('0.01')
+DESCRIPTION_MAX_LENGTH = 200
+DATE_FORMAT = '%Y-%m-%d'
 
 class ExpenseForm(FlaskForm):
-    amount = FloatField('Amount', validators=[
+    amount = DecimalField('Amount', places=2, rounding=ROUND_HALF_UP, validators=[
         DataRequired(message='Amount is required'),
-        NumberRange(min=0.01, message='Amount must be greater than 0')
+        NumberRange(min=AMOUNT_MIN, message='Amount must be greater than 0')
     ])
     
     category = SelectField('Category', validators=[DataRequired()])
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, category_names=None, **kwargs):
         super(ExpenseForm, self).__init__(*args, **kwargs)
-        from models import Category
-        self.category.choices = [(c.name, c.name) for c in Category.query.order_by(Category.name).all()]
+        if category_names is None:
+            from category_cache import category_cache
+            self.category.choices = category_cache.choices()
+        else:
+            self.category.choices = [(name, name) for name in category_names]
     
     description = TextAreaField('Description', validators=[
-        Length(max=200, message='Description must be less than 200 characters')
+        Length(max=DESCRIPTION_MAX_LENGTH, message='Description must be less than 200 characters')
     ])
     
-    date = DateField('Date', validators=[DataRequired()], default=date.today)
+    date = DateField('Date', validators=[DataRequired()], default=date.today, format=DATE_FORMAT)
+
+def expense_validator(category_names, default_category=None):
+    """A function that validates plain dicts of expense fields with ExpenseForm.
+
+    Used where there is no form POST to bind to (imports, the JSON API); the
+    form is bound once and reprocessed for each dict, which keeps large
+    imports fast. Unknown categories are replaced by default_category when
+    one is given. The function returns (values, errors) where errors maps
+    field names to messages and values['amount'] is a Decimal rounded to
+    cents.
+    """
+    form = ExpenseForm(formdata=None, meta={'csrf': False}, category_names=category_names)
+
+    def clean(data):
+        formdata = MultiDict()
+        for field in ('amount', 'category', 'description', 'date'):
+            value = data.get(field)
+            if value is not None and not isinstance(value, date):
+                formdata[field] = str(value).strip()
+        if default_category and formdata.get('category') not in category_names:
+            formdata['category'] = default_category
+
+        # Dates the caller already parsed are passed as data; a missing date
+        # is an error here rather than the field's default of today
+        expense_date = data.get('date')
+        if isinstance(expense_date, datetime):
+            expense_date = expense_date.date()
+        form.process(formdata, date=expense_date if isinstance(expense_date, date) else None)
+        if not form.validate():
+            # DataRequired hides why a value did not parse; report that first
+            return {}, {field.name: (field.process_errors or field.errors)[0] for field in form if field.errors}
+        return {
+            'amount': form.amount.data.quantize(CENT, rounding=ROUND_HALF_UP),
+            'category': form.category.data,
+            'description': form.description.data or None,
+            'date': form.date.data,
+        }, {}
+
+    return clean
+
+class ImportForm(FlaskForm):
+    file = FileField('Bank export', validators=[FileRequired()])
+    file_format = SelectField('Format', choices=[('csv', 'CSV'), ('ofx', 'OFX / QFX')], default='csv')
+    # See importer.AMOUNT_SIGNS; OFX files always mark spending as negative
+    amount_signs = SelectField('CSV amounts', choices=[
+        ('bank', 'Spending is negative, credits positive (bank statement)'),
+        ('expenses', 'Spending is positive, refunds negative (expense list)'),
+    ], default='bank')
+    submit = SubmitField('Import')
+
+class BudgetForm(FlaskForm):
+    category = SelectField('Category', validators=[DataRequired()])
+    limit = DecimalField('Monthly limit', places=2, rounding=ROUND_HALF_UP, validators=[
+        DataRequired(message='Limit is required'),
+        NumberRange(min=AMOUNT_MIN, message='Limit must be greater than 0')
+    ])
+
+    def __init__(self, *args, **kwargs):
+        super(BudgetForm, self).__init__(*args, **kwargs)
+        from category_cache import category_cache
+        self.category.choices = category_cache.choices()
 
 class CategoryForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
@@ -0,0 +1,163 @@
+"""Bulk-load synthetic users and expenses for load and scaling tests.
+
+    python generate_data.py --users 10000 --expenses 50000000
+
+Rows are inserted with Core executemany in large batches (no ORM objects),
+then the daily/category rollups are rebuilt in one statement. The target
+database comes from DATABASE_URL like the app itself; with
+SHARD_DATABASE_URLS set each user's expenses go to their shard.
+"""
+import argparse
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, insert
+from werkzeug.security import generate_password_hash
+from app import create_app
+from commands import init_database, seed_categories
+from models import db, Expense, Category, User
+import rollups
+import search
+import shards
+
+# Share of expenses and typical amount (median, spread) per default category
+CATEGORY_PROFILES = {
+    'Food & Dining': (0.30, 18.0, 0.7),
+    'Transportation': (0.15, 25.0, 0.8),
+    'Shopping': (0.15, 45.0, 1.0),
+    'Entertainment': (0.10, 30.0, 0.8),
+    'Bills & Utilities': (0.08, 90.0, 0.5),
+    'Healthcare': (0.05, 60.0, 1.1),
+    'Education': (0.04, 80.0, 1.0),
+    'Travel': (0.03, 250.0, 1.0),
+    'Other': (0.10, 20.0, 1.0),
+}
+DEFAULT_PROFILE = (0.05, 30.0, 1.0)
+
+DESCRIPTIONS = ['Card payment', 'Online order', 'Subscription', 'Cash', None]
+
+GENERATED_PASSWORD = 'password'
+
+
+def create_users(count, batch_size):
+    """Insert count users sharing one password hash; returns their ids"""
+    last_id = db.session.query(func.max(User.id)).scalar() or 0
+    password_hash = generate_password_hash(GENERATED_PASSWORD)
+    now = datetime.utcnow()
+    for start in range(0, count, batch_size):
+        rows = [{
+            'username': f'user{number}',
+            'email': f'user{number}@example.com',
+            'password_hash': password_hash,
+            'role': 'customer',
+            'created_at': now,
+        } for number in range(last_id + start + 1, last_id + min(start + batch_size, count) + 1)]
+        db.session.execute(insert(User), rows)
+        db.session.commit()
+    return [user_id for (user_id,) in db.session.query(User.id).filter(User.id > last_id)]
+
+
+def user_weights(user_ids, rng):
+    # A few heavy users and a long tail of light ones, like real signups
+    return [rng.paretovariate(1.2) for _ in user_ids]
+
+
+def create_expenses(count, user_ids, days, batch_size, rng):
+    """Insert count expenses spread over the last `days` days; returns rows/sec"""
+    categories = [name for (name,) in db.session.query(Category.name)]
+    profiles = [CATEGORY_PROFILES.get(name, DEFAULT_PROFILE) for name in categories]
+    category_weights = [profile[0] for profile in profiles]
+    amount_params = [(math.log(profile[1]), profile[2]) for profile in profiles]
+    category_indexes = range(len(categories))
+    weights = user_weights(user_ids, rng)
+    homes = {user_id: shards.home(user_id) for user_id in user_ids} if shards.enabled() else None
+    today = date.today()
+
+    started = time.perf_counter()
+    inserted = 0
+    while inserted < count:
+        size = min(batch_size, count - inserted)
+        owners = rng.choices(user_ids, weights=weights, k=size)
+        picks = rng.choices(category_indexes, weights=category_weights, k=size)
+        rows = []
+        for owner, pick in zip(owners, picks):
+            # Recent days are busier than old ones (users join over time)
+            day = today - timedelta(days=int(rng.triangular(0, days, 0)))
+            mu, sigma = amount_params[pick]
+            rows.append({
+                'user_id': owner,
+                'amount_cents': max(1, int(rng.lognormvariate(mu, sigma) * 100)),
+                'category': categories[pick],
+                'description': rng.choice(DESCRIPTIONS),
+                'date': day,
+                'created_at': datetime(day.year, day.month, day.day) + timedelta(seconds=rng.randrange(86400)),
+            })
+        # Core insert on the table: the ORM bulk path would split the batch
+        # wherever a nullable column switches between NULL and a value
+        if homes is None:
+            db.session.execute(insert(Expense.__table__), rows)
+        else:
+            shards.assign_ids(rows)
+            by_home = defaultdict(list)
+            for row in rows:
+                by_home[homes[row['user_id']]].append(row)
+            for location, home_rows in by_home.items():
+                with shards.using(location):
+                    db.session.execute(insert(Expense.__table__), home_rows)
+        db.session.commit()
+        inserted += size
+        elapsed = time.perf_counter() - started
+        print(f'{inserted}/{count} expenses ({inserted / elapsed:.0f} rows/sec)', flush=True)
+    return inserted / (time.perf_counter() - started) if count else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--expenses', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=730, help='History length in days.')
+    parser.add_argument('--batch-size', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep-indexes', dest='defer_indexes', action='store_false',
+                        help='Maintain expense indexes during the load instead of rebuilding them after.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app = create_app()
+    with app.app_context():
+        init_database()
+        seed_categories()
+        user_ids = create_users(args.users, args.batch_size)
+        if not User.query.filter_by(role='admin').first():
+            admin = User(username='bench_admin', email='bench_admin@example.com', role='admin')
+            admin.set_password(GENERATED_PASSWORD)
+            db.session.add(admin)
+            db.session.commit()
+        # Building the secondary indexes (and the full-text index) once at
+        # the end is much cheaper than updating them row by row during the load
+        indexes = list(Expense.__table__.indexes) if args.defer_indexes else []
+        engines = [shards.engine(shard) for shard in range(shards.count())] or [db.engine]
+        for engine in engines:
+            for index in indexes:
+                index.drop(engine, checkfirst=True)
+            if args.defer_indexes:
+                with engine.begin() as conn:
+                    search.uninstall(conn)
+        try:
+            rate = create_expenses(args.expenses, user_ids, args.days, args.batch_size, rng)
+        finally:
+            for engine in engines:
+                for index in indexes:
+                    index.create(engine, checkfirst=True)
+                with engine.begin() as conn:
+                    search.install(conn)
+        started = time.perf_counter()
+        rows = sum(rollups.rebuild() for _ in shards.each())
+        print(f'Inserted {args.users} users and {args.expenses} expenses ({rate:.0f} rows/sec); '
+              f'rebuilt {rows} rollup rows in {time.perf_counter() - started:.1f}s.')
+
+
+if __name__ == '__main__':
+    main()
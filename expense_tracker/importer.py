@@ -0,0 +1,243 @@
+import csv
+import io
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert
+from models import db, Expense
+from forms import expense_validator, DATE_FORMAT
+from money import to_cents
+import rollups
+import shards
+
+# Column names seen in bank exports, mapped to Expense fields
+CSV_COLUMN_ALIASES = {
+    'date': 'date', 'transaction date': 'date', 'posted date': 'date', 'posting date': 'date',
+    'amount': 'amount', 'debit': 'amount', 'credit': 'credit',
+    'category': 'category',
+    'description': 'description', 'memo': 'description', 'payee': 'description', 'name': 'description',
+}
+
+# How a CSV's single amount column tells spending from credits: bank
+# statements (like OFX) write spending as negative amounts, expense lists
+# such as this app's own export write it as positive ones. Files with
+# separate debit and credit columns don't depend on it
+AMOUNT_SIGNS = ('bank', 'expenses')
+
+# Besides ISO dates, US-style dates are common in bank CSVs
+CSV_DATE_FORMATS = (DATE_FORMAT, '%m/%d/%Y')
+
+# Keep at most this many per-row errors so a bad file can't exhaust memory
+MAX_REPORTED_ERRORS = 1000
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class ImportReport:
+    """Counts, timing and per-row errors of one import run"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.credits_skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            'rows_read': self.rows_read,
+            'rows_imported': self.rows_imported,
+            'credits_skipped': self.credits_skipped,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def _normalize_date(value):
+    value = (value or '').strip()
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return value
+
+
+def _normalize_amount(value):
+    """(amount without its sign, whether it was negative) of a bank export amount.
+
+    Negative amounts may be written -12.00 or (12.00), with currency symbols.
+    """
+    value = (value or '').strip().replace('$', '').replace(',', '')
+    negative = value.startswith('-')
+    if value.startswith('(') and value.endswith(')'):
+        value = value[1:-1]
+        negative = True
+    return value.lstrip('+-') or None, negative
+
+
+def _positive(value):
+    """Whether an unsigned amount string is a number above zero"""
+    try:
+        return Decimal(value) > 0
+    except (InvalidOperation, TypeError):
+        return False
+
+
+def iter_csv_rows(stream, signs='bank'):
+    """Yield (line_number, fields) from a binary CSV stream, one row at a time.
+
+    Credits are marked with fields['credit']: rows with only a credit
+    column filled in, or else amounts whose sign is not the one signs (see
+    AMOUNT_SIGNS) gives spending. Only amounts that are numbers count as
+    credits; anything else is left for validation to report.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [CSV_COLUMN_ALIASES.get(name.strip().lower()) for name in header]
+    split_columns = 'credit' in columns
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        fields = {}
+        for column, value in zip(columns, row):
+            if column and column not in fields:
+                fields[column] = value
+        fields['date'] = _normalize_date(fields.get('date'))
+        fields['amount'], negative = _normalize_amount(fields.get('amount'))
+        credit, _ = _normalize_amount(fields.pop('credit', None))
+        if split_columns:
+            fields['credit'] = fields['amount'] is None and _positive(credit)
+        else:
+            fields['credit'] = _positive(fields['amount']) and negative != (signs == 'bank')
+        yield reader.line_num, fields
+
+
+def iter_ofx_rows(stream, chunk_size=64 * 1024):
+    """Yield (transaction_number, fields) for each transaction in a binary OFX stream.
+
+    OFX 1.x is SGML without closing tags for values and OFX 2.x is XML, so
+    the file is tokenised tag by tag from fixed-size chunks rather than
+    parsed as a document. Credits (positive amounts) are marked with
+    fields['credit'].
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    buffer = ''
+    current = None
+    number = 0
+    while True:
+        chunk = text.read(chunk_size)
+        buffer += chunk
+        # Only consume tags whose value is complete (followed by another '<')
+        end = len(buffer) if not chunk else buffer.rfind('<')
+        for match in OFX_TAG.finditer(buffer, 0, max(end, 0)):
+            closing, tag, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+            if tag == 'STMTTRN':
+                if closing and current is not None:
+                    number += 1
+                    amount = current.get('amount', '')
+                    yield number, {
+                        'amount': amount.lstrip('+-'),
+                        'date': _parse_ofx_date(current.get('date', '')),
+                        'description': current.get('name') or current.get('memo'),
+                        'category': None,
+                        'credit': not amount.startswith('-') and _positive(amount.lstrip('+')),
+                    }
+                    current = None
+                elif not closing:
+                    current = {}
+            elif current is not None and not closing and value:
+                if tag == 'TRNAMT':
+                    current['amount'] = value
+                elif tag == 'DTPOSTED':
+                    current['date'] = value
+                elif tag in ('NAME', 'MEMO'):
+                    current.setdefault(tag.lower(), value)
+        buffer = buffer[max(end, 0):]
+        if not chunk:
+            break
+
+
+def _parse_ofx_date(value):
+    try:
+        return datetime.strptime(value[:8], '%Y%m%d').date()
+    except ValueError:
+        return value
+
+
+def _flush(batch, deltas):
+    shards.assign_ids(batch)
+    db.session.execute(insert(Expense), batch)
+    rollups.apply_deltas(deltas)
+    db.session.commit()
+    batch.clear()
+    deltas.clear()
+
+
+def import_expenses(rows, user_id, category_names, default_category, batch_size=5000):
+    """Validate and insert (line, fields) rows for one user in batches.
+
+    Each batch is one executemany INSERT plus its rollup updates, committed
+    together; rows that fail validation are reported and skipped. Credits
+    (money coming in) are not expenses; they are counted and skipped.
+    """
+    report = ImportReport()
+    clean = expense_validator(set(category_names), default_category)
+    batch = []
+    deltas = defaultdict(lambda: [0, 0])
+    now = datetime.utcnow()
+
+    for line, fields in rows:
+        report.rows_read += 1
+        if fields.pop('credit', False):
+            report.credits_skipped += 1
+            continue
+        values, errors = clean(fields)
+        if errors:
+            report.add_error(line, '; '.join(f'{field}: {message}' for field, message in errors.items()))
+            continue
+
+        values['amount_cents'] = to_cents(values.pop('amount'))
+        values['user_id'] = user_id
+        values['created_at'] = now
+        batch.append(values)
+        delta = deltas[(user_id, values['date'], values['category'])]
+        delta[0] += values['amount_cents']
+        delta[1] += 1
+
+        if len(batch) >= batch_size:
+            report.rows_imported += len(batch)
+            _flush(batch, deltas)
+
+    if batch:
+        report.rows_imported += len(batch)
+        _flush(batch, deltas)
+    report.finish()
+    return report
+
+
+def rows_for_format(stream, file_format, signs='bank'):
+    if file_format == 'ofx':
+        return iter_ofx_rows(stream)
+    return iter_csv_rows(stream, signs)
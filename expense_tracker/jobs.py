@@ -0,0 +1,282 @@
+import csv
+import json
+import logging
+import os
+import secrets
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import extract, func, select, update
+from models import db, Budget, Category, DailyCategoryTotal, Expense, Job
+from category_cache import category_cache
+from money import format_cents
+import exporter
+import archive
+import rollups
+import shards
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# kind -> function(job, params); see the @handler functions below
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, owner_id, **params):
+    """Queue a job for `flask run-jobs` and commit so a worker can claim it"""
+    job = Job(kind=kind, user_id=owner_id, params=json.dumps(params), status='queued', progress=0)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def pending_count(user_id):
+    return Job.query.filter(Job.user_id == user_id, Job.status.in_(ACTIVE_STATUSES)).count()
+
+
+def find_active(kind, **params):
+    """An already queued or running job of this kind with exactly these params"""
+    return Job.query.filter(Job.kind == kind, Job.params == json.dumps(params),
+                            Job.status.in_(ACTIVE_STATUSES)).first()
+
+
+def progress(job, percent, message=None):
+    """Record progress in its own short transaction.
+
+    Handlers may be in the middle of a long read (a streamed export), so this
+    never touches their session; it also serves as the job's heartbeat.
+    """
+    values = {'progress': max(0, min(99, int(percent))), 'heartbeat_at': datetime.utcnow()}
+    if message is not None:
+        values['message'] = message[:255]
+    with db.engine.begin() as conn:
+        conn.execute(update(Job).where(Job.id == job.id).values(**values))
+
+
+def results_dir():
+    path = current_app.config['JOB_RESULTS_DIR'] or os.path.join(current_app.instance_path, 'job_results')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def result_file(job, name):
+    """Path to write a job's downloadable result to; recorded on the job.
+
+    Job ids are only unique per database, and databases can share a results
+    directory (dev and test databases, a restored backup), so the file name
+    also carries a random part.
+    """
+    job.result_name = name
+    job.result_path = os.path.join(results_dir(), f'{job.id}-{secrets.token_hex(8)}-{name}')
+    return job.result_path
+
+
+def claim_next():
+    """Atomically move the oldest queued job to running; returns its id or None"""
+    while True:
+        job_id = db.session.execute(
+            select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        now = datetime.utcnow()
+        # The status condition makes this a compare-and-set between workers
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', started_at=now, heartbeat_at=now)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def requeue_stale(seconds):
+    """Put running jobs whose worker stopped sending heartbeats back in the queue"""
+    cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+    count = db.session.execute(
+        update(Job).where(Job.status == 'running', Job.heartbeat_at < cutoff)
+        .values(status='queued', message='Requeued after its worker stopped')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        kind = job.kind
+        logger.info('Running job %s (%s)', job.id, kind)
+        try:
+            HANDLERS[kind](job, json.loads(job.params))
+            job.status = 'done'
+            job.progress = 100
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            # job may not be loadable until the rollback, so don't touch it here
+            logger.exception('Job %s (%s) failed', job_id, kind)
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.status = 'failed'
+            job.message = str(e)[:255]
+            job.finished_at = datetime.utcnow()
+            if kind == 'delete-category':
+                # Offer the category in the forms again
+                category_cache.invalidate()
+            db.session.commit()
+
+
+def run_worker(app, concurrency, poll_interval, once=False):
+    """Claim and run jobs on a pool of `concurrency` threads until interrupted.
+
+    With once=True the worker exits as soon as the queue is empty and all
+    claimed jobs have finished.
+    """
+    with app.app_context():
+        stale = requeue_stale(app.config['JOB_STALE_SECONDS'])
+        if stale:
+            logger.warning('Requeued %s stale jobs', stale)
+
+    running = set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job') as executor:
+        while True:
+            running = {future for future in running if not future.done()}
+            while len(running) < concurrency:
+                with app.app_context():
+                    job_id = claim_next()
+                if job_id is None:
+                    break
+                running.add(executor.submit(run_job, app, job_id))
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            elif once:
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+@handler('export')
+def export_job(job, params):
+    """Write an expense export to a file instead of streaming it from a web worker"""
+    # Jobs queued before filters existed only carry a category
+    filters = params.get('filters') or {'category': params.get('category')}
+    include_user = params.get('include_user', False)
+    file_format = params.get('format', 'csv')
+
+    total = sum(exporter.count_rows(filters, params.get('user_id'))
+                for _ in shards.each(params.get('user_id'))) or 1
+    if params.get('user_id') is not None and shards.enabled():
+        shards.use_user(params['user_id'])
+    _, extension = exporter.EXPORT_FORMATS[file_format]
+    rows_per_chunk = 500
+    with open(result_file(job, f'expenses.{extension}'), 'w', newline='') as f:
+        chunks = exporter.generate_export(file_format, filters, params.get('user_id'), include_user)
+        for number, chunk in enumerate(chunks, 1):
+            f.write(chunk)
+            if number % 100 == 0:
+                progress(job, number * rows_per_chunk * 100 / total, f'{number * rows_per_chunk} rows written')
+
+
+def _move_to_uncategorized(table, name, chunk_size):
+    """Move up to chunk_size of the category's rows in table, with their
+    rollup totals, to Uncategorized; returns how many moved"""
+    rows = db.session.execute(
+        select(table.c.id, table.c.user_id, table.c.date, table.c.amount_cents)
+        .where(table.c.category == name).limit(chunk_size)
+    ).all()
+    deltas = defaultdict(lambda: [0, 0])
+    for _, user_id, day, cents in rows:
+        for category, sign in ((name, -1), ('Uncategorized', 1)):
+            delta = deltas[(user_id, day, category)]
+            delta[0] += sign * cents
+            delta[1] += sign
+    if rows:
+        db.session.execute(
+            update(table).where(table.c.id.in_([row[0] for row in rows])).values(category='Uncategorized')
+        )
+        rollups.apply_deltas(deltas)
+    return len(rows)
+
+
+@handler('delete-category')
+def delete_category_job(job, params):
+    """Move a category's expenses to Uncategorized in chunks, then delete it.
+
+    Each chunk moves its expenses and their rollup totals in one commit, so
+    the dashboards stay consistent while the job runs. Archived expenses
+    are moved too, since the rollups still count them. Budgets for the
+    category are dropped with it.
+    """
+    name = params['name']
+    chunk_size = current_app.config['JOB_CHUNK_SIZE']
+    if not Category.query.filter_by(name='Uncategorized').first():
+        db.session.add(Category(name='Uncategorized', color='#999999'))
+        category_cache.invalidate()
+        db.session.commit()
+
+    total = sum(Expense.query.filter_by(category=name).count() for _ in shards.each()) or 1
+    moved = 0
+    for _ in shards.each():
+        for table in [Expense.__table__] + archive.tables():
+            while True:
+                count = _move_to_uncategorized(table, name, chunk_size)
+                if not count:
+                    break
+                db.session.commit()
+                moved += count
+                progress(job, moved * 100 / total, f'{moved} expenses moved')
+
+    # Expenses filed under the category since its last chunk are moved in
+    # the transaction that deletes it. The row lock (on SQLite, the write
+    # lock the budget delete takes) holds new ones back until it commits;
+    # the forms and the API stopped offering the category when the job was
+    # queued
+    category = db.session.execute(
+        select(Category).where(Category.id == params['category_id']).with_for_update()
+    ).scalar()
+    if category is not None:
+        Budget.query.filter_by(category=name).delete(synchronize_session=False)
+        for _ in shards.each():
+            for table in [Expense.__table__] + archive.tables():
+                while True:
+                    count = _move_to_uncategorized(table, name, chunk_size)
+                    if not count:
+                        break
+                    moved += count
+        db.session.delete(category)
+        category_cache.invalidate()
+    job.message = f'Deleted category {name}; {moved} expenses moved to Uncategorized'
+
+
+@handler('yearly-report')
+def yearly_report_job(job, params):
+    """Spend per category and year, with the change against the previous year"""
+    year = extract('year', DailyCategoryTotal.day)
+    query = db.session.query(DailyCategoryTotal.category, year, func.sum(DailyCategoryTotal.total_cents))
+    if params.get('user_id') is not None:
+        query = query.filter(DailyCategoryTotal.user_id == params['user_id'])
+    totals = defaultdict(lambda: defaultdict(int))
+    for _ in shards.each(params.get('user_id')):
+        for category, row_year, cents in query.group_by(DailyCategoryTotal.category, year):
+            totals[category][int(row_year)] += cents or 0
+    years = sorted({row_year for by_year in totals.values() for row_year in by_year})
+
+    with open(result_file(job, 'yearly_report.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category'] + years + ['change vs previous year'])
+        for category in sorted(totals):
+            by_year = totals[category]
+            change = ''
+            if len(years) >= 2 and by_year.get(years[-2]):
+                change = f'{(by_year.get(years[-1], 0) - by_year[years[-2]]) * 100 / by_year[years[-2]]:.1f}%'
+            writer.writerow([category] + [format_cents(by_year.get(y, 0)) for y in years] + [change])
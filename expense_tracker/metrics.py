@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition model"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Per-process request and SQL metrics, rendered as Prometheus text.
+
+    Each gunicorn worker keeps its own numbers; every series carries a
+    `worker` label so scrapes of different workers never look like resets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.sql_seconds = {}
+        self.slow_queries = {}
+
+    def record_request(self, endpoint, method, status, seconds, query_count, sql_seconds):
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((endpoint, method), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault((endpoint,), Histogram(QUERY_COUNT_BUCKETS)).observe(query_count)
+            self.sql_seconds[(endpoint,)] = self.sql_seconds.get((endpoint,), 0.0) + sql_seconds
+
+    def record_slow_query(self, endpoint):
+        with self.lock:
+            self.slow_queries[(endpoint,)] = self.slow_queries.get((endpoint,), 0) + 1
+
+    def _labels(self, names, values, **extra):
+        pairs = list(zip(names, values)) + list(extra.items()) + [('worker', os.getpid())]
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def _counter(self, lines, name, help_text, names, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for key, value in sorted(values.items()):
+            lines.append(f'{name}{self._labels(names, key)} {value}')
+
+    def _histogram(self, lines, name, help_text, names, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, histogram in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(names, key, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{self._labels(names, key, le="+Inf")} {histogram.count}')
+            lines.append(f'{name}_sum{self._labels(names, key)} {histogram.sum}')
+            lines.append(f'{name}_count{self._labels(names, key)} {histogram.count}')
+
+    def render(self):
+        lines = []
+        with self.lock:
+            self._counter(lines, 'http_requests_total', 'Requests handled, by endpoint, method and status.',
+                          ('endpoint', 'method', 'status'), self.requests)
+            self._histogram(lines, 'http_request_duration_seconds', 'Request latency.',
+                            ('endpoint', 'method'), self.latency)
+            self._histogram(lines, 'db_queries_per_request', 'SQL statements executed per request.',
+                            ('endpoint',), self.queries)
+            self._counter(lines, 'db_query_seconds_total', 'Time spent executing SQL.',
+                          ('endpoint',), self.sql_seconds)
+            self._counter(lines, 'db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.',
+                          ('endpoint',), self.slow_queries)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def init_app(app, engines):
+    """Time every request and every SQL statement it runs on any of engines"""
+    slow_seconds = app.config['SLOW_QUERY_MS'] / 1000
+
+    # The start time lives on the statement's execution context, which is
+    # thrown away with it when the statement fails
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_query_start', None)
+        if start is None or not has_request_context():
+            return
+        elapsed = time.perf_counter() - start
+        g._sql_queries = g.get('_sql_queries', 0) + 1
+        g._sql_seconds = g.get('_sql_seconds', 0.0) + elapsed
+        if elapsed >= slow_seconds:
+            registry.record_slow_query(_endpoint())
+            logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, _endpoint(),
+                           ' '.join(statement.split())[:1000])
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', start_query)
+        event.listen(engine, 'after_cursor_execute', end_query)
+
+    @app.before_request
+    def start_request():
+        g._request_start = time.perf_counter()
+
+    @app.after_request
+    def end_request(response):
+        start = g.get('_request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        query_count = g.get('_sql_queries', 0)
+        sql_seconds = g.get('_sql_seconds', 0.0)
+        registry.record_request(_endpoint(), request.method, response.status_code,
+                                elapsed, query_count, sql_seconds)
+        logger.debug('%s %s %s %.1f ms, %d queries in %.1f ms', request.method, request.path,
+                     response.status_code, elapsed * 1000, query_count, sql_seconds * 1000)
+        return response
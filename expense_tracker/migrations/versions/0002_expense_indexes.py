@@ -0,0 +1,36 @@
+"""composite indexes on expense
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_expense_user_date', ['user_id', 'date']),
+    ('ix_expense_user_created_at', ['user_id', 'created_at']),
+    ('ix_expense_date', ['date']),
+    ('ix_expense_category_date', ['category', 'date']),
+]
+
+
+def upgrade():
+    # Databases created by db.create_all() may already have some of these
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('expense')}
+    for name, columns in INDEXES:
+        if name not in existing:
+            op.create_index(name, 'expense', columns, unique=False)
+
+
+def downgrade():
+    for name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name='expense')
@@ -0,0 +1,59 @@
+"""store money as integer cents
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'amount' in _columns('expense'):
+        with op.batch_alter_table('expense', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('amount_cents', sa.Integer(), nullable=True))
+        op.execute('UPDATE expense SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER)')
+        with op.batch_alter_table('expense', schema=None) as batch_op:
+            batch_op.alter_column('amount_cents', existing_type=sa.Integer(), nullable=False)
+            batch_op.drop_column('amount')
+
+    if 'total' in _columns('daily_category_total'):
+        with op.batch_alter_table('daily_category_total', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('total_cents', sa.BigInteger(), nullable=True))
+        # Recompute from the converted expenses rather than rounding float sums
+        op.execute('UPDATE daily_category_total SET total_cents = ('
+                   'SELECT COALESCE(SUM(expense.amount_cents), 0) FROM expense '
+                   'WHERE expense.user_id = daily_category_total.user_id '
+                   'AND expense.date = daily_category_total.day '
+                   'AND expense.category = daily_category_total.category)')
+        with op.batch_alter_table('daily_category_total', schema=None) as batch_op:
+            batch_op.alter_column('total_cents', existing_type=sa.BigInteger(), nullable=False)
+            batch_op.drop_column('total')
+
+
+def downgrade():
+    with op.batch_alter_table('daily_category_total', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('total', sa.Float(), nullable=True))
+    op.execute('UPDATE daily_category_total SET total = total_cents / 100.0')
+    with op.batch_alter_table('daily_category_total', schema=None) as batch_op:
+        batch_op.alter_column('total', existing_type=sa.Float(), nullable=False)
+        batch_op.drop_column('total_cents')
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('amount', sa.Float(), nullable=True))
+    op.execute('UPDATE expense SET amount = amount_cents / 100.0')
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.alter_column('amount', existing_type=sa.Float(), nullable=False)
+        batch_op.drop_column('amount_cents')
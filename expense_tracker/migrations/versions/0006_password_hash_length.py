@@ -0,0 +1,36 @@
+"""widen user.password_hash for scrypt hashes
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Werkzeug's scrypt hashes are 162 characters; SQLite never enforced 128
+    columns = {c['name']: c['type'] for c in sa.inspect(op.get_bind()).get_columns('user')}
+    if (getattr(columns['password_hash'], 'length', None) or 0) >= 255:
+        return
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=128),
+               type_=sa.String(length=255),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=128),
+               existing_nullable=True)
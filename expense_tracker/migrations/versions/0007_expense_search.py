@@ -0,0 +1,52 @@
+"""full-text index over expense descriptions
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        if 'expense_fts' in sa.inspect(bind).get_table_names():
+            return
+        # Contentless FTS5 index with an owner token (u<user_id>) per row
+        op.execute("CREATE VIRTUAL TABLE expense_fts "
+                   "USING fts5(description, owner, content='', tokenize='porter unicode61')")
+        op.execute("CREATE TRIGGER expense_fts_insert AFTER INSERT ON expense BEGIN "
+                   "INSERT INTO expense_fts(rowid, description, owner) "
+                   "VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id); END")
+        op.execute("CREATE TRIGGER expense_fts_delete AFTER DELETE ON expense BEGIN "
+                   "INSERT INTO expense_fts(expense_fts, rowid, description, owner) "
+                   "VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id); END")
+        op.execute("CREATE TRIGGER expense_fts_update AFTER UPDATE OF description, user_id ON expense BEGIN "
+                   "INSERT INTO expense_fts(expense_fts, rowid, description, owner) "
+                   "VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id); "
+                   "INSERT INTO expense_fts(rowid, description, owner) "
+                   "VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id); END")
+        op.execute("INSERT INTO expense_fts(rowid, description, owner) "
+                   "SELECT id, coalesce(description, ''), 'u' || user_id FROM expense")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("CREATE INDEX IF NOT EXISTS ix_expense_description_fts ON expense "
+                   "USING gin (to_tsvector('english', coalesce(description, '')))")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for trigger in ('expense_fts_insert', 'expense_fts_delete', 'expense_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS expense_fts')
+    elif bind.dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_expense_description_fts')
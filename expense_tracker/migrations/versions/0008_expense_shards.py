@@ -0,0 +1,42 @@
+"""shard directory and id blocks for sharded expenses
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'user_shard' not in tables:
+        op.create_table('user_shard',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=True),
+        sa.Column('moving_to', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+        op.create_index('ix_user_shard_shard', 'user_shard', ['shard'], unique=False)
+    if 'id_block' not in tables:
+        op.create_table('id_block',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('next_id', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+        )
+
+
+def downgrade():
+    op.drop_table('id_block')
+    op.drop_index('ix_user_shard_shard', table_name='user_shard')
+    op.drop_table('user_shard')
@@ -0,0 +1,32 @@
+"""catalog of per-year expense archive tables
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The expense_archive_<year> tables themselves are created by
+    # `flask archive-expenses` as years are archived
+    if 'expense_archive' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('expense_archive',
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('archived_before', sa.Date(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('year')
+        )
+
+
+def downgrade():
+    op.drop_table('expense_archive')
@@ -0,0 +1,51 @@
+"""monthly category totals and budgets
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The monthly totals are backfilled by 0011; `flask reconcile-budgets`
+    # rebuilds them from the expenses
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'monthly_category_total' not in existing:
+        op.create_table('monthly_category_total',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('total_cents', sa.BigInteger(), nullable=False),
+        sa.Column('expense_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category'], ['category.name'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'month', 'category')
+        )
+    if 'budget' not in existing:
+        op.create_table('budget',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('limit_cents', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['category'], ['category.name'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'category', name='uq_budget_user_category')
+        )
+
+
+def downgrade():
+    op.drop_table('budget')
+    op.drop_table('monthly_category_total')
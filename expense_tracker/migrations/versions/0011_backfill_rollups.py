@@ -0,0 +1,57 @@
+"""backfill the daily and monthly rollups
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def _empty(conn, table):
+    return conn.execute(sa.text(f'SELECT 1 FROM {table} LIMIT 1')).first() is None
+
+
+def upgrade():
+    conn = op.get_bind()
+    # Databases from before the rollups have expenses but no daily rows;
+    # archived expenses are still counted in the daily rows they had
+    if _empty(conn, 'daily_category_total') and not _empty(conn, 'expense'):
+        op.execute('INSERT INTO daily_category_total (user_id, day, category, total_cents, expense_count) '
+                   'SELECT user_id, date, category, SUM(amount_cents), COUNT(*) FROM expense '
+                   'GROUP BY user_id, date, category')
+
+    # The monthly rows behind budgets are sums of the daily ones. Months are
+    # grouped with EXTRACT, which every database supports, and made dates here
+    if _empty(conn, 'monthly_category_total'):
+        daily = sa.table('daily_category_total', sa.column('user_id'), sa.column('day', sa.Date()),
+                         sa.column('category'), sa.column('total_cents'), sa.column('expense_count'))
+        year = sa.extract('year', daily.c.day)
+        month = sa.extract('month', daily.c.day)
+        rows = [
+            {'user_id': user_id, 'month': date(int(row_year), int(row_month), 1), 'category': category,
+             'total_cents': cents, 'expense_count': count}
+            for user_id, row_year, row_month, category, cents, count in conn.execute(
+                sa.select(daily.c.user_id, year, month, daily.c.category,
+                          sa.func.sum(daily.c.total_cents), sa.func.sum(daily.c.expense_count))
+                .group_by(daily.c.user_id, year, month, daily.c.category))
+        ]
+        if rows:
+            monthly = sa.table('monthly_category_total', sa.column('user_id'), sa.column('month', sa.Date()),
+                               sa.column('category'), sa.column('total_cents'), sa.column('expense_count'))
+            op.bulk_insert(monthly, rows)
+
+
+def downgrade():
+    # The rollups are kept up to date from here on; emptying them would
+    # only make the dashboards wrong
+    pass
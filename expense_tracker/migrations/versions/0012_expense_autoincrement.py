@@ -0,0 +1,69 @@
+"""never reuse expense ids on SQLite
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+# Recreating the table drops its triggers; these are the ones 0007 made
+FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_insert AFTER INSERT ON expense BEGIN "
+    "INSERT INTO expense_fts(rowid, description, owner) "
+    "VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_delete AFTER DELETE ON expense BEGIN "
+    "INSERT INTO expense_fts(expense_fts, rowid, description, owner) "
+    "VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS expense_fts_update AFTER UPDATE OF description, user_id ON expense BEGIN "
+    "INSERT INTO expense_fts(expense_fts, rowid, description, owner) "
+    "VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id); "
+    "INSERT INTO expense_fts(rowid, description, owner) "
+    "VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id); END",
+]
+
+
+def _recreate(autoincrement):
+    conn = op.get_bind()
+    with op.batch_alter_table('expense', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    if 'expense_fts' in sa.inspect(conn).get_table_names():
+        for statement in FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, so once the newest
+    # expense is deleted new ones can take the ids of archived expenses.
+    # Other databases already use sequences that never go back
+    conn = op.get_bind()
+    if conn.dialect.name != 'sqlite':
+        return
+    definition = conn.execute(sa.text("SELECT sql FROM sqlite_master WHERE name = 'expense'")).scalar()
+    if 'AUTOINCREMENT' not in definition.upper():
+        _recreate(True)
+
+    # Start above every id in use, archived ones included
+    highest = [conn.execute(sa.text('SELECT max(id) FROM expense')).scalar() or 0]
+    for year in conn.execute(sa.text('SELECT year FROM expense_archive')).scalars():
+        highest.append(conn.execute(sa.text(f'SELECT max(id) FROM expense_archive_{int(year)}')).scalar() or 0)
+    seq = max(highest)
+    if conn.execute(sa.text("SELECT 1 FROM sqlite_sequence WHERE name = 'expense'")).first():
+        conn.execute(sa.text("UPDATE sqlite_sequence SET seq = max(seq, :seq) WHERE name = 'expense'"),
+                     {'seq': seq})
+    else:
+        conn.execute(sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('expense', :seq)"), {'seq': seq})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        _recreate(False)
@@ -1,37 +1,60 @@
+import logging
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, date
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from money import to_cents, from_cents
+from database import RoutingSession
+import passwords
 
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     role = db.Column(db.String(20), default='customer')  # 'admin' or 'customer'
     expenses = db.relationship('Expense', backref='user', lazy=True)
+    budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify password; rehashes it (uncommitted) when the hash parameters changed"""
+        if not passwords.verify_password(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False)
+    # Stored as integer cents so sums are exact; use .amount for dollars
+    amount_cents = db.Column(db.Integer, nullable=False)
     category = db.Column(db.String(50), db.ForeignKey('category.name'), nullable=False)
     description = db.Column(db.String(200), nullable=True)
     date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # Hot paths: per-user date ranges and listings, the recent-expenses list,
+    # the admin listing by date and the category filter / category delete.
+    # AUTOINCREMENT keeps SQLite from reusing the ids of archived expenses
+    __table_args__ = (
+        db.Index('ix_expense_user_date', 'user_id', 'date'),
+        db.Index('ix_expense_user_created_at', 'user_id', 'created_at'),
+        db.Index('ix_expense_date', 'date'),
+        db.Index('ix_expense_category_date', 'category', 'date'),
+        {'sqlite_autoincrement': True},
+    )
+
     def __init__(self, **kwargs):
         if 'date' not in kwargs:
             kwargs['date'] = datetime.utcnow().date()
@@ -41,8 +64,18 @@ class Expense(db.Model):
             kwargs['date'] = kwargs['date'].date()
         super(Expense, self).__init__(**kwargs)
     
-    # Relationship with Category
-    category_info = db.relationship('Category', backref=db.backref('expenses', lazy=True))
+    # Relationship with Category. Categories are only deleted once their
+    # expenses have moved, so deleting one need not load them (they may be
+    # on another database when expenses are sharded)
+    category_info = db.relationship('Category', backref=db.backref('expenses', lazy=True, passive_deletes=True))
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents) if self.amount_cents is not None else None
+    
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
     
     def __repr__(self):
         return f'<Expense {self.amount} - {self.category}>'
@@ -56,7 +89,7 @@ class Expense(db.Model):
                 return self.date
             return str(self.date)
         except Exception as e:
-            print(f"Error formatting date: {e}")
+            logger.warning("Error formatting date %r: %s", self.date, e)
             return str(self.date)
 
     def to_dict(self):
@@ -76,3 +109,168 @@ class Category(db.Model):
     
     def __repr__(self):
         return f'<Category {self.name}>'
+
+class DailyCategoryTotal(db.Model):
+    """Pre-aggregated spend per user, day and category.
+
+    Kept in step with Expense by the helpers in rollups.py so the dashboard
+    and reports can sum a handful of rows instead of scanning every expense.
+    """
+    __tablename__ = 'daily_category_total'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), db.ForeignKey('category.name'), primary_key=True)
+    total_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_daily_category_total_day', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<DailyCategoryTotal {self.user_id} {self.day} {self.category}: {self.total_cents}>'
+
+class MonthlyCategoryTotal(db.Model):
+    """Spend per user, calendar month and category.
+
+    Updated together with DailyCategoryTotal (rollups.py), so the current
+    month's row is a running month-to-date counter that budgets read
+    without summing anything.
+    """
+    __tablename__ = 'monthly_category_total'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    category = db.Column(db.String(50), db.ForeignKey('category.name'), primary_key=True)
+    total_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<MonthlyCategoryTotal {self.user_id} {self.month} {self.category}: {self.total_cents}>'
+
+class Budget(db.Model):
+    """A user's monthly spending limit for one category"""
+    __tablename__ = 'budget'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'category', name='uq_budget_user_category'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(50), db.ForeignKey('category.name'), nullable=False)
+    limit_cents = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def limit(self):
+        return from_cents(self.limit_cents)
+
+    @limit.setter
+    def limit(self, value):
+        self.limit_cents = to_cents(value)
+
+    def __repr__(self):
+        return f'<Budget {self.user_id} {self.category}: {self.limit}>'
+
+class CacheVersion(db.Model):
+    """Counter bumped whenever a cached data set changes.
+
+    Each worker compares its cached copy against this row so changes made
+    through one gunicorn worker are seen by all the others.
+    """
+    __tablename__ = 'cache_version'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class Job(db.Model):
+    """A queued background task, run by `flask run-jobs` outside the web workers"""
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_user_created_at', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # percent
+    message = db.Column(db.String(255))
+    result_path = db.Column(db.String(255))
+    result_name = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'has_result': self.result_path is not None,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+class ExpenseArchive(db.Model):
+    """Catalog of the per-year archive tables (see archive.py).
+
+    Every expense in expense_archive_<year> is dated before archived_before,
+    so reads that stay after it never need the archive.
+    """
+    __tablename__ = 'expense_archive'
+
+    year = db.Column(db.Integer, primary_key=True)
+    archived_before = db.Column(db.Date, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ExpenseArchive {self.year} before {self.archived_before}>'
+
+class UserShard(db.Model):
+    """Directory of which expense shard holds each user's data (see shards.py).
+
+    shard is NULL while the user's expenses are still on the primary;
+    moving_to is set while rebalance-shards copies them somewhere else.
+    """
+    __tablename__ = 'user_shard'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=True)
+    moving_to = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_user_shard_shard', 'shard'),
+    )
+
+    def __repr__(self):
+        return f'<UserShard {self.user_id} -> {self.shard}>'
+
+class IdBlock(db.Model):
+    """High-water mark of ids handed out for a sharded table.
+
+    Shards can't number expenses on their own without clashing, so workers
+    reserve blocks of ids here and rebalancing keeps every id unchanged.
+    """
+    __tablename__ = 'id_block'
+
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f'<IdBlock {self.name}={self.next_id}>'
@@ -0,0 +1,23 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    """Convert an amount in dollars (str, float, int or Decimal) to integer cents"""
+    if value is None:
+        return None
+    amount = value if isinstance(value, Decimal) else Decimal(str(value))
+    return int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    """Amount in dollars for display and JSON; exact sums stay in cents until here"""
+    if cents is None:
+        return 0.0
+    return float(Decimal(int(cents)) / 100)
+
+
+def format_cents(cents):
+    """Fixed two-decimal string, e.g. 1250 -> '12.50'"""
+    return str((Decimal(int(cents or 0)) / 100).quantize(CENT))
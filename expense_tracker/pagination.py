@@ -0,0 +1,127 @@
+from datetime import date
+from flask import current_app
+from itsdangerous import BadData, URLSafeSerializer
+from sqlalchemy import and_, or_
+from models import Expense
+
+
+class KeysetPage:
+    """One page of expenses ordered by (date, id) descending.
+
+    Exposes `items` like Flask-SQLAlchemy's Pagination, plus opaque cursors
+    for the neighbouring pages instead of page numbers.
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='expense-cursor')
+
+
+def encode_cursor(expense):
+    return _serializer().dumps([expense.format_date(), expense.id])
+
+
+def decode_cursor(token):
+    """Return the (date, id) position in token, or None if it is missing or invalid"""
+    if not token:
+        return None
+    try:
+        day, expense_id = _serializer().loads(token)
+        return date.fromisoformat(day), int(expense_id)
+    except (BadData, TypeError, ValueError):
+        return None
+
+
+def keyset_query(query, after=None, before=None, entity=Expense):
+    """query seeked to the rows after/before a decoded (date, id) position.
+
+    Rows come newest first, or oldest first when seeking before a
+    position, so the caller's LIMIT always takes the rows nearest it. The
+    plain date bound next to the OR is what gives the index a range to
+    start from; the OR alone only narrows the rows it has already read.
+    """
+    if before:
+        day, expense_id = before
+        return query.filter(entity.date >= day, or_(
+            entity.date > day,
+            and_(entity.date == day, entity.id > expense_id)
+        )).order_by(entity.date.asc(), entity.id.asc())
+    if after:
+        day, expense_id = after
+        query = query.filter(entity.date <= day, or_(
+            entity.date < day,
+            and_(entity.date == day, entity.id < expense_id)
+        ))
+    return query.order_by(entity.date.desc(), entity.id.desc())
+
+
+def keyset_paginate(query, per_page, after=None, before=None, with_total=False, entity=Expense):
+    """Seek to the page after/before a cursor without OFFSET.
+
+    With an index on (date) or (user_id, date), as check-indexes verifies,
+    each page is an index range read that starts at the cursor's date, so
+    deep pages cost about as much as the first; rows sharing the cursor's
+    date are skipped by id. The total row count is only computed when with_total is set.
+    entity is what query selects: Expense, or an alias of it over a union
+    with the archive tables.
+    """
+    total = query.order_by(None).count() if with_total else None
+    after = decode_cursor(after)
+    before = None if after else decode_cursor(before)
+
+    rows = keyset_query(query, after, before, entity).limit(per_page + 1).all()
+    if before:
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after is not None
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next and items else None,
+        prev_cursor=encode_cursor(items[0]) if has_prev and items else None,
+        total=total
+    )
+
+
+def merge_keyset_pages(pages, per_page, after=None, before=None):
+    """Combine the same keyset page taken from several shards into one page.
+
+    Each shard returned its own per_page rows nearest the cursor; the
+    merged page keeps the per_page nearest overall.
+    """
+    backwards = decode_cursor(after) is None and decode_cursor(before) is not None
+    items = sorted((item for page in pages for item in page.items),
+                   key=lambda expense: (expense.date, expense.id), reverse=True)
+    if backwards:
+        has_prev = len(items) > per_page or any(page.has_prev for page in pages)
+        items = items[-per_page:]
+        has_next = True
+    else:
+        has_next = len(items) > per_page or any(page.has_next for page in pages)
+        items = items[:per_page]
+        has_prev = any(page.has_prev for page in pages)
+    totals = [page.total for page in pages]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next and items else None,
+        prev_cursor=encode_cursor(items[0]) if has_prev and items else None,
+        total=None if None in totals else sum(totals)
+    )
@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class HashingBusy(Exception):
+    """More password hashes are waiting than PASSWORD_HASH_QUEUE allows"""
+
+
+def _setting(name):
+    # Scripts such as create_admin.py may hash outside an app context
+    return current_app.config[name] if has_app_context() else getattr(Config, name)
+
+
+class Hasher:
+    """Runs password hashing on a small per-process thread pool.
+
+    The pool bounds how many hashes one worker computes at once, and a slot
+    count bounds how many may wait; past that callers get HashingBusy at
+    once instead of queueing behind a login burst. It does not free the
+    caller: the request thread still blocks on the result, for up to
+    PASSWORD_HASH_TIMEOUT, so each login occupies a gunicorn thread for
+    the length of its hash.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+        self.slots = None
+        self.prefixes = {}
+
+    def _pool(self):
+        # Threads do not survive a fork (gunicorn --preload), so build lazily per process
+        with self.lock:
+            if self.pid != os.getpid():
+                workers = _setting('PASSWORD_HASH_WORKERS')
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+                self.slots = threading.BoundedSemaphore(workers + _setting('PASSWORD_HASH_QUEUE'))
+                self.pid = os.getpid()
+            return self.executor, self.slots
+
+    def run(self, function, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = executor.submit(function, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=_setting('PASSWORD_HASH_TIMEOUT'))
+        except TimeoutError:
+            raise HashingBusy()
+
+    def prefix(self, method):
+        """Werkzeug's canonical "method:params" for method, e.g. scrypt -> scrypt:32768:8:1"""
+        if method not in self.prefixes:
+            self.prefixes[method] = generate_password_hash('', method).split('$', 1)[0]
+        return self.prefixes[method]
+
+
+hasher = Hasher()
+
+
+def hash_password(password):
+    return hasher.run(generate_password_hash, password, _setting('PASSWORD_HASH_METHOD'))
+
+
+def verify_password(pwhash, password):
+    if not pwhash:
+        return False
+    return hasher.run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True when pwhash was made with other parameters than PASSWORD_HASH_METHOD"""
+    return bool(pwhash) and pwhash.split('$', 1)[0] != hasher.prefix(_setting('PASSWORD_HASH_METHOD'))
+
+
+class SlidingWindow:
+    """Timestamps of recent events per key, for at most `size` keys (oldest dropped)"""
+
+    def __init__(self, size=10000):
+        self.lock = threading.Lock()
+        self.size = size
+        self.events = OrderedDict()
+
+    def retry_after(self, key, limit, window):
+        """Seconds until key is under limit again, 0 if it already is"""
+        now = time.monotonic()
+        with self.lock:
+            events = self.events.get(key)
+            if not events:
+                return 0
+            while events and events[0] <= now - window:
+                events.popleft()
+            if len(events) < limit:
+                return 0
+            return max(1, int(events[0] + window - now) + 1)
+
+    def add(self, key):
+        with self.lock:
+            events = self.events.get(key)
+            if events is None:
+                events = self.events[key] = deque()
+            else:
+                self.events.move_to_end(key)
+            events.append(time.monotonic())
+            while len(self.events) > self.size:
+                self.events.popitem(last=False)
+
+    def clear(self, key):
+        with self.lock:
+            self.events.pop(key, None)
+
+
+class LoginLimiter:
+    """Admission control in front of password verification.
+
+    Every attempt counts against the client IP, so one client cannot keep
+    the hash pool busy; failed attempts also count against the username
+    and IP together, which slows guessing one account without letting a
+    stranger lock its owner out from another address. Counts are per
+    worker process, so the effective limits scale with the worker count.
+    """
+
+    def __init__(self):
+        self.attempts = SlidingWindow()
+        self.failures = SlidingWindow()
+
+    def check(self, ip, username):
+        """Seconds the client must wait before this attempt is allowed, or 0"""
+        window = _setting('LOGIN_WINDOW_SECONDS')
+        return max(self.attempts.retry_after(ip, _setting('LOGIN_ATTEMPTS_PER_IP'), window),
+                   self.failures.retry_after((username.lower(), ip), _setting('LOGIN_FAILURES_PER_USERNAME'), window))
+
+    def attempted(self, ip):
+        self.attempts.add(ip)
+
+    def failed(self, ip, username):
+        self.failures.add((username.lower(), ip))
+
+    def succeeded(self, ip, username):
+        self.failures.clear((username.lower(), ip))
+
+
+login_limiter = LoginLimiter()
@@ -0,0 +1,247 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import extract, func, insert, select
+from models import db, DailyCategoryTotal, MonthlyCategoryTotal
+from versions import DATA_EPOCH, bump_version, user_data_version
+import archive
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+# Each expense counts in a per-day and a per-month rollup row:
+# (model, name of its period column, first day of the period holding a day)
+LEVELS = (
+    (DailyCategoryTotal, 'day', lambda day: day),
+    (MonthlyCategoryTotal, 'month', lambda day: day.replace(day=1)),
+)
+
+
+def _apply_row(model, period, key, cents, count):
+    row = db.session.get(model, key)
+    if row is None:
+        if count <= 0:
+            return
+        row = model(user_id=key[0], category=key[2], total_cents=0, expense_count=0, **{period: key[1]})
+        db.session.add(row)
+    row.total_cents = (row.total_cents or 0) + cents
+    row.expense_count = (row.expense_count or 0) + count
+    if row.expense_count <= 0:
+        db.session.delete(row)
+
+
+def apply_delta(user_id, day, category, cents, count):
+    """Add cents/count to the rollup rows of one day inside the current session.
+
+    Nothing is committed here; the caller commits together with the expense
+    change so the rollups can never drift from the rows they summarise.
+    """
+    day = _as_date(day)
+    for model, period, start in LEVELS:
+        _apply_row(model, period, (user_id, start(day), category), cents, count)
+
+
+def apply_deltas(deltas):
+    """Apply many {(user_id, day, category): (cents, count)} changes at once.
+
+    Bulk writers (imports, the JSON API) use this instead of apply_delta so a
+    batch costs one read per user and level plus one executemany for new
+    rows, rather than a round trip per rollup key.
+    """
+    for model, period, start in LEVELS:
+        by_user = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        for (user_id, day, category), (cents, count) in deltas.items():
+            change = by_user[user_id][(start(_as_date(day)), category)]
+            change[0] += cents
+            change[1] += count
+
+        column = getattr(model, period)
+        new_rows = []
+        with db.session.no_autoflush:
+            for user_id, changes in by_user.items():
+                periods = [key[0] for key in changes]
+                existing = {
+                    (getattr(row, period), row.category): row
+                    for row in model.query.filter(
+                        model.user_id == user_id, column >= min(periods), column <= max(periods)
+                    )
+                }
+                for key, (cents, count) in changes.items():
+                    row = existing.get(key)
+                    if row is None:
+                        if count > 0:
+                            new_rows.append({'user_id': user_id, period: key[0], 'category': key[1],
+                                             'total_cents': cents, 'expense_count': count})
+                        continue
+                    row.total_cents = (row.total_cents or 0) + cents
+                    row.expense_count = (row.expense_count or 0) + count
+                    if row.expense_count <= 0:
+                        db.session.delete(row)
+        if new_rows:
+            db.session.execute(insert(model), new_rows)
+    for user_id in {key[0] for key in deltas}:
+        bump_version(user_data_version(user_id))
+
+
+def snapshot(expense):
+    """Capture the rollup key and amount of an expense before it is edited"""
+    return (expense.user_id, _as_date(expense.date), expense.category, expense.amount_cents)
+
+
+def record_added(expense):
+    apply_delta(expense.user_id, expense.date, expense.category, expense.amount_cents, 1)
+    bump_version(user_data_version(expense.user_id))
+
+
+def record_removed(expense):
+    apply_delta(expense.user_id, expense.date, expense.category, -expense.amount_cents, -1)
+    bump_version(user_data_version(expense.user_id))
+
+
+def record_changed(before, expense):
+    # Also called for description-only edits, which still change what users see
+    user_id, day, category, cents = before
+    for model, period, start in LEVELS:
+        old = (user_id, start(day), category)
+        new = (expense.user_id, start(_as_date(expense.date)), expense.category)
+        if old == new:
+            # Same row: removing first would delete it when this is its only expense
+            _apply_row(model, period, old, expense.amount_cents - cents, 0)
+        else:
+            _apply_row(model, period, old, -cents, -1)
+            _apply_row(model, period, new, expense.amount_cents, 1)
+    bump_version(user_data_version(expense.user_id))
+
+
+def period_start(day, granularity):
+    """First day of the day/week/month bucket that contains day (weeks start on Monday)"""
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def next_period(start, granularity):
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    return start + timedelta(days=1)
+
+
+def total_statement(start=None, end=None):
+    """Spend of every user from the daily rollup, over [start, end) when given"""
+    statement = select(func.sum(DailyCategoryTotal.total_cents))
+    if start is not None:
+        statement = statement.where(DailyCategoryTotal.day >= start, DailyCategoryTotal.day < end)
+    return statement
+
+
+def user_totals_statement():
+    """(user_id, total) rows of each user's spend from the daily rollup"""
+    return select(DailyCategoryTotal.user_id, func.sum(DailyCategoryTotal.total_cents).label('total')) \
+        .group_by(DailyCategoryTotal.user_id)
+
+
+def spend_series(start, end, granularity='month', user_id=None):
+    """Zero-filled spend per period over the half-open range [start, end).
+
+    Runs a single grouped query on the rollup table; months are grouped in
+    SQL, days and weeks are grouped by day and folded into weeks here.
+    Returns a list of (period_start, total_cents) tuples.
+    """
+    filters = [DailyCategoryTotal.day >= start, DailyCategoryTotal.day < end]
+    if user_id is not None:
+        filters.append(DailyCategoryTotal.user_id == user_id)
+
+    totals = defaultdict(int)
+    if granularity == 'month':
+        year = extract('year', DailyCategoryTotal.day)
+        month = extract('month', DailyCategoryTotal.day)
+        rows = db.session.query(year, month, func.sum(DailyCategoryTotal.total_cents)) \
+            .filter(*filters).group_by(year, month).all()
+        for row_year, row_month, total in rows:
+            totals[date(int(row_year), int(row_month), 1)] += total or 0
+    else:
+        rows = db.session.query(DailyCategoryTotal.day, func.sum(DailyCategoryTotal.total_cents)) \
+            .filter(*filters).group_by(DailyCategoryTotal.day).all()
+        for day, total in rows:
+            totals[period_start(_as_date(day), granularity)] += total or 0
+
+    series = []
+    current = period_start(start, granularity)
+    while current < end:
+        series.append((current, totals.get(current, 0)))
+        current = next_period(current, granularity)
+    return series
+
+
+def _expense_source(user_id):
+    # Archived expenses are included; the rollups always cover the whole history
+    return archive.source(lambda expenses: [] if user_id is None else [expenses.user_id == user_id],
+                          archive.catalog())
+
+
+def rebuild(user_id=None):
+    """Recompute the daily and monthly rollup rows from Expense, for all users or just one.
+
+    Returns the number of rollup rows written. Used for the initial backfill
+    and to repair the tables after manual edits to the expense data.
+    """
+    delete_query = DailyCategoryTotal.query
+    if user_id is not None:
+        delete_query = delete_query.filter_by(user_id=user_id)
+    expenses, conditions = _expense_source(user_id)
+    source = select(
+        expenses.user_id,
+        expenses.date,
+        expenses.category,
+        func.sum(expenses.amount_cents),
+        func.count(expenses.id)
+    ).where(*conditions).group_by(expenses.user_id, expenses.date, expenses.category)
+
+    delete_query.delete(synchronize_session=False)
+    bump_version(user_data_version(user_id) if user_id is not None else DATA_EPOCH)
+    result = db.session.execute(
+        insert(DailyCategoryTotal).from_select(
+            ['user_id', 'day', 'category', 'total_cents', 'expense_count'], source
+        )
+    )
+    db.session.commit()
+    return result.rowcount + rebuild_monthly(user_id)
+
+
+def rebuild_monthly(user_id=None, batch_size=5000):
+    """Recompute the monthly rollup rows (the budget counters) from Expense.
+
+    Months are grouped with EXTRACT, which every database supports, and
+    turned into dates here. Returns the number of rows written.
+    """
+    delete_query = MonthlyCategoryTotal.query
+    if user_id is not None:
+        delete_query = delete_query.filter_by(user_id=user_id)
+    expenses, conditions = _expense_source(user_id)
+    year = extract('year', expenses.date)
+    month = extract('month', expenses.date)
+    source = select(
+        expenses.user_id, year, month, expenses.category,
+        func.sum(expenses.amount_cents), func.count(expenses.id)
+    ).where(*conditions).group_by(expenses.user_id, year, month, expenses.category)
+
+    delete_query.delete(synchronize_session=False)
+    bump_version(user_data_version(user_id) if user_id is not None else DATA_EPOCH)
+    rows = [
+        {'user_id': row_user_id, 'month': date(int(row_year), int(row_month), 1), 'category': category,
+         'total_cents': cents, 'expense_count': count}
+        for row_user_id, row_year, row_month, category, cents, count in db.session.execute(source)
+    ]
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(MonthlyCategoryTotal), rows[start:start + batch_size])
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,197 @@
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import func, literal_column, select, table, text
+from models import db, Expense
+from money import to_cents
+
+FTS_TABLE = 'expense_fts'
+POSTGRES_INDEX = 'ix_expense_description_fts'
+TEXT_SEARCH_CONFIG = 'english'
+# Longest search accepted; more words rarely narrow it further
+MAX_TERMS = 8
+# Query string arguments of the expense listing filters, in URL order
+FILTER_ARGS = ('q', 'category', 'date_from', 'date_to', 'min_amount', 'max_amount')
+
+# SQLite: a contentless FTS5 index kept in sync by triggers. Besides the
+# description it indexes an "owner" token (u<user_id>), so a customer's
+# search intersects two posting lists instead of filtering every match in
+# the table by user_id afterwards.
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+        USING fts5(description, owner, content='', tokenize='porter unicode61')""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_fts_insert AFTER INSERT ON expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, owner)
+        VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_fts_delete AFTER DELETE ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, owner)
+        VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_fts_update AFTER UPDATE OF description, user_id ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, owner)
+        VALUES ('delete', old.id, coalesce(old.description, ''), 'u' || old.user_id);
+        INSERT INTO {FTS_TABLE}(rowid, description, owner)
+        VALUES (new.id, coalesce(new.description, ''), 'u' || new.user_id);
+    END""",
+]
+SQLITE_BACKFILL = f"""INSERT INTO {FTS_TABLE}(rowid, description, owner)
+    SELECT id, coalesce(description, ''), 'u' || user_id FROM expense"""
+
+# Postgres: a GIN index on the same expression the queries below use
+POSTGRES_DDL = [
+    f"""CREATE INDEX IF NOT EXISTS {POSTGRES_INDEX} ON expense
+        USING gin (to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(description, '')))""",
+]
+
+
+def install(connection):
+    """Create the full-text index for connection's database if it is missing.
+
+    Returns True when it was created (and, on SQLite, filled from expense).
+    Other databases get no index; searches there fall back to LIKE.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                    {'name': FTS_TABLE}).first()
+        if exists:
+            return False
+        for statement in SQLITE_DDL:
+            connection.execute(text(statement))
+        connection.execute(text(SQLITE_BACKFILL))
+        return True
+    if dialect == 'postgresql':
+        exists = connection.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                                    {'name': POSTGRES_INDEX}).first()
+        for statement in POSTGRES_DDL:
+            connection.execute(text(statement))
+        return not exists
+    return False
+
+
+def uninstall(connection):
+    """Drop the SQLite index and triggers, e.g. around a bulk load; install() rebuilds it"""
+    if connection.dialect.name == 'sqlite':
+        for trigger in ('expense_fts_insert', 'expense_fts_delete', 'expense_fts_update'):
+            connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+        connection.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+
+
+def search_terms(q):
+    return re.findall(r'\w+', q or '')[:MAX_TERMS]
+
+
+def _fts_query(terms, owner_id):
+    # Quoted terms can't be read as FTS5 operators; the last one matches as a prefix
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += '*'
+    query = f'description:({" ".join(phrases)})'
+    if owner_id is not None:
+        query = f'owner:u{int(owner_id)} AND {query}'
+    return query
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _sqlite_matches(terms, owner_id):
+    fts = table(FTS_TABLE)
+    return select(
+        literal_column('rowid').label('id'),
+        literal_column(f'bm25({FTS_TABLE}, 1.0, 0.0)').label('rank'),
+    ).select_from(fts).where(literal_column(FTS_TABLE).op('MATCH')(_fts_query(terms, owner_id)))
+
+
+def _postgres_vectors(terms):
+    config = literal_column(f"'{TEXT_SEARCH_CONFIG}'")
+    vector = func.to_tsvector(config, func.coalesce(Expense.description, ''))
+    query = func.to_tsquery(config, ' & '.join(terms[:-1] + [terms[-1] + ':*']))
+    return vector, query
+
+
+def condition(q, owner_id, source=Expense):
+    """SQL condition for expenses whose description matches q, or None without terms.
+
+    source is Expense or the columns of an archive table; archive tables
+    have no full-text index and are matched with LIKE.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return None
+    dialect = _dialect() if source is Expense else None
+    if dialect == 'sqlite':
+        return Expense.id.in_(_sqlite_matches(terms, owner_id).with_only_columns(literal_column('rowid')))
+    if dialect == 'postgresql':
+        vector, query = _postgres_vectors(terms)
+        return vector.op('@@')(query)
+    return db.and_(*[source.description.ilike(f'%{term}%') for term in terms])
+
+
+def ranked(query, q, owner_id):
+    """Restrict an Expense query to matches for q, best match first"""
+    terms = search_terms(q)
+    if not terms:
+        return query
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        # Materialized so the MATCH runs once; otherwise SQLite may probe the
+        # index once per expense row when counting pages
+        matches = _sqlite_matches(terms, owner_id).cte('matches').prefix_with('MATERIALIZED')
+        # bm25() is negative; lower is a better match
+        return query.join(matches, matches.c.id == Expense.id).order_by(matches.c.rank, Expense.id.desc())
+    if dialect == 'postgresql':
+        vector, tsquery = _postgres_vectors(terms)
+        return query.filter(vector.op('@@')(tsquery)) \
+            .order_by(func.ts_rank(vector, tsquery).desc(), Expense.id.desc())
+    return query.filter(condition(q, owner_id)).order_by(Expense.date.desc(), Expense.id.desc())
+
+
+def _amount(value):
+    try:
+        return to_cents(Decimal(value)) if value else None
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _day(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def active_filters(args):
+    """The non-empty filter arguments in args, to carry into links and jobs"""
+    return {name: args.get(name).strip() for name in FILTER_ARGS if (args.get(name) or '').strip()}
+
+
+def date_range(args):
+    """The (date_from, date_to) filter in args; either may be None"""
+    return _day(args.get('date_from')), _day(args.get('date_to'))
+
+
+def filter_conditions(args, owner_id, source=Expense):
+    """Conditions for the category, date-range and amount filters in args.
+
+    owner_id scopes them to one user; None means every user's expenses. The
+    q search is applied separately with condition() or ranked(). source is
+    Expense or the columns of an archive table.
+    """
+    conditions = []
+    if owner_id is not None:
+        conditions.append(source.user_id == owner_id)
+    if args.get('category'):
+        conditions.append(source.category == args.get('category'))
+    date_from, date_to = date_range(args)
+    if date_from:
+        conditions.append(source.date >= date_from)
+    if date_to:
+        conditions.append(source.date <= date_to)
+    min_cents, max_cents = _amount(args.get('min_amount')), _amount(args.get('max_amount'))
+    if min_cents is not None:
+        conditions.append(source.amount_cents >= min_cents)
+    if max_cents is not None:
+        conditions.append(source.amount_cents <= max_cents)
+    return conditions
@@ -0,0 +1,451 @@
+"""Per-user sharding of expense data.
+
+With SHARD_DATABASE_URLS set, Expense rows and their rollups live on one
+of N shard databases chosen per user; users, categories, budgets, jobs and
+the cache versions stay on the primary. The user_shard directory table on the
+primary records each user's shard, so users can be moved between shards
+(flask rebalance-shards) without changing how they are found.
+
+Each request is routed to the logged-in user's shard the first time it
+touches expense data (init_app). Code that works across users - admin pages, jobs, commands -
+either visits the shards in turn with each() or queries them in parallel
+with fan_out().
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app, g, has_request_context
+from flask_login import current_user
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from database import SHARD, RoutingSession, ShardNotSelected, shard_bind
+from models import db, DailyCategoryTotal, Expense, ExpenseArchive, IdBlock, MonthlyCategoryTotal, UserShard
+import archive
+import rollups
+import search
+
+logger = logging.getLogger(__name__)
+
+SHARDED_MODELS = (Expense, DailyCategoryTotal, MonthlyCategoryTotal, ExpenseArchive)
+# Rows fetched per round trip when copying a user between shards
+COPY_BATCH_SIZE = 5000
+
+
+class UserMoving(Exception):
+    """The user's expenses are being moved to another shard; retry shortly"""
+
+
+def count():
+    return len(current_app.config['SHARD_DATABASE_URLS'])
+
+
+def enabled():
+    return count() > 0
+
+
+def engine(location):
+    """Engine for a shard number, or the primary for None"""
+    return db.engine if location is None else db.engines[shard_bind(location)]
+
+
+def locations():
+    """Every database that may hold expenses: the shards, plus the primary
+    while it still has rows of users who have not been moved off it"""
+    if not enabled():
+        return [None]
+    with db.engine.connect() as conn:
+        on_primary = conn.execute(select(Expense.id).limit(1)).first() is not None or bool(archive.catalog(conn))
+    return list(range(count())) + ([None] if on_primary else [])
+
+
+# Directory
+
+def placement(user_id):
+    """(shard, moving_to) for a user, placing users seen for the first time.
+
+    New users go to shard user_id % count. Users who already have expenses
+    on the primary stay there (shard None) until rebalance-shards moves them.
+    Reads use their own primary connection so a placement made by a
+    concurrent request is always visible.
+    """
+    lookup = select(UserShard.shard, UserShard.moving_to).where(UserShard.user_id == user_id)
+    with db.engine.connect() as conn:
+        row = conn.execute(lookup).first()
+    if row is not None:
+        return row.shard, row.moving_to
+    try:
+        with db.engine.begin() as conn:
+            on_primary = conn.execute(select(Expense.id).where(Expense.user_id == user_id).limit(1)).first()
+            shard = None if on_primary else user_id % count()
+            conn.execute(insert(UserShard).values(user_id=user_id, shard=shard, updated_at=datetime.utcnow()))
+        return shard, None
+    except IntegrityError:
+        # Placed by a concurrent request in the meantime
+        with db.engine.connect() as conn:
+            row = conn.execute(lookup).one()
+        return row.shard, row.moving_to
+
+
+def use(location):
+    """Route this session's expense statements to a shard (None: the primary)"""
+    db.session.info[SHARD] = location
+
+
+def home(user_id):
+    """The location of a user's expenses; raises UserMoving during a move"""
+    location, moving_to = placement(user_id)
+    if moving_to is not None:
+        raise UserMoving(user_id)
+    return location
+
+
+def use_user(user_id):
+    """Route this session to the user's shard"""
+    location = home(user_id)
+    use(location)
+    return location
+
+
+@contextmanager
+def using(location):
+    """Route to location for the duration of the block.
+
+    Pending changes are flushed on the way in and out, so they always reach
+    the shard they were made for.
+    """
+    session = db.session
+    missing = object()
+    previous = session.info.get(SHARD, missing)
+    session.flush()
+    session.info[SHARD] = location
+    try:
+        yield location
+        session.flush()
+    finally:
+        if previous is missing:
+            session.info.pop(SHARD, None)
+        else:
+            session.info[SHARD] = previous
+
+
+def each(user_id=None):
+    """Route to every location in turn, yielding each one.
+
+    With user_id only the location of that user's expenses is visited.
+    """
+    if user_id is None:
+        targets = locations()
+    else:
+        targets = [home(user_id) if enabled() else None]
+    for location in targets:
+        with using(location):
+            yield location
+
+
+_pool_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def _executor():
+    # One pool per process; threads do not survive gunicorn's fork
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=count() + 1, thread_name_prefix='shard')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def fan_out(function):
+    """Call function(connection) on every location in parallel.
+
+    Returns [(location, result), ...]. Each call gets its own connection, so
+    function must only read.
+    """
+    targets = locations()
+    # Engines are looked up here: the pool threads have no app context
+    engines = [engine(location) for location in targets]
+
+    def run(target):
+        with target.connect() as conn:
+            return function(conn)
+    if len(targets) == 1:
+        return [(targets[0], run(engines[0]))]
+    return list(zip(targets, _executor().map(run, engines)))
+
+
+def fan_out_rows(statement):
+    """Rows of statement from every location, as [(location, rows), ...]"""
+    return fan_out(lambda conn: conn.execute(statement).all())
+
+
+def locate_expenses(ids):
+    """Map each existing expense id, archived or not, to the location that holds it"""
+    ids = list(ids)
+    found = {}
+    for location, existing in fan_out(lambda conn: archive.existing_ids(conn, ids)):
+        for expense_id in existing:
+            found[expense_id] = location
+    return found
+
+
+def use_expense(expense_id):
+    """Route this session to the location of one expense, for admins editing any user's data"""
+    use(locate_expenses([expense_id]).get(expense_id, current()))
+
+
+# Ids
+
+class IdAllocator:
+    """Globally unique ids for a sharded table, reserved in blocks on the primary.
+
+    One UPDATE on the primary hands a worker SHARD_ID_BLOCK_SIZE ids, so
+    inserts on different shards never collide and rows keep their id when
+    they are moved.
+    """
+
+    def __init__(self, name, table):
+        self.name = name
+        self.table = table
+        self.lock = threading.Lock()
+        self.pid = None
+        self.next_id = self.limit = 0
+
+    def take(self, number):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.next_id = self.limit = 0
+                self.pid = os.getpid()
+            ids = []
+            while len(ids) < number:
+                if self.next_id >= self.limit:
+                    self._reserve(max(current_app.config['SHARD_ID_BLOCK_SIZE'], number - len(ids)))
+                taken = min(self.limit - self.next_id, number - len(ids))
+                ids.extend(range(self.next_id, self.next_id + taken))
+                self.next_id += taken
+            return ids
+
+    def _reserve(self, size):
+        block = IdBlock.__table__
+        try:
+            with db.engine.begin() as conn:
+                reserved = conn.execute(
+                    update(block).where(block.c.name == self.name).values(next_id=block.c.next_id + size)
+                ).rowcount
+                if not reserved:
+                    # The first block starts above every id already in use anywhere
+                    highest = [rows[0][0] or 0 for _, rows in fan_out_rows(select(func.max(self.table.c.id)))]
+                    conn.execute(insert(block).values(name=self.name, next_id=max(highest) + 1 + size))
+                limit = conn.execute(select(block.c.next_id).where(block.c.name == self.name)).scalar()
+        except IntegrityError:
+            # Another worker created the row first
+            return self._reserve(size)
+        self.next_id, self.limit = limit - size, limit
+
+
+expense_ids = IdAllocator('expense', Expense.__table__)
+
+
+def assign_ids(rows):
+    """Give Core insert rows (dicts) their expense ids when sharded"""
+    if enabled():
+        for row, expense_id in zip(rows, expense_ids.take(len(rows))):
+            row['id'] = expense_id
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _assign_expense_ids(session, flush_context, instances):
+    if shard_bind(0) not in session._db.engines:
+        return
+    new = [obj for obj in session.new if isinstance(obj, Expense) and obj.id is None]
+    for obj, expense_id in zip(new, expense_ids.take(len(new))):
+        obj.id = expense_id
+
+
+# Setup
+
+def create_schema(target):
+    """Create the sharded tables and the search index on a shard.
+
+    Foreign keys are left out: users and categories live on the primary.
+    """
+    with target.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        for model in SHARDED_MODELS:
+            table = model.__table__
+            if table.name not in existing:
+                conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+                for index in table.indexes:
+                    index.create(conn)
+        search.install(conn)
+
+
+def request_location():
+    """The logged-in user's shard, looked up once per request.
+
+    Requests that never touch expense data (static files, health checks,
+    the login page) skip the directory lookup altogether.
+    """
+    if not has_request_context() or not current_user.is_authenticated:
+        raise ShardNotSelected('expense data is sharded; select a shard first (shards.use_user)')
+    if 'shard_location' not in g:
+        g.shard_location = home(current_user.id)
+    return g.shard_location
+
+
+def current():
+    """The location this session's expense statements go to"""
+    if SHARD not in db.session.info:
+        use(request_location())
+    return db.session.info[SHARD]
+
+
+def init_app(app):
+    """Route each request to its user's shard on first use (`flask init-shards` creates the shard tables)"""
+    if not app.config['SHARD_DATABASE_URLS']:
+        return
+    RoutingSession.resolve_shard = staticmethod(request_location)
+
+    @app.errorhandler(UserMoving)
+    def user_moving(e):
+        return 'Your expenses are being moved; please try again in a minute.', 503, {'Retry-After': '30'}
+
+
+# Rebalancing
+
+def user_counts():
+    """{location: {user_id: expense count}} for every location"""
+    statement = select(Expense.user_id, func.count()).group_by(Expense.user_id)
+    return {location: dict(rows) for location, rows in fan_out_rows(statement)}
+
+
+def directory():
+    with db.engine.connect() as conn:
+        return {row.user_id: row for row in conn.execute(select(UserShard))}
+
+
+def _delete_user_rows(location, user_id):
+    removed = 0
+    with engine(location).begin() as conn:
+        for table in [Expense.__table__] + archive.tables(conn):
+            removed += conn.execute(delete(table).where(table.c.user_id == user_id)).rowcount
+        for rollup in (DailyCategoryTotal.__table__, MonthlyCategoryTotal.__table__):
+            conn.execute(delete(rollup).where(rollup.c.user_id == user_id))
+    return removed
+
+
+def remove_leftovers():
+    """Delete rows that an interrupted move left where the directory no longer points"""
+    entries = directory()
+    removed = 0
+    for location, users in user_counts().items():
+        for user_id in users:
+            entry = entries.get(user_id)
+            if entry is not None and entry.moving_to is None and entry.shard != location:
+                removed += _delete_user_rows(location, user_id)
+    return removed
+
+
+def plan_moves(tolerance=0.1):
+    """Moves (user_id, source, target) that drain the primary and even out the shards.
+
+    Users still on the primary go to the lightest shard, largest first. Then,
+    while the heaviest and lightest shard differ by more than tolerance of
+    the mean, the user whose size best halves the gap moves between them.
+    Interrupted moves are resumed first.
+    """
+    entries = directory()
+    moves = [(user_id, entry.shard, entry.moving_to) for user_id, entry in entries.items()
+             if entry.moving_to is not None]
+    moving = {user_id for user_id, _, _ in moves}
+    counts = user_counts()
+    users = {shard: {} for shard in range(count())}
+    for location, by_user in counts.items():
+        for user_id, size in by_user.items():
+            entry = entries.get(user_id)
+            home = entry.shard if entry is not None else None
+            if location == home and location is not None and user_id not in moving:
+                users[location][user_id] = size
+    loads = {shard: sum(sizes.values()) for shard, sizes in users.items()}
+
+    on_primary = [(user_id, size) for user_id, size in counts.get(None, {}).items()
+                  if user_id not in moving and (entries.get(user_id) is None or entries[user_id].shard is None)]
+    for user_id, size in sorted(on_primary, key=lambda item: -item[1]):
+        target = min(loads, key=loads.get)
+        moves.append((user_id, None, target))
+        loads[target] += size
+
+    mean = sum(loads.values()) / len(loads)
+    while len(loads) > 1:
+        heavy, light = max(loads, key=loads.get), min(loads, key=loads.get)
+        gap = loads[heavy] - loads[light]
+        fits = [(size, user_id) for user_id, size in users[heavy].items() if size < gap]
+        if gap <= tolerance * mean or not fits:
+            break
+        size, user_id = min(fits, key=lambda fit: abs(gap / 2 - fit[0]))
+        moves.append((user_id, heavy, light))
+        del users[heavy][user_id]
+        loads[heavy] -= size
+        loads[light] += size
+    return moves
+
+
+def _copy_user(user_id, source, target):
+    """Copy a user's expenses, archived ones included, to target.
+
+    Ids already there from an earlier attempt are skipped.
+    """
+    copied = 0
+    with engine(source).connect() as source_conn, engine(target).begin() as target_conn:
+        archived = {row.year: row.archived_before for row in archive.catalog(source_conn)}
+        for year, table in [(None, Expense.__table__)] + [(year, archive.year_table(year)) for year in archived]:
+            if year is not None:
+                archive.ensure_year(target_conn, year, archived[year])
+            result = source_conn.execution_options(yield_per=COPY_BATCH_SIZE).execute(
+                select(table).where(table.c.user_id == user_id))
+            for partition in result.mappings().partitions():
+                ids = [row['id'] for row in partition]
+                existing = set(target_conn.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+                rows = [dict(row) for row in partition if row['id'] not in existing]
+                if rows:
+                    target_conn.execute(insert(table), rows)
+                copied += len(rows)
+    return copied
+
+
+def move_users(moves, drain_seconds, report=logger.info):
+    """Move users' expenses between locations.
+
+    Every user in moves is flagged first, so their requests get 503 instead
+    of writing to the old shard; after drain_seconds (requests that looked
+    the user up before the flag finish) each user is copied, their rollups
+    rebuilt on the target, the directory switched and the old rows deleted.
+    Safe to re-run after an interruption.
+    """
+    if not moves:
+        return
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        for user_id, source, target in moves:
+            flagged = conn.execute(update(UserShard).where(UserShard.user_id == user_id)
+                                   .values(moving_to=target, updated_at=now)).rowcount
+            if not flagged:
+                conn.execute(insert(UserShard).values(user_id=user_id, shard=source, moving_to=target, updated_at=now))
+    time.sleep(drain_seconds)
+
+    for user_id, source, target in moves:
+        copied = _copy_user(user_id, source, target)
+        with using(target):
+            rollups.rebuild(user_id)
+        with db.engine.begin() as conn:
+            conn.execute(update(UserShard).where(UserShard.user_id == user_id)
+                         .values(shard=target, moving_to=None, updated_at=datetime.utcnow()))
+        removed = _delete_user_rows(source, user_id)
+        report(f'user {user_id}: {"primary" if source is None else f"shard {source}"} -> shard {target} '
+               f'({copied} copied, {removed} removed)')
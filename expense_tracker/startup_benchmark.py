@@ -0,0 +1,143 @@
+"""Time app startup - importing app.py and serving the first request.
+
+    python startup_benchmark.py --output startup.json
+    python startup_benchmark.py --compare startup.json
+
+Every run is a fresh interpreter pointed at an empty SQLite database, the
+way a gunicorn worker or a script starts. Startup must not touch the
+database: the run fails when importing the app or the first request ran
+any SQL or created any table. --compare also fails when a median got
+slower than the baseline by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in the child: statements are counted on every engine from the start
+CHILD = """
+import json, time
+started = time.perf_counter()
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+from app import app
+imported = time.perf_counter()
+response = app.test_client().get('/login')
+served = time.perf_counter()
+queries = list(statements)
+with app.app_context():
+    from models import db
+    tables = inspect(db.engine).get_table_names()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': response.status_code,
+    'queries': queries,
+    'tables': tables,
+}))
+"""
+
+
+def run_once(workdir, number):
+    path = os.path.join(workdir, f'startup_{number}.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', LOG_LEVEL='WARNING')
+    env.pop('SHARD_DATABASE_URLS', None)
+    env.pop('REPLICA_DATABASE_URL', None)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=HERE, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def measure(repeat):
+    """Median startup timings over repeat fresh processes, and any side effects seen"""
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for number in range(repeat):
+            samples.append(run_once(workdir, number))
+    results = {}
+    for name in ('import_ms', 'first_request_ms', 'process_ms'):
+        timings = sorted(sample[name] for sample in samples)
+        results[name] = {
+            'median_ms': round(statistics.median(timings), 3),
+            'min_ms': round(timings[0], 3),
+            'max_ms': round(timings[-1], 3),
+        }
+        print(f'{name:18} {results[name]["median_ms"]:10.2f} ms', file=sys.stderr)
+    side_effects = {
+        'statuses': sorted({sample['status'] for sample in samples}),
+        'queries': sorted({query for sample in samples for query in sample['queries']}),
+        'tables': sorted({table for sample in samples for table in sample['tables']}),
+    }
+    return results, side_effects
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against baseline; returns the names that regressed"""
+    regressions = []
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else 1.0
+        flag = 'REGRESSED' if ratio > 1 + threshold else ''
+        print(f'{name:18} {old["median_ms"]:10.2f} -> {result["median_ms"]:10.2f} ms ({ratio:5.2f}x) {flag}',
+              file=sys.stderr)
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON file from an earlier run.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed median slowdown before --compare fails (default: 0.25).')
+    args = parser.parse_args()
+
+    results, side_effects = measure(args.repeat)
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'results': results,
+        'side_effects': side_effects,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    failed = False
+    if side_effects['statuses'] != [200]:
+        print(f'first request returned {side_effects["statuses"]}', file=sys.stderr)
+        failed = True
+    if side_effects['queries'] or side_effects['tables']:
+        print(f'startup touched the database: {len(side_effects["queries"])} statements, '
+              f'tables {side_effects["tables"]}', file=sys.stderr)
+        failed = True
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed = bool(compare(results, baseline, args.threshold)) or failed
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app's modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='expense-tracker-tests-'), 'test.db')
+os.environ['FLASK_CONFIG'] = 'testing'
+os.environ['TEST_DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ.pop('SHARD_DATABASE_URLS', None)
+os.environ.pop('REPLICA_DATABASE_URL', None)
+
+from app import app as flask_app  # noqa: E402
+from commands import init_database, seed_categories  # noqa: E402
+from models import db, User  # noqa: E402
+from passwords import login_limiter  # noqa: E402
+from user_cache import user_cache  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app on a fresh database with the default categories"""
+    with flask_app.app_context():
+        init_database()
+        seed_categories()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DATABASE + suffix):
+            os.remove(DATABASE + suffix)
+    user_cache.clear()
+    login_limiter.attempts.events.clear()
+    login_limiter.failures.events.clear()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username='alice', role='customer', password='secret123'):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com', role=role)
+            user.set_password(password)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def login(app):
+    """A test client logged in as username"""
+    def login(username, password='secret123'):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code == 302
+        return client
+    return login
@@ -0,0 +1,78 @@
+import random
+import statistics
+from collections import defaultdict
+from datetime import date, timedelta
+
+import archive
+import rollups
+from models import db, Expense
+
+
+def month_of(day):
+    return day.strftime('%Y-%m')
+
+
+def add(app, user_id, rows):
+    with app.app_context():
+        for day, category, cents in rows:
+            expense = Expense(user_id=user_id, amount_cents=cents, category=category, date=day, description=category)
+            db.session.add(expense)
+            rollups.record_added(expense)
+        db.session.commit()
+
+
+def test_analytics_match_the_raw_expenses(app, make_user, login):
+    alice, bob = make_user(), make_user('bob')
+    today = date.today()
+    pick = random.Random(7)
+    rows = [(today - timedelta(days=pick.randrange(500)), pick.choice(['Travel', 'Shopping', 'Healthcare']),
+             pick.randrange(100, 5000)) for _ in range(300)]
+    outlier = (today, 'Travel', 900000)
+    add(app, alice, rows + [outlier])
+    add(app, bob, [(today, 'Travel', 123456)])
+    with app.app_context():
+        assert archive.archive_before(today - timedelta(days=365), 1000) > 0
+
+    data = login('alice').get('/api/analytics?months=3').get_json()
+
+    rows.append(outlier)
+    start = date.fromisoformat(data['from'])
+    in_range = [row for row in rows if start <= row[0] <= today]
+    assert data['expense_count'] == len(in_range)
+
+    totals, shares = defaultdict(int), defaultdict(lambda: defaultdict(int))
+    for day, category, cents in rows:
+        totals[month_of(day)] += cents
+        shares[month_of(day)][category] += cents
+    previous = month_of(start - timedelta(days=1))
+    for month in data['monthly']:
+        assert month['total'] == totals[month['month']] / 100
+        assert month['change'] == round((totals[month['month']] - totals[previous]) / 100, 2)
+        assert month['category_share'] == {
+            category: round(cents / totals[month['month']], 4) for category, cents in shares[month['month']].items()}
+        previous = month['month']
+
+    last_30 = sum(cents for day, _, cents in rows if today - timedelta(days=29) <= day <= today)
+    assert data['rolling_average'][-1] == {'date': today.isoformat(), 'average': round(last_30 / 30 / 100, 2)}
+    assert data['percentiles']['p50'] == round(statistics.median(cents for _, _, cents in in_range) / 100, 2)
+    assert [(anomaly['category'], anomaly['amount']) for anomaly in data['anomalies']] == [('Travel', 9000.0)]
+
+
+def test_analytics_follow_expense_writes(app, make_user, login):
+    make_user()
+    client = login('alice')
+
+    def total():
+        return client.get('/api/analytics?months=1').get_json()['monthly'][-1]['total']
+
+    assert total() == 0
+    client.post('/add_expense', data={'amount': '12.50', 'category': 'Travel',
+                                      'date': date.today().isoformat(), 'description': 'Train'})
+    assert total() == 12.5
+
+    with app.app_context():
+        expense_id = Expense.query.one().id
+    client.patch('/api/expenses', json=[{'id': expense_id, 'amount': '20'}])
+    assert total() == 20
+    client.delete('/api/expenses', json=[{'id': expense_id}])
+    assert total() == 0
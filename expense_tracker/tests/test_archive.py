@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+import archive
+from models import db, Expense
+from test_search import add_expenses
+
+
+def test_new_expenses_never_take_archived_ids(app, make_user, login):
+    user_id = make_user()
+    today = date.today()
+    old = today - timedelta(days=800)
+    add_expenses(app, user_id, [(old, 'old0'), (old, 'old1'), (today, 'recent')])
+    with app.app_context():
+        assert archive.archive_before(today - timedelta(days=365), 100) == 2
+        recent = Expense.query.filter_by(description='recent').one().id
+
+    client = login('alice')
+    client.post(f'/delete_expense/{recent}')
+    client.post('/add_expense', data={'amount': '5', 'category': 'Shopping', 'date': today.isoformat(),
+                                      'description': 'new'})
+
+    with app.app_context():
+        new = Expense.query.filter_by(description='new').one().id
+        assert new > recent
+        assert archive.restore([1, 2]) == 2
+        db.session.commit()
+        assert sorted(expense.description for expense in Expense.query) == ['new', 'old0', 'old1']
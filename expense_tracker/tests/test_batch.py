@@ -0,0 +1,54 @@
+from models import Expense
+
+
+def item(**fields):
+    return dict({'amount': '12.50', 'category': 'Shopping', 'date': '2026-01-02'}, **fields)
+
+
+def test_batch_uses_the_expense_form_rules(app, make_user, login):
+    make_user()
+    response = login('alice').post('/api/expenses', json=[
+        item(description='Lunch'),
+        item(amount='0'),
+        item(category='Nope'),
+        item(date='02/01/2026'),
+        item(description='x' * 201),
+    ])
+
+    results = response.get_json()['results']
+    assert response.status_code == 207
+    assert results[0]['status'] == 'created'
+    assert results[0]['expense']['amount'] == 12.5
+    assert [result['errors'] for result in results[1:]] == [
+        {'amount': 'Amount is required'},
+        {'category': 'Not a valid choice.'},
+        {'date': 'Not a valid date value.'},
+        {'description': 'Description must be less than 200 characters'},
+    ]
+
+
+def test_admin_batch_rejects_unknown_users(app, make_user, login):
+    alice = make_user()
+    make_user('root', role='admin')
+    response = login('root').post('/api/expenses', json=[item(user_id=alice), item(user_id=alice + 100)])
+
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['created', 'error']
+    assert results[1]['errors'] == {'user_id': 'User not found.'}
+    with app.app_context():
+        assert [expense.user_id for expense in Expense.query] == [alice]
+
+
+def test_batch_rejects_non_integer_ids(app, make_user, login):
+    make_user()
+    client = login('alice')
+    created = client.post('/api/expenses', json=[item()]).get_json()['results'][0]['id']
+
+    for method in (client.patch, client.delete):
+        response = method('/api/expenses', json=[{'id': [created], 'amount': '1'}, {'id': '1'}, {'id': True}])
+        assert response.status_code == 207
+        assert [result['errors'] for result in response.get_json()['results']] == [
+            {'id': 'Expected an integer id.'}] * 3
+
+    response = client.patch('/api/expenses', json=[{'id': created, 'amount': '3'}])
+    assert response.get_json()['results'][0]['expense']['amount'] == 3.0
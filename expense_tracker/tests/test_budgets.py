@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+
+def add(client, amount, day=None):
+    response = client.post('/add_expense', follow_redirects=True, data={
+        'amount': amount, 'category': 'Travel', 'date': (day or date.today()).isoformat(), 'description': 'Train'})
+    assert b'Expense added successfully!' in response.data
+    return response.data
+
+
+def bar(client):
+    page = client.get('/budgets').data
+    return next(state for state in ('bg-danger', 'bg-warning', 'bg-success') if state.encode() in page)
+
+
+def test_budget_warns_near_and_past_its_limit(app, make_user, login):
+    make_user()
+    client = login('alice')
+    client.post('/budgets', data={'category': 'Travel', 'limit': '20.00'})
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+
+    # Each month is checked against the budget on its own
+    page = add(client, '100.00', last_month)
+    assert f'Travel is at $100.00 of its $20.00 budget for {last_month:%B %Y}'.encode() in page
+
+    assert b'Over budget' not in add(client, '15.00')
+    assert bar(client) == 'bg-success'
+    assert b'Over budget' not in add(client, '1.00')
+    assert bar(client) == 'bg-warning'
+    # Reaching the limit exactly is still within budget
+    assert b'Over budget' not in add(client, '4.00')
+    assert b'Over budget: Travel is at $20.01 of its $20.00 budget' in add(client, '0.01')
+    assert bar(client) == 'bg-danger'
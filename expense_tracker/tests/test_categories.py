@@ -0,0 +1,54 @@
+from datetime import date
+
+import jobs
+from category_cache import CATEGORIES_VERSION
+from models import db, Category
+from versions import bump_version
+
+
+def offered(client):
+    page = client.get('/add_expense').data
+    return {name for name in ('Pets', 'Animals', 'Travel') if f'<option value="{name}"'.encode() in page}
+
+
+def add(client, category):
+    return client.post('/add_expense', data={'amount': '3', 'category': category,
+                                             'date': date.today().isoformat(), 'description': 'Food'})
+
+
+def test_category_changes_reach_the_forms(app, make_user, login):
+    make_user()
+    make_user('root', role='admin')
+    client, admin = login('alice'), login('root')
+    assert offered(client) == {'Travel'}
+
+    admin.post('/categories/add', data={'name': 'Pets', 'color': '#123456'})
+    assert offered(client) == {'Travel', 'Pets'}
+    assert add(client, 'Pets').status_code == 302
+
+    with app.app_context():
+        pets = Category.query.filter_by(name='Pets').one().id
+    admin.post('/categories/edit', data={'category_id': pets, 'name': 'Animals', 'color': '#654321'})
+    assert offered(client) == {'Travel', 'Animals'}
+
+    # Not offered from the moment the delete is queued, before the job runs
+    admin.post(f'/categories/delete/{pets}')
+    assert offered(client) == {'Travel'}
+    assert add(client, 'Animals').status_code == 200
+    jobs.run_worker(app, concurrency=1, poll_interval=0.01, once=True)
+    with app.app_context():
+        assert db.session.get(Category, pets) is None
+    assert offered(client) == {'Travel'}
+
+
+def test_changes_from_other_workers_are_picked_up(app, make_user, login):
+    make_user()
+    client = login('alice')
+    assert offered(client) == {'Travel'}
+
+    # What another worker's add_category commits; this worker's cache object is untouched
+    with app.app_context():
+        db.session.add(Category(name='Pets', color='#123456'))
+        bump_version(CATEGORIES_VERSION)
+        db.session.commit()
+    assert offered(client) == {'Travel', 'Pets'}
@@ -0,0 +1,80 @@
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+import conditional
+from models import db, CacheVersion
+from versions import user_data_version
+
+
+def add(client, amount):
+    return client.post('/add_expense', data={'amount': amount, 'category': 'Travel',
+                                             'date': date.today().isoformat(), 'description': 'Train'})
+
+
+def test_unchanged_pages_are_not_modified(app, make_user, login):
+    make_user()
+    client = login('alice')
+    first = client.get('/api/dashboard')
+    etag = first.headers['ETag']
+
+    repeat = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert (repeat.status_code, repeat.data, repeat.headers['ETag']) == (304, b'', etag)
+
+    # A stale ETag wins over an If-Modified-Since that would still match
+    future = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    stale = client.get('/api/dashboard', headers={'If-None-Match': '"stale"', 'If-Modified-Since': future})
+    assert stale.status_code == 200
+    assert client.get('/api/dashboard', headers={'If-Modified-Since': future}).status_code == 304
+
+
+def test_writes_invalidate_the_page(app, make_user, login):
+    make_user()
+    client = login('alice')
+    etag = client.get('/api/dashboard').headers['ETag']
+
+    add(client, '12.50')
+    client.get('/')  # shows the flash from the redirect
+
+    response = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['monthly_total'] == 12.5
+
+
+def test_pending_flashes_bypass_the_check(app, make_user, login):
+    make_user()
+    client = login('alice')
+    etag = client.get('/').headers['ETag']
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Budget saved')]
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Budget saved' in response.data
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_last_modified_waits_for_its_second_to_end(app, make_user, login, monkeypatch):
+    user_id = make_user()
+    client = login('alice')
+    written = datetime.utcnow().replace(microsecond=200000) - timedelta(seconds=5)
+    with app.app_context():
+        db.session.add(CacheVersion(name=user_data_version(user_id), version=1))
+        db.session.execute(update(CacheVersion).values(updated_at=written))
+        db.session.commit()
+
+    def at(moment):
+        class Clock(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return moment.replace(tzinfo=timezone.utc).astimezone(tz)
+        monkeypatch.setattr(conditional, 'datetime', Clock)
+
+    # Another write could still happen in this second without changing the header
+    at(written + timedelta(milliseconds=500))
+    assert 'Last-Modified' not in client.get('/api/dashboard').headers
+
+    at(written + timedelta(seconds=1))
+    last_modified = client.get('/api/dashboard').headers['Last-Modified']
+    assert last_modified == written.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    assert client.get('/api/dashboard', headers={'If-Modified-Since': last_modified}).status_code == 304
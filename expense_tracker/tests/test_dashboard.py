@@ -0,0 +1,20 @@
+from datetime import date
+
+from models import db, Expense
+import rollups
+
+
+def test_dashboard_embeds_chart_data(app, make_user, login):
+    user_id = make_user()
+    with app.app_context():
+        expense = Expense(user_id=user_id, amount=12.5, category='Travel', date=date.today(), description='Train')
+        db.session.add(expense)
+        rollups.record_added(expense)
+        db.session.commit()
+
+    response = login('alice').get('/')
+
+    assert response.status_code == 200
+    assert b'"category": "Travel"' in response.data
+    # The charts render from the page, not from a second request
+    assert b'/api/dashboard' not in response.data
@@ -0,0 +1,73 @@
+import io
+
+import importer
+from models import Expense
+
+
+def import_csv(app, user_id, text, signs='bank'):
+    with app.app_context():
+        report = importer.import_expenses(
+            importer.iter_csv_rows(io.BytesIO(text.encode()), signs), user_id, ['Other', 'Travel'], 'Other')
+        expenses = sorted((expense.description, expense.amount_cents) for expense in Expense.query)
+        return report, expenses
+
+
+def test_csv_credits_are_skipped(app, make_user):
+    report, expenses = import_csv(app, make_user(), (
+        'Date,Amount,Description\n'
+        '2026-01-02,-45.10,Groceries\n'
+        '2026-01-03,+2000.00,Salary\n'
+        '2026-01-04,(12.00),Cinema\n'
+        '2026-01-05,20.00,Refund\n'
+    ))
+
+    assert expenses == [('Cinema', 1200), ('Groceries', 4510)]
+    assert (report.rows_read, report.rows_imported, report.credits_skipped) == (4, 2, 2)
+
+
+def test_csv_expense_list_signs(app, make_user):
+    report, expenses = import_csv(app, make_user(), (
+        'date,amount,category,description\n'
+        '2026-01-02,45.10,Travel,Train\n'
+        '2026-01-03,-2000.00,Other,Refund\n'
+    ), signs='expenses')
+
+    assert expenses == [('Train', 4510)]
+    assert report.credits_skipped == 1
+
+
+def test_csv_debit_and_credit_columns(app, make_user):
+    report, expenses = import_csv(app, make_user(), (
+        'Posted Date,Payee,Debit,Credit\n'
+        '01/02/2026,Groceries,45.10,\n'
+        '01/03/2026,Salary,,2000.00\n'
+    ))
+
+    assert expenses == [('Groceries', 4510)]
+    assert report.credits_skipped == 1
+
+
+def test_ofx_credits_are_skipped(app, make_user):
+    ofx = ('<OFX><BANKTRANLIST>'
+           '<STMTTRN><TRNAMT>-9.99<DTPOSTED>20260102<NAME>Music</STMTTRN>'
+           '<STMTTRN><TRNAMT>2000.00<DTPOSTED>20260103<NAME>Salary</STMTTRN>'
+           '</BANKTRANLIST></OFX>')
+    with app.app_context():
+        report = importer.import_expenses(
+            importer.iter_ofx_rows(io.BytesIO(ofx.encode())), make_user(), ['Other'], 'Other')
+        assert [expense.description for expense in Expense.query] == ['Music']
+    assert report.credits_skipped == 1
+
+
+def test_csv_invalid_amounts_are_errors_not_credits(app, make_user):
+    report, expenses = import_csv(app, make_user(), (
+        'Date,Amount,Description\n'
+        '2026-01-02,-45.10,Groceries\n'
+        '2026-01-03,abc,Junk\n'
+        '2026-01-04,2000.00,Salary\n'
+        '2026-01-05,,Blank\n'
+    ))
+
+    assert expenses == [('Groceries', 4510)]
+    assert (report.rows_imported, report.credits_skipped) == (1, 1)
+    assert report.errors == [(3, 'amount: Not a valid decimal value.'), (5, 'amount: Amount is required')]
@@ -0,0 +1,36 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from commands import explain, hot_queries, plan_problems
+from models import Expense
+from pagination import keyset_query
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        problems = {name: plan_problems(explain(statement), expected)
+                    for name, statement, expected in hot_queries()}
+    assert {name: lines for name, lines in problems.items() if lines} == {}
+
+
+def test_table_scans_are_reported(app):
+    with app.app_context():
+        plan = explain(select(Expense).where(Expense.description == 'Lunch').order_by(Expense.amount_cents))
+    assert [line.split()[0] for line in plan_problems(plan)] == ['SCAN', 'USE']
+
+
+def test_check_indexes_command(app):
+    result = app.test_cli_runner().invoke(args=['check-indexes'])
+    assert result.exit_code == 0, result.output
+    assert '[ok] expense search' in result.output
+
+
+def test_cursor_pages_seek_to_the_cursor(app):
+    """Deeper pages must start the index range at the cursor, not at the user's first row"""
+    position = (date(2026, 1, 31), 1000)
+    with app.app_context():
+        for seek, bound in (({'after': position}, 'date<'), ({'before': position}, 'date>')):
+            query = keyset_query(Expense.query.filter(Expense.user_id == 1), **seek).limit(21)
+            plan = ' '.join(explain(query.statement))
+            assert f'(user_id=? AND {bound}?)' in plan, plan
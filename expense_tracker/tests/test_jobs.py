@@ -0,0 +1,130 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import archive
+import jobs
+import rollups
+from models import db, Category, DailyCategoryTotal, Expense, Job, MonthlyCategoryTotal
+
+
+@pytest.fixture
+def results(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_RESULTS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def add(app, user_id, rows):
+    with app.app_context():
+        for day, category, cents in rows:
+            expense = Expense(user_id=user_id, amount_cents=cents, category=category, date=day, description=category)
+            db.session.add(expense)
+            rollups.record_added(expense)
+        db.session.commit()
+
+
+def enqueue(app, kind, owner_id, **params):
+    with app.app_context():
+        return jobs.enqueue(kind, owner_id, **params).id
+
+
+def job_row(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        db.session.expunge(job)
+        return job
+
+
+def rollup_rows():
+    return {
+        model.__tablename__: sorted(
+            (row.user_id, str(getattr(row, period)), row.category, row.total_cents, row.expense_count)
+            for row in model.query)
+        for model, period in ((DailyCategoryTotal, 'day'), (MonthlyCategoryTotal, 'month'))
+    }
+
+
+def test_jobs_are_claimed_once_in_order(app, make_user):
+    user_id = make_user()
+    first = enqueue(app, 'yearly-report', user_id)
+    second = enqueue(app, 'yearly-report', user_id)
+    with app.app_context():
+        assert [jobs.claim_next(), jobs.claim_next(), jobs.claim_next()] == [first, second, None]
+        assert jobs.pending_count(user_id) == 2
+    assert job_row(app, first).status == 'running'
+
+
+def test_stale_running_jobs_are_requeued(app, make_user):
+    job_id = enqueue(app, 'yearly-report', make_user())
+    with app.app_context():
+        jobs.claim_next()
+        db.session.get(Job, job_id).heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        assert jobs.requeue_stale(600) == 1
+        assert jobs.claim_next() == job_id
+
+
+def test_failed_jobs_record_the_error(app, make_user, monkeypatch):
+    def boom(job, params):
+        raise ValueError(f'bad input {params["n"]}')
+    monkeypatch.setitem(jobs.HANDLERS, 'boom', boom)
+    job_id = enqueue(app, 'boom', make_user(), n=3)
+
+    jobs.run_worker(app, concurrency=1, poll_interval=0.01, once=True)
+
+    job = job_row(app, job_id)
+    assert (job.status, job.message) == ('failed', 'bad input 3')
+    assert job.finished_at is not None
+
+
+def test_export_job_writes_its_result(app, make_user, login, results):
+    user_id = make_user()
+    add(app, user_id, [(date(2026, 1, 2), 'Travel', 1250), (date(2026, 1, 3), 'Shopping', 300)])
+    job_id = enqueue(app, 'export', user_id, format='csv', filters={}, user_id=user_id)
+
+    jobs.run_worker(app, concurrency=1, poll_interval=0.01, once=True)
+
+    job = job_row(app, job_id)
+    assert (job.status, job.progress, job.result_name) == ('done', 100, 'expenses.csv')
+    assert os.path.dirname(job.result_path) == str(results)
+    response = login('alice').get(f'/jobs/{job_id}/download')
+    lines = response.data.decode().splitlines()
+    assert response.status_code == 200
+    assert len(lines) == 3 and 'Travel,12.50' in lines[2]
+
+
+def test_result_files_of_equal_job_ids_do_not_collide(app, make_user, results):
+    job_id = enqueue(app, 'yearly-report', make_user())
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        assert jobs.result_file(job, 'report.csv') != jobs.result_file(job, 'report.csv')
+
+
+def test_delete_category_moves_every_expense_and_keeps_rollups_exact(app, make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_CHUNK_SIZE', 2)
+    alice, bob = make_user(), make_user('bob')
+    today = date.today()
+    old = today - timedelta(days=800)
+    add(app, alice, [(today, 'Travel', 100), (today, 'Travel', 200), (today, 'Shopping', 50),
+                     (today - timedelta(days=40), 'Travel', 400), (old, 'Travel', 800)])
+    add(app, bob, [(today, 'Travel', 1000), (today, 'Healthcare', 7)])
+    with app.app_context():
+        assert archive.archive_before(today - timedelta(days=365), 100) == 1
+        travel = Category.query.filter_by(name='Travel').one().id
+    job_id = enqueue(app, 'delete-category', alice, category_id=travel, name='Travel')
+
+    jobs.run_worker(app, concurrency=1, poll_interval=0.01, once=True)
+
+    assert job_row(app, job_id).status == 'done'
+    with app.app_context():
+        assert db.session.get(Category, travel) is None
+        assert Expense.query.filter_by(category='Travel').count() == 0
+        assert Expense.query.filter_by(category='Uncategorized').count() == 4
+        archived = archive.year_table(old.year)
+        assert db.session.execute(archived.select()).mappings().one()['category'] == 'Uncategorized'
+
+        after_job = rollup_rows()
+        rollups.rebuild()
+        assert after_job == rollup_rows()
+        assert not any('Travel' in row for rows in after_job.values() for row in rows)
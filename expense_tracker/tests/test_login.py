@@ -0,0 +1,16 @@
+def attempt(app, ip, username, password):
+    """The status of a login attempt from ip, with 'ok' for a successful one"""
+    response = app.test_client().post('/login', data={'username': username, 'password': password},
+                                      environ_base={'REMOTE_ADDR': ip})
+    if response.status_code == 302 and not response.location.endswith('/login'):
+        return 'ok'
+    return response.status_code
+
+
+def test_failed_logins_only_lock_out_the_guessing_client(app, make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_FAILURES_PER_USERNAME', 2)
+    make_user()
+    assert [attempt(app, '203.0.113.9', 'alice', 'wrong') for _ in range(3)] == [302, 302, 429]
+    assert attempt(app, '203.0.113.9', 'alice', 'secret123') == 429
+
+    assert attempt(app, '198.51.100.7', 'alice', 'secret123') == 'ok'
@@ -0,0 +1,28 @@
+from flask import g
+from sqlalchemy import text
+
+from models import db
+
+
+def test_failed_statements_do_not_skew_query_timings(app):
+    with app.test_request_context():
+        for _ in range(3):
+            try:
+                db.session.execute(text('SELECT * FROM no_such_table'))
+            except Exception:
+                db.session.rollback()
+        db.session.execute(text('SELECT 1'))
+        assert 'query_start' not in db.session.connection().info
+        assert g._sql_queries == 1
+
+
+def test_metrics_need_a_token_when_required(app, monkeypatch):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+
+    monkeypatch.setitem(app.config, 'METRICS_REQUIRE_TOKEN', True)
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+import archive
+import rollups
+from models import db, Expense
+
+
+def add_expenses(app, user_id, rows):
+    with app.app_context():
+        for day, description in rows:
+            expense = Expense(user_id=user_id, amount=10, category='Shopping', date=day, description=description)
+            db.session.add(expense)
+            rollups.record_added(expense)
+        db.session.commit()
+
+
+def test_search_finds_archived_expenses(app, make_user, login):
+    user_id = make_user()
+    today = date.today()
+    old = today - timedelta(days=800)
+    add_expenses(app, user_id, [
+        (old, 'Costco membership'),
+        (old + timedelta(days=1), 'Bakery'),
+        (today - timedelta(days=2), 'Costco groceries'),
+        (today, 'Costco fuel'),
+    ])
+    with app.app_context():
+        assert archive.archive_before(today - timedelta(days=365), 100) == 2
+
+    response = login('alice').get('/expenses?q=costco')
+
+    assert response.status_code == 200
+    for description in (b'Costco membership', b'Costco groceries', b'Costco fuel'):
+        assert description in response.data
+    assert b'Bakery' not in response.data
+
+
+def test_search_is_ranked_without_archived_years(app, make_user, login):
+    user_id = make_user()
+    today = date.today()
+    add_expenses(app, user_id, [(today, 'Costco fuel'), (today, 'Costco Costco bulk'), (today, 'Bakery')])
+
+    response = login('alice').get('/expenses?q=costco')
+
+    assert response.status_code == 200
+    assert b'Costco fuel' in response.data and b'Costco Costco bulk' in response.data
+    assert b'Bakery' not in response.data
@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+import pytest
+from flask_login import login_user
+from sqlalchemy import select
+
+import archive
+import rollups
+import shards
+from app import create_app
+from commands import init_database
+from config import TestingConfig
+from database import RoutingSession
+from models import db, DailyCategoryTotal, Expense, MonthlyCategoryTotal, User
+
+
+@pytest.fixture
+def sharded(app, tmp_path, monkeypatch):
+    """A second app on the test database with two expense shards"""
+    monkeypatch.setattr(TestingConfig, 'SHARD_DATABASE_URLS',
+                        [f'sqlite:///{tmp_path}/shard{number}.db' for number in range(2)])
+    # These are process-wide; don't let them leak into the unsharded app
+    monkeypatch.setattr(RoutingSession, 'resolve_shard', None)
+    monkeypatch.setattr(db, 'metadatas', dict(db.metadatas))
+    monkeypatch.setattr(shards, 'expense_ids', shards.IdAllocator('expense', Expense.__table__))
+    sharded_app = create_app('testing')
+    with sharded_app.app_context():
+        init_database()
+    yield sharded_app
+    with sharded_app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def add_as(app, user_id, rows):
+    """Add (day, category, cents) expenses the way a request by user_id does"""
+    with app.test_request_context():
+        login_user(db.session.get(User, user_id))
+        for day, category, cents in rows:
+            expense = Expense(user_id=user_id, amount_cents=cents, category=category, date=day, description=category)
+            db.session.add(expense)
+            rollups.record_added(expense)
+        db.session.commit()
+
+
+def contents(location):
+    """Rows of the sharded tables at location, archived expenses included"""
+    with shards.engine(location).connect() as conn:
+        expenses = [Expense.__table__] + archive.tables(conn)
+        return {
+            'expense': sorted((row.id, row.user_id, row.amount_cents)
+                              for table in expenses for row in conn.execute(select(table))),
+            'daily': sorted(conn.execute(select(DailyCategoryTotal.__table__)).all()),
+            'monthly': sorted(conn.execute(select(MonthlyCategoryTotal.__table__)).all()),
+        }
+
+
+def test_expenses_and_rollups_land_on_the_users_shard(sharded, make_user):
+    alice, bob = make_user(), make_user('bob')
+    today = date.today()
+    add_as(sharded, alice, [(today, 'Travel', 1200), (today, 'Shopping', 300)])
+    add_as(sharded, bob, [(today, 'Travel', 50)])
+
+    with sharded.app_context():
+        assert {user_id: entry.shard for user_id, entry in shards.directory().items()} == {
+            alice: alice % 2, bob: bob % 2}
+        primary = contents(None)
+        homes = {alice: contents(alice % 2), bob: contents(bob % 2)}
+
+    assert primary == {'expense': [], 'daily': [], 'monthly': []}
+    for user_id, location in homes.items():
+        assert {row[1] for row in location['expense']} == {user_id}
+        assert {row.user_id for row in location['daily'] + location['monthly']} == {user_id}
+    assert sum(row.total_cents for row in homes[alice]['monthly']) == 1500
+    assert len({row[0] for location in homes.values() for row in location['expense']}) == 3
+
+
+def test_moved_user_leaves_both_shards_consistent(sharded, make_user):
+    alice, bob = make_user(), make_user('bob')
+    today = date.today()
+    old = today - timedelta(days=800)
+    add_as(sharded, alice, [(today, 'Travel', 1200), (today, 'Travel', 300), (old, 'Shopping', 70)])
+    add_as(sharded, bob, [(today, 'Travel', 50), (old, 'Healthcare', 5)])
+    source, target = alice % 2, bob % 2
+
+    with sharded.app_context():
+        assert sum(archive.archive_before(today - timedelta(days=365), 100) for _ in shards.each()) == 2
+        before = contents(source)
+        shards.move_users([(alice, source, target)], drain_seconds=0, report=lambda message: None)
+
+        entry = shards.directory()[alice]
+        assert (entry.shard, entry.moving_to) == (target, None)
+        moved = {location: contents(location) for location in (source, target)}
+        for _ in shards.each():
+            rollups.rebuild()
+        rebuilt = {location: contents(location) for location in (source, target)}
+
+    assert moved == rebuilt
+    assert rebuilt[source] == {'expense': [], 'daily': [], 'monthly': []}
+    on_target = rebuilt[target]
+    assert [row for row in on_target['expense'] if row[1] == alice] == before['expense']
+    assert [row for row in on_target['daily'] if row.user_id == alice] == before['daily']
+    assert [row for row in on_target['monthly'] if row.user_id == alice] == before['monthly']
+    assert {row[1] for row in on_target['expense']} == {alice, bob}
@@ -0,0 +1,38 @@
+import time
+from types import SimpleNamespace
+
+import user_cache
+from models import db, User
+
+
+def test_admin_changes_apply_on_the_next_request(app, make_user, login):
+    alice = make_user()
+    make_user('root', role='admin')
+    client, admin = login('alice'), login('root')
+    assert client.get('/').status_code == 200
+
+    edited = admin.post(f'/admin/users/{alice}/edit', data={
+        'username': 'alice2', 'email': 'alice2@example.com', 'role': 'admin',
+        'password': 'changed1', 'password2': 'changed1'})
+    assert edited.status_code == 302
+    response = client.get('/')
+    assert response.status_code == 302 and response.location.endswith('/admin')
+
+    assert admin.post(f'/admin/users/{alice}/delete').status_code == 302
+    response = client.get('/')
+    assert response.status_code == 302 and '/login' in response.location
+
+
+def test_changes_from_other_workers_apply_within_the_ttl(app, make_user, login, monkeypatch):
+    alice = make_user()
+    client = login('alice')
+    assert client.get('/').status_code == 200
+    # Another worker's change doesn't invalidate this worker's entry
+    with app.app_context():
+        db.session.get(User, alice).role = 'admin'
+        db.session.commit()
+    assert client.get('/').status_code == 200
+
+    later = time.monotonic() + app.config['USER_CACHE_TTL'] + 1
+    monkeypatch.setattr(user_cache, 'time', SimpleNamespace(monotonic=lambda: later))
+    assert client.get('/').location.endswith('/admin')
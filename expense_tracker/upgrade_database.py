@@ -1,13 +1,24 @@
 from app import create_app
 from models import db
+from commands import init_migrations
+from flask_migrate import upgrade
 
 def upgrade_database():
     app = create_app()
+    init_migrations(app)
     with app.app_context():
-        # Add role column to user table
-        with db.engine.connect() as conn:
-            conn.execute(db.text('ALTER TABLE user ADD COLUMN role VARCHAR(20) DEFAULT "customer"'))
-            conn.commit()
+        inspector = db.inspect(db.engine)
+        tables = inspector.get_table_names()
+        if 'alembic_version' not in tables and 'user' in tables:
+            # Databases from before the role column existed; the initial
+            # migration adopts tables created by db.create_all() as they are
+            if 'role' not in {column['name'] for column in inspector.get_columns('user')}:
+                with db.engine.connect() as conn:
+                    conn.execute(db.text("ALTER TABLE user ADD COLUMN role VARCHAR(20) DEFAULT 'customer'"))
+                    conn.commit()
+        
+        # Apply every migration in migrations/versions
+        upgrade()
         print("Database upgraded successfully!")
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from models import db, User
+
+
+class CachedUser(UserMixin):
+    """Read-only identity snapshot used as current_user.
+
+    Holds what request handling needs (id, username, email, role) so the
+    user table is not queried on every authenticated request. Code that
+    changes a user must load the real User row.
+    """
+
+    def __init__(self, id, username, email, role, created_at=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.role, user.created_at)
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class UserCache:
+    """Per-worker LRU of identity snapshots with a time-to-live.
+
+    Changes made in this worker invalidate the entry immediately; other
+    workers pick them up when their entry expires, so a role change or
+    deletion takes effect everywhere within ttl seconds.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def configure(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clear()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, snapshot = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    return snapshot
+                del self._entries[user_id]
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = CachedUser.from_user(user)
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
@@ -0,0 +1,40 @@
+from datetime import datetime
+from sqlalchemy import select, update
+from models import db, CacheVersion
+
+# Bumped by maintenance that rewrites many users' data at once (rollup rebuilds)
+DATA_EPOCH = 'data'
+
+
+def user_data_version(user_id):
+    """Name of the counter bumped whenever one user's expenses change"""
+    return f'expenses:{user_id}'
+
+
+def get_version(name):
+    """Current value of a version counter (0 if it has never been bumped)"""
+    version = db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar()
+    return version or 0
+
+
+def get_versions(names):
+    """Map each name to its (version, updated_at), in a single query"""
+    rows = db.session.execute(
+        select(CacheVersion.name, CacheVersion.version, CacheVersion.updated_at)
+        .where(CacheVersion.name.in_(names))
+    )
+    found = {name: (version, updated_at) for name, version, updated_at in rows}
+    return {name: found.get(name, (0, None)) for name in names}
+
+
+def bump_version(name):
+    """Increment a version counter inside the caller's transaction"""
+    result = db.session.execute(
+        update(CacheVersion)
+        .where(CacheVersion.name == name)
+        .values(version=CacheVersion.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.session.add(CacheVersion(name=name, version=1, updated_at=datetime.utcnow()))